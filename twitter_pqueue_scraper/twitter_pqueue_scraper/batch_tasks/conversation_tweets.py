@@ -1,22 +1,39 @@
+from twitter_pqueue_scraper.batch_tasks.util import fetch_concurrently, get_fan_out_limit
 from twitter_pqueue_scraper.ingestion.create_deferred_models_v2 import create_deferred_models__conversation
-from twitter_pqueue_scraper.ingestion.ingest_deferred_models import ingest_deferred_models
-from twitter_pqueue_scraper.scrapers.twitter_api_v2.conversation_tweets import get_conversation_tweets
+from twitter_pqueue_scraper.ingestion.ingest_deferred_models import IngestBatcher
+from twitter_pqueue_scraper.scrapers.twitter_api_v2.conversation_tweets import (
+    DEFAULT_CONVERSATION_PAGES, iter_conversation_tweets_pages
+)
 
 
-async def scrape_conversation_tweets(worker, global_ctx, conversation_item_batch):
+CONVERSATION_TWEETS_URL = 'https://api.twitter.com/2/tweets/search/recent'
 
-    db_session, Base = worker.db_connection
 
-    def_objects = []
-    for item in conversation_item_batch:
-        reply_tweets, tweets_included, users, errors, status_code = await get_conversation_tweets(
-            worker.twitter_session, item.conversation_id
-        )
-        _def_objects = create_deferred_models__conversation(
+async def _scrape_and_ingest(worker, batcher, item):
+    """ ingests each page as it arrives, so the page's checkpoint is only saved once it's stored """
+    async for page in iter_conversation_tweets_pages(worker.twitter_session, item.conversation_id):
+        reply_tweets, tweets_included, users, errors, _, status_code = page
+        if not reply_tweets:
+            continue
+        def_objects = create_deferred_models__conversation(
             item.conversation_id, reply_tweets, tweets_included, users, errors
         )
-        def_objects.extend(_def_objects)
+        await batcher.ingest(def_objects)
+
+
+async def scrape_conversation_tweets(worker, global_ctx, conversation_item_batch):
+
+    db_session, Base = worker.db_connection
+
+    batcher = IngestBatcher(worker)
+
+    async def _fetch(item):
+        await _scrape_and_ingest(worker, batcher, item)
 
-    await ingest_deferred_models(worker, def_objects)
+    fan_out_limit = get_fan_out_limit(
+        worker.twitter_session, CONVERSATION_TWEETS_URL, DEFAULT_CONVERSATION_PAGES, app_auth=True
+    )
+    await fetch_concurrently(_fetch, conversation_item_batch, fan_out_limit)
 
-    await db_session.commit_async()
+    async with worker.db_lock:
+        await db_session.commit_async()
@@ -23,7 +23,6 @@ get rid of these cases first:
                 -
         - item.screen_name is set  (but not user_id)
 '''
-import json
 import os
 
 import trio
@@ -31,8 +30,10 @@ import trio
 from twitter_pqueue_scraper.batch_tasks.user_info__profile_index import ProfileIndex
 from twitter_pqueue_scraper.batch_tasks.util import get_mentions_from_string
 from twitter_pqueue_scraper.scrapers.twitter_api_v1.user_info import get_user_info__chunk
-from twitter_pqueue_scraper.util.db_util import create_sqlalchemy_session, get_or_create_by_multiple_keys
+from twitter_pqueue_scraper.util.bulk_ingest import bulk_get_or_create_by_multiple_keys
+from twitter_pqueue_scraper.util.db_util import create_sqlalchemy_session
 from twitter_pqueue_scraper.util.items import TwitterProfileWorkItem
+from twitter_pqueue_scraper.util.json_util import dumps as json_dumps, loads as json_loads
 from util_shared.datetime_utils import get_utc_now
 
 
@@ -125,7 +126,7 @@ def _set_profile_fields(profile, ui_dict, status_code):
     if ui_dict:
         profile.user_id = ui_dict['id_str']
         profile.screen_name = ui_dict['screen_name'].lower()
-        profile.user_info =  json.dumps(ui_dict)
+        profile.user_info =  json_dumps(ui_dict)
         profile.user_info_prev_scrape_success = get_utc_now()
         profile.is_available = not ui_dict['protected']
     else:
@@ -183,6 +184,13 @@ async def _resolve_potential_duplicates(worker, profile_index, potential_duplica
             print("error: profile-merge request failed")
 
 
+def _fetch_profiles(worker, obj_ids):
+    db_session, Base = worker.db_connection
+    TwitterProfile = Base.classes.twitter_twitterprofile
+    profiles = db_session.query(TwitterProfile).filter(TwitterProfile.id.in_(obj_ids)).all()
+    return {obj.id: obj for obj in profiles}
+
+
 async def _create_missing(worker, profile_index, to_create):
 
     if not to_create:
@@ -190,10 +198,35 @@ async def _create_missing(worker, profile_index, to_create):
 
     db_session, Base = worker.db_connection
     TwitterProfile = Base.classes.twitter_twitterprofile
+    id_index = worker.identity_cache.shared
+
+    # note: user_id is unique, so user ids are claimed before their profiles are created,
+    # otherwise another actor creating the same profile would fail the whole commit
+    user_ids = [key for key in to_create if key.isdigit()]
+    indexed_ids, claimed, claimed_elsewhere = await id_index.claim('profile', user_ids)
+    for user_id in claimed_elsewhere:
+        print(f"note: profile {user_id} is being created by another actor, skipped")
+
+    # profiles created (by any actor) since the profile index was built are updated instead
+    existing = {}
+    if indexed_ids:
+        existing = await trio.to_thread.run_sync(
+            _fetch_profiles, worker, list(indexed_ids.values())
+        )
 
-    new_profiles = []
+    new_profiles, is_dirty = [], False
     for userid_or_sn, (item, ui_dict, status_code) in to_create.items():
 
+        if userid_or_sn in claimed_elsewhere:
+            continue
+
+        existing_profile = existing.get(indexed_ids.get(userid_or_sn))
+        if existing_profile:
+            _set_profile_fields(existing_profile, ui_dict, status_code)
+            profile_index.add_profile(existing_profile)
+            is_dirty = True
+            continue
+
         if ui_dict:
             user_id = userid_or_sn  # this is always the user_id when ui_dict is not None
             profile = TwitterProfile(user_id=user_id)
@@ -206,11 +239,20 @@ async def _create_missing(worker, profile_index, to_create):
 
         new_profiles.append(profile)
 
-    if new_profiles:
-        await db_session.add_and_commit(new_profiles)
+    if new_profiles or is_dirty:
+        try:
+            await db_session.add_and_commit(new_profiles)
+        except Exception:
+            await id_index.release('profile', claimed)
+            raise
         for new_obj in new_profiles:
             profile_index.add_profile(new_obj)
 
+    # note: publishing a profile's id releases its claim
+    await worker.identity_cache.publish('profile', {
+        obj.user_id: obj.id for obj in new_profiles if obj.user_id
+    })
+
 
 async def _ingest_profile_description_mentions(worker, profile_batch, profile_index, failed_requests):
 
@@ -239,7 +281,7 @@ async def _ingest_profile_description_mentions(worker, profile_batch, profile_in
             continue
 
         try:
-            user_info = json.loads(profile.user_info)
+            user_info = json_loads(profile.user_info)
         except:
             import pdb; pdb.set_trace()
         for screen_name in get_mentions_from_string(user_info['description']):
@@ -255,7 +297,7 @@ async def _ingest_profile_description_mentions(worker, profile_batch, profile_in
                 })
 
     if mention_rels:
-        await get_or_create_by_multiple_keys(
+        await bulk_get_or_create_by_multiple_keys(
             db_session, ProfileMentionedInProfileDescription, mention_rels
         )
 
@@ -1,11 +1,14 @@
 import trio
 
 from util_shared.datetime_utils import get_utc_now
+from twitter_pqueue_scraper.batch_tasks.util import fetch_concurrently, get_fan_out_limit
+from twitter_pqueue_scraper.ingestion.ingest_deferred_models import IngestBatcher
 from twitter_pqueue_scraper.ingestion.user_likes import ingest_user_likes
-from twitter_pqueue_scraper.scrapers.twitter_api_v1.user_likes import get_user_likes
+from twitter_pqueue_scraper.scrapers.twitter_api_v1.user_likes import iter_user_likes_pages
 
 
 DEFAULT_USER_LIKES_PAGES = 4
+USER_LIKES_URL = 'https://api.twitter.com/1.1/favorites/list.json'
 
 
 def _fetch_profiles(worker, obj_ids):
@@ -15,6 +18,44 @@ def _fetch_profiles(worker, obj_ids):
     return {obj.id: obj for obj in profiles}
 
 
+def _get_newer_id(id_a, id_b):
+    """ the newer of two like ids (id strings or None) """
+    if not id_a or not id_b:
+        return id_a or id_b
+    return id_a if int(id_a) >= int(id_b) else id_b
+
+
+def _get_scrape_state(item, profile):
+    """
+    (since_id, checkpoint_min_saved_at), same as user_timeline: the newer of the item's
+    and the profile's since_id, checkpoints older than the last successful scrape aren't resumed
+    """
+    since_id = _get_newer_id(item.since_id, profile.user_likes_since_id)
+    prev_success = profile.user_likes_prev_scrape_success
+    return since_id, prev_success.timestamp() if prev_success else None
+
+
+async def _scrape_and_ingest(worker, batcher, item, since_id, checkpoint_min_saved_at):
+    """ ingests each page as it arrives, returns (success, newest_like_id) """
+    num_pages = 1 if since_id else DEFAULT_USER_LIKES_PAGES
+    newest_like_id, success = None, True
+
+    # note: the generator is always run to completion, so it can save/clear its checkpoint
+    async for success, likes in iter_user_likes_pages(
+        worker.twitter_session, item.user_id, num_pages, since_id=since_id,
+        checkpoint_min_saved_at=checkpoint_min_saved_at
+    ):
+        if not success:
+            continue
+        # note: pages are newest first, but a resumed scrape starts from an older page
+        for like in likes:
+            newest_like_id = _get_newer_id(newest_like_id, like['id_str'])
+
+        await ingest_user_likes(batcher, item.user_id, likes)
+
+    return success, newest_like_id
+
+
 # todo: add support for 'since_id'  (also rename since_id)
 async def scrape_user_likes(worker, global_ctx, profile_batch):
 
@@ -22,35 +63,41 @@ async def scrape_user_likes(worker, global_ctx, profile_batch):
     db_session, Base = worker.db_connection
 
     obj_ids = [item.obj_id for item in profile_batch if item.obj_id is not None]
-    profiles_by_id = await trio.to_thread.run_sync(
-        _fetch_profiles, worker, obj_ids
-    )
-
-    user_likes_by_id = {}
+    async with worker.db_lock:
+        profiles_by_id = await trio.to_thread.run_sync(
+            _fetch_profiles, worker, obj_ids
+        )
 
+    to_fetch = []  # (item, since_id, checkpoint_min_saved_at)
     for item in profile_batch:
-
-        profile = profiles_by_id.get(item.obj_id)
-        if profile is None:
+        if item.obj_id not in profiles_by_id:
             print(f'error: profile not found: {item.obj_id}')
             continue
+        to_fetch.append((item,) + _get_scrape_state(item, profiles_by_id[item.obj_id]))
 
-        num_pages = 1 if item.since_id else DEFAULT_USER_LIKES_PAGES
-        succ, res = await get_user_likes(
-            twitter_session, item.user_id, num_pages, since_id=item.since_id
-        )
+    batcher = IngestBatcher(worker)
+
+    async def _fetch(fetch_args):
+        return await _scrape_and_ingest(worker, batcher, *fetch_args)
+
+    results = await fetch_concurrently(
+        _fetch, to_fetch,
+        get_fan_out_limit(twitter_session, USER_LIKES_URL, DEFAULT_USER_LIKES_PAGES)
+    )
+
+    # note: the profile is only updated once all of its pages have been ingested
+    for (item, since_id, _), (succ, newest_like_id) in zip(to_fetch, results):
+
+        profile = profiles_by_id[item.obj_id]
+        profile.user_likes_prev_scrape_attempt = get_utc_now()
         if succ:
-            profile.user_likes_prev_scrape_attempt = get_utc_now()
             profile.user_likes_prev_scrape_success = get_utc_now()
-            if res:
-                profile.user_likes_since_id = res[0]['id_str']
-                user_likes_by_id[item.user_id] = res
+            # note: never moves backwards, a resumed scrape only sees older likes
+            profile.user_likes_since_id = _get_newer_id(since_id, newest_like_id)
         else:
-            profile.user_likes_since_id = None
-            profile.user_likes_prev_scrape_attempt = get_utc_now()
+            # note: since_id is kept, a failed full scrape resumes from its checkpoint
+            profile.user_likes_since_id = since_id
             print(f"get_user_likes() failed with: {item.user_id}")
 
-    await db_session.commit_async()
-
-    for user_id, user_likes in user_likes_by_id.items():
-        await ingest_user_likes(worker, user_id, user_likes)
+    async with worker.db_lock:
+        await db_session.commit_async()
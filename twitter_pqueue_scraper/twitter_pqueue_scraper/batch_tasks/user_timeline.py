@@ -1,12 +1,16 @@
 import trio
 
-from twitter_pqueue_scraper.batch_tasks.util import parse_date_str
+from twitter_pqueue_scraper.batch_tasks.util import (
+    fetch_concurrently, get_fan_out_limit, parse_date_str
+)
+from twitter_pqueue_scraper.ingestion.ingest_deferred_models import IngestBatcher
 from twitter_pqueue_scraper.ingestion.user_timeline import ingest_user_timeline
-from twitter_pqueue_scraper.scrapers.twitter_api_v1.user_timeline import get_user_timeline
+from twitter_pqueue_scraper.scrapers.twitter_api_v1.user_timeline import iter_user_timeline_pages
 from util_shared.datetime_utils import get_utc_now
 
 
 DEFAULT_TIMELINE_PAGES = 8
+USER_TIMELINE_URL = 'https://api.twitter.com/1.1/statuses/user_timeline.json'
 
 
 def _fetch_profiles(worker, obj_ids):
@@ -16,49 +20,96 @@ def _fetch_profiles(worker, obj_ids):
     return {obj.id: obj for obj in profiles}
 
 
+def _get_newer_id(id_a, id_b):
+    """ the newer of two tweet ids (id strings or None) """
+    if not id_a or not id_b:
+        return id_a or id_b
+    return id_a if int(id_a) >= int(id_b) else id_b
+
+
+def _get_scrape_state(item, profile):
+    """
+    (since_id, checkpoint_min_saved_at): the item's since_id is from when it was queued,
+    the profile's may be newer. A checkpoint saved before the last successful scrape is
+    older than the profile's since_id, so it's not resumed.
+    """
+    since_id = _get_newer_id(item.since_id, profile.user_timeline_since_id)
+    prev_success = profile.user_timeline_prev_scrape_success
+    return since_id, prev_success.timestamp() if prev_success else None
+
+
+async def _scrape_and_ingest(worker, batcher, item, since_id, checkpoint_min_saved_at):
+    """ ingests each page as it arrives, returns (status_code, newest_tweet, num_tweets) """
+    newest_tweet, status_code, num_tweets = None, None, 0
+
+    async for tweets, _, status_code in iter_user_timeline_pages(
+        worker.twitter_session, item.user_id, max_pages=DEFAULT_TIMELINE_PAGES,
+        since_id=since_id, checkpoint_min_saved_at=checkpoint_min_saved_at
+    ):
+        if not tweets:
+            continue  # let the generator finish, so it clears its checkpoint
+        for tweet in tweets:
+            # note: pages are newest first, but a resumed scrape starts from an older page
+            if newest_tweet is None or int(tweet['id_str']) > int(newest_tweet['id_str']):
+                newest_tweet = {'created_at': tweet['created_at'], 'id_str': tweet['id_str']}
+        num_tweets += len(tweets)
+
+        await ingest_user_timeline(batcher, item.user_id, tweets)
+
+    return status_code, newest_tweet, num_tweets
+
+
 async def scrape_user_timeline(worker, global_ctx, profile_batch):
 
     twitter_session = worker.twitter_session
     db_session, Base = worker.db_connection
 
     obj_ids = [item.obj_id for item in profile_batch if item.obj_id is not None]
-    profiles_by_id = await trio.to_thread.run_sync(
-        _fetch_profiles, worker, obj_ids
-    )
-
-    timeline_data_all = {}
+    async with worker.db_lock:
+        profiles_by_id = await trio.to_thread.run_sync(
+            _fetch_profiles, worker, obj_ids
+        )
 
+    to_fetch = []  # (item, since_id, checkpoint_min_saved_at)
     for item in profile_batch:  # (scrape_job_id, profile_obj_id, user_id)
-
-        profile = profiles_by_id.get(item.obj_id)
-        if profile is None:
+        if item.obj_id not in profiles_by_id:
             print(f'error: profile not found: {item.obj_id}')
             continue
+        to_fetch.append((item,) + _get_scrape_state(item, profiles_by_id[item.obj_id]))
 
-        res, _, status_code = await get_user_timeline(
-            twitter_session, item.user_id, max_pages=DEFAULT_TIMELINE_PAGES,
-            since_id=item.since_id
-        )
+    batcher = IngestBatcher(worker)
+
+    async def _fetch(fetch_args):
+        return await _scrape_and_ingest(worker, batcher, *fetch_args)
+
+    results = await fetch_concurrently(
+        _fetch, to_fetch,
+        get_fan_out_limit(twitter_session, USER_TIMELINE_URL, DEFAULT_TIMELINE_PAGES)
+    )
+
+    # note: the profile is only updated once all of its pages have been ingested,
+    # so an interrupted scrape is retried from the newest tweet rather than skipped
+    for (item, since_id, _), (status_code, newest_tweet, num_tweets) in zip(to_fetch, results):
+
+        profile = profiles_by_id[item.obj_id]
         if status_code != 200:
             print(f"get_user_timeline() failed with: {item.user_id}")
-        if item.since_id:
-            print(f'repeat user_timeline scrape, got {len(res or [])} new tweets')
+        if since_id:
+            print(f'repeat user_timeline scrape, got {num_tweets} new tweets')
 
         profile.user_timeline_prev_scrape_attempt = get_utc_now()
         profile.user_timeline_prev_status_code = status_code
 
-        if status_code == 200:
-            profile.user_timeline_prev_scrape_success = get_utc_now()
-        if res:
-            latest_dt = parse_date_str(res[0]['created_at'])
+        if status_code != 200:
+            # note: since_id is left as it was, a failed full scrape resumes from its checkpoint
+            continue
+        profile.user_timeline_prev_scrape_success = get_utc_now()
+        if newest_tweet and _get_newer_id(newest_tweet['id_str'], since_id) != since_id:
+            latest_dt = parse_date_str(newest_tweet['created_at'])
             profile.user_timeline_latest_tweet_datetime = latest_dt
-            profile.user_timeline_since_id = res[0]['id_str']
-            timeline_data_all[item.user_id] = res
+            profile.user_timeline_since_id = newest_tweet['id_str']
         else:
-            profile.user_timeline_since_id = None
-
-    await db_session.commit_async()
-
-    for user_id, timeline_data in timeline_data_all.items():
-        await ingest_user_timeline(worker, user_id, timeline_data)
+            profile.user_timeline_since_id = since_id  # nothing newer, keep the newest known
 
+    async with worker.db_lock:
+        await db_session.commit_async()
@@ -1,14 +1,15 @@
 import datetime
+from functools import lru_cache
 import os
 import re
 import uuid
 
-import pytz
 import trio
 
-from twitter_pqueue_scraper.util.db_util import (
-    get_or_create_by_key, get_or_create_by_multiple_keys
+from twitter_pqueue_scraper.util.bulk_ingest import (
+    bulk_get_or_create_by_key, bulk_get_or_create_by_multiple_keys
 )
+from twitter_pqueue_scraper.util.db_util import is_foreign_key_violation
 from util_shared.datetime_utils import get_utc_now
 
 
@@ -23,6 +24,15 @@ DB_FETCH_FIELDS = {
     ]
 }
 
+# max api calls in flight per batch, further limited by the endpoint's remaining rate budget
+MAX_FETCH_CONCURRENCY = 4
+
+RELATIONSHIP_ID_URLS = {
+    'friend_ids': 'https://api.twitter.com/1.1/friends/ids.json',
+    'follower_ids': 'https://api.twitter.com/1.1/followers/ids.json',
+}
+RELATIONSHIP_ID_PAGES = 3  # see: DEFAULT_FRIEND_ID_PAGES, DEFAULT_FOLLOWER_ID_PAGES
+
 DJONGO_WEBSERVER_HOSTNAME = os.environ.get('DJONGO_WEBSERVER_HOSTNAME', 'localhost')
 DJONGO_WEBSERVER_PORT = os.environ.get('DJONGO_WEBSERVER_PORT', '8000')
 DJONGO_NOTIFY_URL = f"http://{DJONGO_WEBSERVER_HOSTNAME}:{DJONGO_WEBSERVER_PORT}/notify-new-data/"
@@ -51,15 +61,48 @@ MONTH_NAME_TO_NUM = {
 
 MENTION_REGEX = r'@(?P<screen_name>\w+)'
 
+DATE_RE = re.compile(DATE_REGEX, flags=re.I)
+DATE_CACHE_SIZE = 4096  # a page's tweets, their retweet/like rels share created_at strings
+
+# v1 created_at, e.g. 'Wed Oct 10 20:19:24 +0000 2018', parsed by slicing (see: _parse_v1_date_str)
+V1_DATE_LENGTH = 30
+MONTH_ABBR_TO_ISO = {
+    name.title(): f'{num:02d}' for name, num in MONTH_NAME_TO_NUM.items() if len(name) == 3
+}
+MENTION_RE = re.compile(MENTION_REGEX)
+
+
+def _parse_v1_date_str(date_string):
+    """ the fixed v1 layout, returns None for anything else """
+    if len(date_string) != V1_DATE_LENGTH or date_string[19:26] != ' +0000 ':
+        return None
+    month = MONTH_ABBR_TO_ISO.get(date_string[4:7])
+    if month is None:
+        return None
+
+    # note: rearranged into ISO 8601, fromisoformat() is much faster than strptime()
+    iso_string = (
+        date_string[26:30] + '-' + month + '-' + date_string[8:10] + 'T' +
+        date_string[11:19] + '+00:00'
+    )
+    try:
+        return datetime.datetime.fromisoformat(iso_string)
+    except ValueError:
+        return None
+
 
+@lru_cache(maxsize=DATE_CACHE_SIZE)
 def parse_date_str(date_string):
 
     if date_string.endswith('Z') and 'T' in date_string:
         # v2 api format, ISO 8601
-        dt = datetime.datetime.fromisoformat(date_string[:-1])
-        return dt.replace(tzinfo=pytz.UTC)
+        return datetime.datetime.fromisoformat(date_string[:-1] + '+00:00')
+
+    dt = _parse_v1_date_str(date_string)
+    if dt is not None:
+        return dt
 
-    match = re.search(DATE_REGEX, date_string, flags=re.I)
+    match = DATE_RE.search(date_string)
 
     if match is None:
         print(f"error: failed to parse created_at string: {date_string}")
@@ -73,109 +116,190 @@ def parse_date_str(date_string):
         year=int(values['year']),
         hour=int(values['hour']),
         minute=int(values['minute']),
-        tzinfo=pytz.UTC
+        second=int(values['second']),
+        tzinfo=datetime.timezone.utc
     )
 
 
-def _fetch_profiles(worker, object_ids):
-    db_session, Base = worker.db_connection
-    TwitterProfile = Base.classes.twitter_twitterprofile
-    profiles = db_session.query(TwitterProfile).filter(TwitterProfile.id.in_(object_ids)).all()
-    return {obj.id: obj for obj in profiles}
+def get_fan_out_limit(twitter_session, url, requests_per_item, app_auth=False):
+    budget = twitter_session.get_rate_budget(url, app_auth=app_auth)
+    if budget is None:
+        return MAX_FETCH_CONCURRENCY  # no response yet, the rate limit bucket still paces requests
+    return max(1, min(MAX_FETCH_CONCURRENCY, budget // requests_per_item))
+
 
+async def fetch_concurrently(fetch_func, items, max_concurrency):
+    """ awaits fetch_func(item) for each item, at most max_concurrency at once, returns results in order """
+    results = [None] * len(items)
+    limiter = trio.CapacityLimiter(max(1, max_concurrency))
 
-async def scrape_relationship_ids(worker, key, func, profile_batch):
+    async def _fetch(index, item):
+        async with limiter:
+            results[index] = await fetch_func(item)
+
+    async with trio.open_nursery() as n:
+        for index, item in enumerate(items):
+            n.start_soon(_fetch, index, item)
+
+    return results
+
+
+async def _fetch_profiles(worker, key, object_ids):
+    rows = await worker.db_pool.query(
+        f"SELECT id, is_available, {key}_cursor FROM twitter_twitterprofile WHERE id = ANY(%s);",
+        (object_ids,)
+    )
+    return {row['id']: row for row in rows}
+
+
+async def _update_profile(worker, profile_obj_id, db_update):
+    set_str = ', '.join([f"{field_name} = %s" for field_name in db_update.keys()])
+    await worker.db_pool.execute(
+        f"UPDATE twitter_twitterprofile SET {set_str} WHERE id = %s;",
+        list(db_update.values()) + [profile_obj_id]
+    )
+
+
+def _get_cursor_checkpoint(key, next_cursor):
+    if next_cursor == '0':
+        return {f'{key}_cursor': None, f'{key}_fully_scraped': True}  # cursor exhausted
+    return {f'{key}_cursor': next_cursor, f'{key}_fully_scraped': False}
+
+
+async def _scrape_and_ingest_relationship_ids(worker, key, iter_pages_func, item, initial_cursor):
+    """
+    ingests each page of ids as it arrives, then saves the page's cursor, so
+    an interrupted scrape resumes from (at most) the page that was in progress
+
+    note: the cursor is saved on a db_pool connection, not in the ingest's transaction,
+    it's written strictly after the page's ingest has committed. If the scrape stops in
+    between, the page is fetched and ingested again on resume, which is harmless since
+    its profiles and rels are get-or-created.
+    """
+    status_code, num_pages = None, 0
+
+    async for user_ids, next_cursor, status_code in iter_pages_func(
+        worker.twitter_session, item.user_id, initial_cursor=initial_cursor
+    ):
+        if status_code != 200:
+            continue  # the generator stops after a failed page
+
+        if initial_cursor and not num_pages and not user_ids:
+            print('warning: cursor invalid')
+            checkpoint = {f'{key}_cursor': None, f'{key}_fully_scraped': False}
+        else:
+            if user_ids:
+                async with worker.db_lock:
+                    # note: returns once the page is committed
+                    await _ingest_followers__by_userid(worker, item.obj_id, key, user_ids)
+            checkpoint = _get_cursor_checkpoint(key, next_cursor)
+
+        await _update_profile(worker, item.obj_id, checkpoint)
+        num_pages += 1
+
+    db_update = {
+        f'{key}_prev_status_code': status_code,
+        f'{key}_prev_scrape_attempt': get_utc_now()
+    }
+    if status_code == 200:
+        db_update[f'{key}_prev_scrape_success'] = get_utc_now()
+    await _update_profile(worker, item.obj_id, db_update)
+
+
+async def scrape_relationship_ids(worker, key, iter_pages_func, profile_batch):
 
     assert key in ('friend_ids', 'follower_ids')
 
     twitter_session = worker.twitter_session
-    db_session, Base = worker.db_connection
 
     object_ids = [i.obj_id for i in profile_batch if i.obj_id is not None]
 
-    current_profiles = await trio.to_thread.run_sync(
-        _fetch_profiles, worker, object_ids
-    )
-
-    db_updates_all, rel_userids = {}, {}
+    current_profiles = await _fetch_profiles(worker, key, object_ids)
 
+    to_fetch = []  # (item, initial_cursor)
     for item in profile_batch:
         if item.obj_id not in current_profiles:
             print(f'warning: profile {item.obj_id} doesnt exist')
             continue
-        profile_obj = current_profiles[item.obj_id]
+        profile_row = current_profiles[item.obj_id]
 
-        if profile_obj.is_available is False:  # assume this is up-to-date
+        if profile_row['is_available'] is False:  # assume this is up-to-date
             continue
 
-        initial_cursor = getattr(profile_obj, f'{key}_cursor')
+        initial_cursor = profile_row[f'{key}_cursor']
         if initial_cursor == '0':
             initial_cursor = None  # if true, this is a re-scrape
+        to_fetch.append((item, initial_cursor))
 
-        res, next_cursor, status_code = await func(
-            twitter_session, item.user_id, initial_cursor=initial_cursor
+    async def _fetch(fetch_args):
+        item, initial_cursor = fetch_args
+        await _scrape_and_ingest_relationship_ids(
+            worker, key, iter_pages_func, item, initial_cursor
         )
 
-        db_update = {
-            f'{key}_prev_status_code': status_code,
-            f'{key}_prev_scrape_attempt': get_utc_now()
-        }
-        if status_code != 200:
-            db_updates_all[item.obj_id] = db_update
-            continue
-
-        db_update[f'{key}_prev_scrape_success'] = get_utc_now()
-
-        if initial_cursor and len(res) == 0:
-            print('warning: cursor invalid')
-            db_update[f'{key}_cursor'] = None  # cursor invalid
-            db_update[f'{key}_fully_scraped'] = False
-        else:
-            if next_cursor == '0':
-                db_update[f'{key}_cursor'] = None  # cursor exhausted
-                db_update[f'{key}_fully_scraped'] = True
-            else:
-                db_update[f'{key}_fully_scraped'] = False
-                db_update[f'{key}_cursor'] = next_cursor
-
-            rel_userids[profile_obj.id] = res
-
-        for field_name, value in db_update.items():
-            if field_name != 'id':
-                setattr(profile_obj, field_name, value)
+    url = RELATIONSHIP_ID_URLS[key]
+    await fetch_concurrently(
+        _fetch, to_fetch, get_fan_out_limit(twitter_session, url, RELATIONSHIP_ID_PAGES)
+    )
 
-    await db_session.commit_async()
 
-    for profile_obj_id, user_ids in rel_userids.items():
-        await _ingest_followers__by_userid(
-            worker, profile_obj_id, key, user_ids
-        )
+async def _lookup_profile_ids(worker, user_ids):
+    """ {user_id: TwitterProfile.id}, profiles that don't exist are created """
+    db_session, Base = worker.db_connection
+    _, profiles_by_userid, _ = await bulk_get_or_create_by_key(
+        db_session, Base.classes.twitter_twitterprofile, 'user_id', user_ids,
+        defaults={'manually_added': False}
+    )
+    found_ids = {user_id: obj.id for user_id, obj in profiles_by_userid.items()}
+    await worker.identity_cache.publish('profile', found_ids)
+    return found_ids
 
 
 async def _ingest_followers__by_userid(
     worker, profile_obj_id, friends_or_followers, user_ids
 ):
     db_session, Base = worker.db_connection
-    TwitterProfile = Base.classes.twitter_twitterprofile
     ProfileFollowsProfileRel = Base.classes.twitter_profilefollowsprofilerel
 
-    _, profiles_by_userid, new_profile_ids =  await get_or_create_by_key(
-        db_session, TwitterProfile, 'user_id', user_ids,
-        defaults={'manually_added': False}
-    )
+    identity_cache = worker.identity_cache
+    await identity_cache.check_generation()
+    await identity_cache.prefetch('profile', user_ids)
+
+    # note: profiles found in the identity cache exist, only the rest are looked up
+    profile_ids = {}
+    for user_id, pk in zip(user_ids, identity_cache.resolve('profile', user_ids)):
+        if pk is not None:
+            profile_ids[user_id] = pk
+    cached_user_ids = list(profile_ids.keys())
+    to_lookup = [user_id for user_id in user_ids if user_id not in profile_ids]
+
+    if to_lookup:
+        profile_ids.update(await _lookup_profile_ids(worker, to_lookup))
 
     self_key, other_key = 'source_id', 'dest_id'  # friend_ids
     if friends_or_followers == 'follower_ids':
         self_key, other_key = 'dest_id', 'source_id'  # swap
 
-    rel_params = [
-        {self_key: profile_obj_id, other_key: other.id}
-        for other in profiles_by_userid.values()
-    ]
+    def _get_rel_params(profile_ids):
+        return [
+            {self_key: profile_obj_id, other_key: other_id}
+            for other_id in profile_ids.values()
+        ]
 
-    await get_or_create_by_multiple_keys(
-        db_session, ProfileFollowsProfileRel, rel_params
-    )
+    try:
+        await bulk_get_or_create_by_multiple_keys(
+            db_session, ProfileFollowsProfileRel, _get_rel_params(profile_ids)
+        )
+    except Exception as e:
+        if not is_foreign_key_violation(e) or not cached_user_ids:
+            raise
+        # a cached pk is stale (e.g. its profile was merged away), look them all up instead
+        print(f"warning: stale cached ids, retrying without the identity cache: {e}")
+        await identity_cache.forget('profile', cached_user_ids)
+        profile_ids.update(await _lookup_profile_ids(worker, cached_user_ids))
+        await bulk_get_or_create_by_multiple_keys(
+            db_session, ProfileFollowsProfileRel, _get_rel_params(profile_ids)
+        )
 
 
 '''
@@ -213,8 +337,5 @@ async def set_event(global_ctx, event_uid, payload):
 
 # for tips on how to preprocess tweet text for NLP, see page 4 here: https://arxiv.org/pdf/1708.03994.pdf
 def get_mentions_from_string(text):
-    text = text + ' '
-    mentions = [
-        sn.strip().lower() for sn in re.findall(MENTION_REGEX, text)
-    ]
-    return [s for s in set(mentions)]
+    mentions = {sn.lower() for sn in MENTION_RE.findall(text)}
+    return [s for s in mentions]
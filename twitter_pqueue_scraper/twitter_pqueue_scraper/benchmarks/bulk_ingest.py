@@ -0,0 +1,106 @@
+'''
+Compares the ORM get-or-create helpers in util/db_util.py with the COPY/UPSERT
+engine in util/bulk_ingest.py, run from inside the twitter-scraper container:
+
+    python -m twitter_pqueue_scraper.benchmarks.bulk_ingest
+
+Half of the keys in each run already exist, which is typical of a
+follower_ids page. Rows created by the benchmark are deleted afterwards.
+'''
+import sys
+import time
+import uuid
+
+from sqlalchemy import text
+import trio
+
+from twitter_pqueue_scraper.util.bulk_ingest import (
+    bulk_get_or_create_by_key, bulk_get_or_create_by_multiple_keys
+)
+from twitter_pqueue_scraper.util.db_util import (
+    create_sqlalchemy_session, get_or_create_by_key, get_or_create_by_multiple_keys
+)
+
+
+SIZES = [1000, 10000, 100000]
+ORM_MULTIPLE_KEYS_LIMIT = 10000  # the ORM path is O(n^2) here, larger sizes take hours
+
+
+def _cleanup(db_session, prefix):
+    db_session.execute(text(
+        "DELETE FROM twitter_profilefollowsprofilerel WHERE source_id IN "
+        "(SELECT id FROM twitter_twitterprofile WHERE user_id LIKE :prefix)"
+    ), {'prefix': prefix + '%'})
+    db_session.execute(text(
+        "DELETE FROM twitter_twitterprofile WHERE user_id LIKE :prefix"
+    ), {'prefix': prefix + '%'})
+    db_session.commit()
+
+
+async def _time(func, *args, **kwargs):
+    bf = time.perf_counter()
+    result = await func(*args, **kwargs)
+    return time.perf_counter() - bf, result
+
+
+async def _bench_profiles(db_session, TwitterProfile, size, prefix, get_or_create_func):
+    user_ids = [f"{prefix}{i}" for i in range(size)]
+    defaults = {'manually_added': False}
+
+    # pre-create half of the keys so both the existing and the new path are exercised
+    await get_or_create_func(
+        db_session, TwitterProfile, 'user_id', user_ids[::2], defaults=defaults
+    )
+    secs, (_, profiles_by_userid, new_ids) = await _time(
+        get_or_create_func, db_session, TwitterProfile, 'user_id', user_ids,
+        defaults=defaults
+    )
+    assert len(profiles_by_userid) == size
+    assert len(new_ids) == size - len(user_ids[::2])
+    return secs, profiles_by_userid
+
+
+async def _bench_rels(db_session, Rel, source_id, profiles_by_userid, orm):
+    rel_params = [
+        {'source_id': source_id, 'dest_id': p.id} for p in profiles_by_userid.values()
+    ]
+    if orm:
+        return await _time(
+            get_or_create_by_multiple_keys, db_session, Rel, rel_params
+        )
+    return await _time(
+        bulk_get_or_create_by_multiple_keys, db_session, Rel, rel_params
+    )
+
+
+async def main(sizes):
+
+    db_session, Base = await create_sqlalchemy_session()
+    TwitterProfile = Base.classes.twitter_twitterprofile
+    ProfileFollowsProfileRel = Base.classes.twitter_profilefollowsprofilerel
+
+    print(f"{'rows':>8} {'path':>6} {'profiles (s)':>14} {'rels (s)':>10}")
+
+    for size in sizes:
+        for path, func in (('orm', get_or_create_by_key), ('bulk', bulk_get_or_create_by_key)):
+            prefix = f"bench-{uuid.uuid4().hex[:12]}-"
+            try:
+                profile_secs, profiles_by_userid = await _bench_profiles(
+                    db_session, TwitterProfile, size, prefix, func
+                )
+                source_id = next(iter(profiles_by_userid.values())).id
+                rels_secs = '-'
+                if path == 'bulk' or size <= ORM_MULTIPLE_KEYS_LIMIT:
+                    secs, _ = await _bench_rels(
+                        db_session, ProfileFollowsProfileRel, source_id,
+                        profiles_by_userid, path == 'orm'
+                    )
+                    rels_secs = f"{secs:.3f}"
+                print(f"{size:>8} {path:>6} {profile_secs:>14.3f} {rels_secs:>10}")
+            finally:
+                await trio.to_thread.run_sync(_cleanup, db_session, prefix)
+
+
+if __name__ == '__main__':
+    _sizes = [int(s) for s in sys.argv[1:]] or SIZES
+    trio.run(main, _sizes)
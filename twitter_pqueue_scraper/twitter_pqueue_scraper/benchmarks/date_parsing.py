@@ -0,0 +1,117 @@
+'''
+Compares the previous regex based parse_date_str() with the fixed-format parser, with
+and without its lru_cache, over a million created_at timestamps:
+
+    python -m twitter_pqueue_scraper.benchmarks.date_parsing [timeline.json ...]
+
+Timestamps are taken from recorded v1/v2 responses (see: benchmarks/tweet_features.py)
+and repeated up to NUM_TIMESTAMPS. Without files, synthetic v1 and v2 timestamps are
+used, each parsed for a tweet and, sometimes, its retweet/like rel and the timeline's
+latest tweet, the way ingestion does.
+'''
+import datetime
+import random
+import re
+import sys
+import time
+
+import pytz
+
+from twitter_pqueue_scraper.batch_tasks.util import (
+    DATE_REGEX, MONTH_NAME_TO_NUM, parse_date_str
+)
+from twitter_pqueue_scraper.benchmarks.tweet_features import load_corpus
+
+
+NUM_TIMESTAMPS = 1000000
+TWEETS_PER_PAGE = 200
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def _old_parse_date_str(date_string):
+    # the previous parse_date_str(), for comparison
+    if date_string.endswith('Z') and 'T' in date_string:
+        dt = datetime.datetime.fromisoformat(date_string[:-1])
+        return dt.replace(tzinfo=pytz.UTC)
+
+    match = re.search(DATE_REGEX, date_string, flags=re.I)
+    if match is None:
+        return None
+    values = match.groupdict()
+    return datetime.datetime(
+        day=int(values['day_num']),
+        month=MONTH_NAME_TO_NUM[values['month_name'].lower()],
+        year=int(values['year']),
+        hour=int(values['hour']),
+        minute=int(values['minute']),
+        tzinfo=pytz.UTC
+    )
+
+
+def _format_v1(dt):
+    return f"{WEEKDAYS[dt.weekday()]} {MONTHS[dt.month - 1]} {dt:%d %H:%M:%S} +0000 {dt.year}"
+
+
+def _format_v2(dt):
+    return f"{dt:%Y-%m-%dT%H:%M:%S}.000Z"
+
+
+def create_synthetic_timestamps(num_timestamps, seed=0):
+    """ pages of tweets in time order, rels parse their tweet's created_at again """
+    rnd = random.Random(seed)
+    dt = datetime.datetime(2021, 6, 1)
+    timestamps = []
+    while len(timestamps) < num_timestamps:
+        formatter = _format_v1 if rnd.random() < 0.8 else _format_v2
+        page = []
+        for _ in range(TWEETS_PER_PAGE):
+            dt -= datetime.timedelta(seconds=rnd.randint(1, 20000))
+            created_at = formatter(dt)
+            page.append(created_at)
+            if rnd.random() < 0.5:
+                page.append(created_at)  # a retweet/like/reply rel
+        page.append(page[0])  # the timeline's latest tweet
+        timestamps.extend(page)
+    return timestamps[:num_timestamps]
+
+
+def _load_timestamps(paths):
+    v1_tweets, v2_tweets = load_corpus(paths)
+    recorded = [di['created_at'] for di in v1_tweets + v2_tweets if 'created_at' in di]
+    if not recorded:
+        sys.exit('no created_at values found')
+    return (recorded * (NUM_TIMESTAMPS // len(recorded) + 1))[:NUM_TIMESTAMPS]
+
+
+def _time(func, timestamps):
+    started = time.perf_counter()
+    results = [func(s) for s in timestamps]
+    return time.perf_counter() - started, results
+
+
+def main():
+    if len(sys.argv) > 1:
+        timestamps = _load_timestamps(sys.argv[1:])
+    else:
+        timestamps = create_synthetic_timestamps(NUM_TIMESTAMPS)
+
+    parse_date_str.cache_clear()
+    old_secs, old_results = _time(_old_parse_date_str, timestamps)
+    uncached_secs, uncached_results = _time(parse_date_str.__wrapped__, timestamps)
+    cached_secs, cached_results = _time(parse_date_str, timestamps)
+    assert cached_results == uncached_results
+
+    # note: the previous parser dropped seconds
+    num_diffs = sum(
+        1 for s, old, new in zip(timestamps, old_results, uncached_results)
+        if old != (new if new is None or s.endswith('Z') else new.replace(second=0))
+    )
+    print(f"{len(timestamps)} timestamps, {len(set(timestamps))} distinct, {num_diffs} parsed differently")
+    for name, secs in [('regex', old_secs), ('fixed-format', uncached_secs), ('fixed-format + cache', cached_secs)]:
+        print(f"{name:<22} {secs:6.2f} s  {len(timestamps) / secs:12,.0f} timestamps/s")
+    print(parse_date_str.cache_info())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+'''
+Compares dedup_def_objects() + get_update_values() with the columnar DeferredBatch,
+the cpu-bound part of ingest_batch() (no db needed):
+
+    python -m twitter_pqueue_scraper.benchmarks.deferred_models [timeline.json]
+
+timeline.json is a recorded user_timeline response (a json list of v1 tweets), pages
+can be concatenated. Without it a synthetic 8 page timeline is used.
+'''
+from collections import namedtuple
+import json
+import random
+import sys
+import time
+
+from twitter_pqueue_scraper.ingestion.create_deferred_models import create_deferred_models
+from twitter_pqueue_scraper.ingestion.deferred_batch import DeferredBatch
+from twitter_pqueue_scraper.ingestion.deferred_models import (
+    DeferredTwitterProfile, DeferredTweet, DeferredRetweetRel, DeferredReplyRel,
+    DeferredLikeRel, DeferredProfileMentionedInTweet, dedup_def_objects
+)
+
+
+NUM_PAGES = 8
+PAGE_SIZE = 200
+NUM_RUNS = 20
+TIMELINE_USER_ID = '1234567890'
+
+Row = namedtuple('Row', ['id'])
+REL_CLASSES = [
+    DeferredRetweetRel, DeferredReplyRel, DeferredLikeRel, DeferredProfileMentionedInTweet
+]
+
+
+def _create_tweet(id_str, user_id, rnd):
+    mentions = [
+        {'id_str': str(rnd.randint(1, 2000)), 'screen_name': 'someone'}
+        for _ in range(rnd.choice([0, 0, 1, 1, 2, 3]))
+    ]
+    urls = [{'url': 'https://t.co/abcdef'}] if rnd.random() < 0.4 else []
+    text = ' '.join(['@someone'] * len(mentions) + ['some words here'] + [u['url'] for u in urls])
+    return {
+        'id_str': id_str,
+        'created_at': 'Wed Oct 10 20:19:24 +0000 2018',
+        'text': text,
+        'user': {'id_str': user_id},
+        'is_quote_status': False,
+        'in_reply_to_status_id_str': None,
+        'in_reply_to_user_id_str': None,
+        'entities': {'urls': urls, 'user_mentions': mentions},
+    }
+
+
+def create_synthetic_timeline(num_tweets, seed=0):
+    """ a mix of statuses, replies and retweets, retweets and replies often share tweets """
+    rnd = random.Random(seed)
+    tweets = []
+    for i in range(num_tweets):
+        tweet_di = _create_tweet(str(1400000000000000000 + i), TIMELINE_USER_ID, rnd)
+        scenario = rnd.random()
+        if scenario < 0.3:
+            inner_id = str(1300000000000000000 + rnd.randint(1, 400))
+            tweet_di['retweeted_status'] = _create_tweet(inner_id, str(rnd.randint(1, 2000)), rnd)
+            tweet_di['text'] = 'RT @someone: ' + tweet_di['retweeted_status']['text']
+        elif scenario < 0.6:
+            tweet_di['in_reply_to_status_id_str'] = str(1300000000000000000 + rnd.randint(1, 400))
+            tweet_di['in_reply_to_user_id_str'] = str(rnd.randint(1, 2000))
+        tweets.append(tweet_di)
+    return tweets
+
+
+def _get_lookups(def_objects):
+    # stand-ins for the rows returned by bulk_get_or_create_by_key()
+    tweets_by_api_id, profiles_by_userid = {}, {TIMELINE_USER_ID: Row(0)}
+    for do in def_objects:
+        if isinstance(do, DeferredTweet):
+            tweets_by_api_id[do.tweet_api_id] = Row(len(tweets_by_api_id))
+            profiles_by_userid[do.author_user_id] = Row(len(profiles_by_userid))
+        elif isinstance(do, DeferredReplyRel):
+            tweets_by_api_id[do.reply_to_api_id] = Row(len(tweets_by_api_id))
+        elif isinstance(do, DeferredProfileMentionedInTweet):
+            # note: ingest_batch() drops these when the tweet isn't stored (retweets)
+            tweets_by_api_id.setdefault(do.tweet_api_id, Row(len(tweets_by_api_id)))
+        elif isinstance(do, DeferredTwitterProfile):
+            profiles_by_userid[do.profile_api_id] = Row(len(profiles_by_userid))
+    return tweets_by_api_id, profiles_by_userid
+
+
+def run_objects(def_objects, tweets_by_api_id, profiles_by_userid):
+    def_objects = dedup_def_objects(def_objects)
+    value_dicts = [
+        dt.get_update_values(profiles_by_userid)
+        for dt in def_objects if isinstance(dt, DeferredTweet)
+    ]
+    for Cls in REL_CLASSES:
+        value_dicts.extend([
+            dr.get_update_values(tweets_by_api_id, profiles_by_userid)
+            for dr in def_objects if isinstance(dr, Cls)
+        ])
+    return value_dicts
+
+
+def run_columnar(def_objects, tweets_by_api_id, profiles_by_userid):
+    batch = DeferredBatch.from_def_objects(def_objects)
+    batch.dedup()
+    value_dicts = batch.tweets.get_value_dicts(tweets_by_api_id, profiles_by_userid)
+    for Cls in REL_CLASSES:
+        value_dicts.extend(batch.tables[Cls].get_value_dicts(tweets_by_api_id, profiles_by_userid))
+    return value_dicts
+
+
+def _time(func, *args):
+    started = time.perf_counter()
+    for _ in range(NUM_RUNS):
+        result = func(*args)
+    return (time.perf_counter() - started) / NUM_RUNS, result
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            timeline = json.load(f)
+    else:
+        timeline = create_synthetic_timeline(NUM_PAGES * PAGE_SIZE)
+
+    def_objects = []
+    for tweet_di in timeline:
+        def_objects.extend(create_deferred_models(TIMELINE_USER_ID, tweet_di))
+    lookups = _get_lookups(def_objects)
+
+    print(f"{len(timeline)} tweets, {len(def_objects)} deferred objects, {NUM_RUNS} runs")
+    objects_secs, objects_result = _time(run_objects, def_objects, *lookups)
+    columnar_secs, columnar_result = _time(run_columnar, def_objects, *lookups)
+    assert objects_result == columnar_result
+
+    print(f"objects:  {objects_secs * 1000:7.2f} ms")
+    print(f"columnar: {columnar_secs * 1000:7.2f} ms ({len(columnar_result)} value dicts)")
+
+
+if __name__ == '__main__':
+    main()
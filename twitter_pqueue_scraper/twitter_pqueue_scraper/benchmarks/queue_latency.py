@@ -0,0 +1,109 @@
+'''
+End-to-end item latency (queue put -> batch loop receive) and idle CPU for
+the old round-robin polling daemon vs the per-worker event-driven feeders:
+
+    python -m twitter_pqueue_scraper.benchmarks.queue_latency [num_workers]
+
+Only needs trio, the workers are stand-ins with a channel and a consumer task.
+'''
+import random
+import statistics
+import sys
+import time
+
+import trio
+
+from twitter_pqueue_scraper.execution.pqueue import (
+    AwaitablePriorityQueue, feed_channel_from_queue
+)
+
+
+NUM_WORKERS = 50
+NUM_ITEMS = 2000
+CHANNEL_SIZE = 5
+IDLE_SECONDS = 5
+IDLE_FLUSH_DELAY = 40
+
+
+class FakeWorker(object):
+
+    def __init__(self):
+        self.priority_queue = AwaitablePriorityQueue()
+        self.send_channel, self.receive_channel = trio.open_memory_channel(CHANNEL_SIZE)
+        self.latencies = []
+
+    async def consume(self):
+        async for item in self.receive_channel:
+            self.latencies.append(time.perf_counter() - item['queued_at'])
+
+    async def flush(self):
+        pass
+
+
+async def _polling_daemon(workers):
+    # the original daemon__move_items_from_queues_to_channels() loop
+    while True:
+        was_empty = []
+        for w in workers:
+            try:
+                priority, item = w.priority_queue.get_nowait()
+            except trio.WouldBlock:
+                was_empty.append(True)
+                continue
+            try:
+                w.send_channel.send_nowait(item)
+            except trio.WouldBlock:
+                w.priority_queue.put_nowait(priority, item)
+                await trio.sleep(0.2)
+            was_empty.append(False)
+        if all(was_empty):
+            await trio.sleep(0.3)
+
+
+async def _event_driven(workers):
+    async with trio.open_nursery() as n:
+        for w in workers:
+            n.start_soon(
+                feed_channel_from_queue, w.priority_queue, w.send_channel,
+                IDLE_FLUSH_DELAY, w.flush
+            )
+
+
+async def _run(strategy, num_workers):
+    workers = [FakeWorker() for _ in range(num_workers)]
+
+    async with trio.open_nursery() as n:
+        for w in workers:
+            n.start_soon(w.consume)
+        n.start_soon(strategy, workers)
+
+        # idle period: nothing is queued
+        cpu_bf, wall_bf = time.process_time(), time.perf_counter()
+        await trio.sleep(IDLE_SECONDS)
+        idle_cpu = (time.process_time() - cpu_bf) / (time.perf_counter() - wall_bf)
+
+        # items trickle in, a few milliseconds apart
+        for _ in range(NUM_ITEMS):
+            w = random.choice(workers)
+            w.priority_queue.put_nowait(2, {'queued_at': time.perf_counter()})
+            await trio.sleep(random.uniform(0, 0.004))
+        await trio.sleep(1)
+        n.cancel_scope.cancel()
+
+    latencies = sorted([lat for w in workers for lat in w.latencies])
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{strategy.__name__:>15} items={len(latencies)} mean={statistics.mean(latencies)*1000:.2f}ms "
+        f"p99={p99*1000:.2f}ms idle_cpu={idle_cpu*100:.2f}%"
+    )
+
+
+async def main(num_workers):
+    print(f"{num_workers} workers, {NUM_ITEMS} items")
+    await _run(_polling_daemon, num_workers)
+    await _run(_event_driven, num_workers)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    trio.run(main, int(args[0]) if args else NUM_WORKERS)
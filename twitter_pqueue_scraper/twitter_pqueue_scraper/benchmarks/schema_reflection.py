@@ -0,0 +1,85 @@
+'''
+Measures actor startup cost of preparing the SQLAlchemy schema for N workers:
+
+    python -m twitter_pqueue_scraper.benchmarks.schema_reflection [num_workers]
+
+    per-worker:  the original behaviour, a NullPool engine + automap reflection per worker
+    per-actor:   one reflection, shared by all workers
+    cached:      metadata loaded from the schema cache file, no reflection
+'''
+import sys
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.automap import automap_base
+from sqlalchemy.pool import NullPool
+
+from twitter_pqueue_scraper.util.db_util import (
+    _create_automap_base, _create_db_connection_str, _load_metadata
+)
+
+
+NUM_WORKERS = 20
+CATALOG_MARKERS = ('pg_catalog', 'pg_class', 'pg_attribute', 'information_schema')
+
+
+class QueryCounter(object):
+
+    def __init__(self):
+        self.total = 0
+        self.catalog = 0
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.total += 1
+        if any(marker in statement for marker in CATALOG_MARKERS):
+            self.catalog += 1
+
+
+def _per_worker(num_workers, counter):
+    for _ in range(num_workers):
+        engine = create_engine(_create_db_connection_str(), poolclass=NullPool)
+        counter.attach(engine)
+        Base = automap_base()
+        Base.prepare(engine, reflect=True)
+        engine.dispose()
+
+
+def _per_actor(num_workers, counter):
+    # workers share the actor's (engine, Base), so num_workers doesn't matter
+    engine = create_engine(_create_db_connection_str())
+    counter.attach(engine)
+    metadata, _ = _load_metadata(engine, use_cache=False)
+    _create_automap_base(metadata)
+    engine.dispose()
+
+
+def _cached(num_workers, counter):
+    engine = create_engine(_create_db_connection_str())
+    counter.attach(engine)
+    metadata, from_cache = _load_metadata(engine)
+    assert from_cache
+    _create_automap_base(metadata)
+    engine.dispose()
+
+
+def main(num_workers):
+    # make sure the cache file exists before timing anything
+    engine = create_engine(_create_db_connection_str())
+    _load_metadata(engine)
+    engine.dispose()
+
+    print(f"{'strategy':>12} {'seconds':>9} {'queries':>8} {'catalog queries':>16}")
+    for name, func in (('per-worker', _per_worker), ('per-actor', _per_actor), ('cached', _cached)):
+        counter = QueryCounter()
+        bf = time.perf_counter()
+        func(num_workers, counter)
+        secs = time.perf_counter() - bf
+        print(f"{name:>12} {secs:>9.3f} {counter.total:>8} {counter.catalog:>16}")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if args else NUM_WORKERS)
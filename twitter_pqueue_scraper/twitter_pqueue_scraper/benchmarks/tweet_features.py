@@ -0,0 +1,181 @@
+'''
+Tweets per second classified by the previous create_deferred_models helpers and by
+get_tweet_features(), over recorded v1 and v2 tweets:
+
+    python -m twitter_pqueue_scraper.benchmarks.tweet_features [file.json ...]
+
+Each file is a recorded v1 response (a json list of tweets) or v2 response (a dict
+with 'data' and optionally 'includes'). Without files a synthetic corpus is used.
+'''
+import json
+import random
+import re
+import sys
+import time
+
+from twitter_pqueue_scraper.benchmarks.deferred_models import create_synthetic_timeline
+from twitter_pqueue_scraper.ingestion.tweet_features import get_tweet_features
+
+
+NUM_SYNTHETIC_TWEETS = 5000
+NUM_RUNS = 5
+
+
+def _old_remove_links_and_mentions(tweet_di):
+    # the previous remove_links_and_mentions(), for comparison
+    text = tweet_di['text'].strip()
+    if text.startswith('RT @'):
+        if text.rstrip() == 'RT @':
+            return ''
+        try:
+            text = text.lstrip('RT @').split(' ', 1)[1]
+        except IndexError:
+            return ''  # note: was a pdb breakpoint
+
+    text = re.sub(r'@\w{1,15}', '', text, flags=re.I).strip()
+
+    urls = tweet_di.get('entities', {}).get('urls') or []
+    text_no_links = text
+    for url_di in urls:
+        text_no_links = text_no_links.replace(url_di['url'], '')
+    text_no_links = re.sub(re.escape('https://') + r'[^\s]+', ' ', text_no_links).strip()
+
+    for punc in (',', ':', '.', '?', '!'):
+        text_no_links = text_no_links.replace(punc, ' ')
+
+    text_no_links = re.sub(r'\s+', ' ', text_no_links).strip()
+    return text_no_links.strip()
+
+
+def _old_get_status_type(tweet_di):
+    text = tweet_di['text']
+    urls = tweet_di.get('entities', {}).get('urls') or []
+
+    if len(urls) == 1 and urls[0]['url'] == text:
+        return 'link-only-status'
+    for media_di in tweet_di.get('entities', {}).get('media', []):
+        if media_di['url'] == text:
+            return 'media-object-status'
+    if not urls:
+        return 'text-only-status'
+    if not _old_remove_links_and_mentions(tweet_di):
+        return 'link-only-status'
+    return 'text-with-link'
+
+
+def _old_get_tweet_scenario(tweet_di):
+    if tweet_di['is_quote_status']:
+        return 'retweet-with-quote'
+    if tweet_di.get('retweeted_status'):
+        return 'retweet'
+    if tweet_di['in_reply_to_status_id_str'] is not None:
+        return 'reply'
+    return _old_get_status_type(tweet_di)
+
+
+def old_features__v1(tweet_di):
+    # what create_deferred_models() computed for a timeline tweet it stores
+    scenario = _old_get_tweet_scenario(tweet_di)
+    if tweet_di['in_reply_to_status_id_str']:
+        tweet_type = 'reply'
+    elif tweet_di['is_quote_status']:
+        tweet_type = 'quote'
+    else:
+        tweet_type = 'status'
+    has_link = bool(tweet_di.get('entities', {}).get('urls'))
+    has_text = bool(_old_remove_links_and_mentions(tweet_di))
+    mentions = [di['id_str'] for di in tweet_di.get('entities', {}).get('user_mentions', [])]
+    return scenario, tweet_type, has_link, has_text, mentions
+
+
+def new_features__v1(tweet_di):
+    features = get_tweet_features(tweet_di)
+    return (
+        features.scenario, features.tweet_type, features.has_link, features.has_text,
+        [user_id for user_id, _ in features.mentions]
+    )
+
+
+def old_features__v2(tweet_di):
+    # what create_deferred_models__conversation() computed for a tweet
+    status_type = _old_get_status_type(tweet_di)
+    has_link = bool(tweet_di.get('entities', {}).get('urls'))
+    has_text = bool(_old_remove_links_and_mentions(tweet_di))
+    mentions = tweet_di.get('entities', {}).get('mentions') or []
+    return status_type, has_link, has_text, [di['username'].lower() for di in mentions]
+
+
+def new_features__v2(tweet_di):
+    features = get_tweet_features(tweet_di)
+    return (
+        features.status_type, features.has_link, features.has_text,
+        [screen_name for _, screen_name in features.mentions]
+    )
+
+
+def create_synthetic_v2_tweets(num_tweets, seed=0):
+    rnd = random.Random(seed)
+    tweets = []
+    for i in range(num_tweets):
+        mentions = [{'username': f'User{rnd.randint(1, 2000)}'} for _ in range(rnd.choice([0, 1, 1, 2]))]
+        urls = [{'url': 'https://t.co/abcdef'}] if rnd.random() < 0.4 else []
+        words = ['some', 'words', 'here.'] if rnd.random() < 0.8 else []
+        text = ' '.join([f"@{di['username']}" for di in mentions] + words + [u['url'] for u in urls])
+        tweets.append({
+            'id': str(1400000000000000000 + i),
+            'text': text,
+            'author_id': str(rnd.randint(1, 2000)),
+            'entities': {'mentions': mentions, 'urls': urls},
+        })
+    return tweets
+
+
+def load_corpus(paths):
+    v1_tweets, v2_tweets = [], []
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            v1_tweets.extend(data)
+            # note: nested tweets are classified too, see: create_deferred_models()
+            for tweet_di in data:
+                for key in ('retweeted_status', 'quoted_status'):
+                    if key in tweet_di:
+                        v1_tweets.append(tweet_di[key])
+        else:
+            v2_tweets.extend(data.get('data') or [])
+            v2_tweets.extend(data.get('includes', {}).get('tweets') or [])
+    return v1_tweets, v2_tweets
+
+
+def _time(func, tweets):
+    started = time.perf_counter()
+    for _ in range(NUM_RUNS):
+        results = [func(tweet_di) for tweet_di in tweets]
+    return len(tweets) * NUM_RUNS / (time.perf_counter() - started), results
+
+
+def main():
+    if len(sys.argv) > 1:
+        v1_tweets, v2_tweets = load_corpus(sys.argv[1:])
+    else:
+        v1_tweets = create_synthetic_timeline(NUM_SYNTHETIC_TWEETS)
+        v2_tweets = create_synthetic_v2_tweets(NUM_SYNTHETIC_TWEETS)
+
+    for name, tweets, old_func, new_func in [
+        ('v1', v1_tweets, old_features__v1, new_features__v1),
+        ('v2', v2_tweets, old_features__v2, new_features__v2),
+    ]:
+        if not tweets:
+            continue
+        old_rate, old_results = _time(old_func, tweets)
+        new_rate, new_results = _time(new_func, tweets)
+        num_diffs = sum(1 for a, b in zip(old_results, new_results) if a != b)
+
+        print(f"{name}: {len(tweets)} tweets, {num_diffs} classified differently")
+        print(f"  before: {old_rate:10,.0f} tweets/s")
+        print(f"  after:  {new_rate:10,.0f} tweets/s")
+
+
+if __name__ == '__main__':
+    main()
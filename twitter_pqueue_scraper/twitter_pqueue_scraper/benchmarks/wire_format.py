@@ -0,0 +1,93 @@
+'''
+Compares the v1 (field per value) and v2 (single msgpack field) stream wire formats,
+bytes per entry and the time to decode a 200-line XREADGROUP result:
+
+    python -m twitter_pqueue_scraper.benchmarks.wire_format
+'''
+import time
+
+import msgpack
+
+from twitter_pqueue_scraper.util.redis_util import RedisGroupStreamClient
+
+
+READ_COUNT = 200
+NUM_READS = 500
+
+
+def _create_item(i):
+    # a user_timeline item as sent by the webserver's send_scrape_work()
+    return {
+        'obj_id': 1000000 + i,
+        'user_id': str(1234567890123456789 + i),
+        'work_type': 'user_timeline',
+        'priority': 2,
+        'has_user_info': True,
+        'since_id': str(1400000000000000000 + i),
+        'dedup_key': f"twitter-dedup:user_timeline:{1234567890123456789 + i}",
+    }
+
+
+def _to_raw_line(i, field_values):
+    # the shape redio returns for a line: [line_id, [field, value, field, value...]]
+    fields = [f.encode() if type(f) is str else f for f in field_values]
+    return [f"1634567890123-{i}".encode(), fields]
+
+
+def _parse_line__slicing(raw_line):
+    # the previous parse_line(), for comparison
+    value_dict = {}
+    line_id, values = raw_line
+    line_id = line_id.decode()
+    while values:
+        key, val = values[:2]
+        value_dict[key.decode()] = msgpack.loads(val)
+        values = values[2:]
+    return True, line_id, value_dict
+
+
+def _get_entry_bytes(field_values):
+    # field names and values, excluding the line id and redis' own framing
+    return sum(len(f.encode() if type(f) is str else f) for f in field_values)
+
+
+def _get_resp_bytes(field_values):
+    # as sent/received over the connection, each field and value is a RESP bulk string
+    sizes = [len(f.encode() if type(f) is str else f) for f in field_values]
+    return len(f"*{len(sizes)}\r\n") + sum(len(f"${n}\r\n") + n + 2 for n in sizes)
+
+
+def _time_reads(parse_func, raw_lines):
+    started = time.perf_counter()
+    for _ in range(NUM_READS):
+        for raw_line in raw_lines:
+            parse_func(raw_line)
+    return (time.perf_counter() - started) / NUM_READS
+
+
+def main():
+    items = [_create_item(i) for i in range(READ_COUNT)]
+
+    results = []
+    for wire_format in ('v1', 'v2'):
+        client = RedisGroupStreamClient('bench', 'bench-cg', None, wire_format=wire_format)
+        serialized = [client.serialize_line(item) for item in items]
+        raw_lines = [_to_raw_line(i, fv) for i, fv in enumerate(serialized)]
+
+        entry_bytes = sum(_get_entry_bytes(fv) for fv in serialized) / READ_COUNT
+        resp_bytes = sum(_get_resp_bytes(fv) for fv in serialized) / READ_COUNT
+        sizes = (entry_bytes, resp_bytes)
+        results.append((wire_format, sizes, _time_reads(client.parse_line, raw_lines)))
+        if wire_format == 'v1':
+            results.append(('v1 (slicing)', sizes, _time_reads(_parse_line__slicing, raw_lines)))
+
+    print(f"{READ_COUNT} lines per read, {NUM_READS} reads")
+    for name, (entry_bytes, resp_bytes), read_secs in results:
+        print(
+            f"{name:<14} {entry_bytes:6.1f} bytes/entry ({resp_bytes:6.1f} as RESP)"
+            f"  {read_secs * 1000:6.3f} ms/read"
+        )
+
+
+if __name__ == '__main__':
+    main()
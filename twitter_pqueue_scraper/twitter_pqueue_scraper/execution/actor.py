@@ -1,6 +1,4 @@
 from collections import defaultdict, namedtuple
-import datetime
-import random
 
 from eliot import to_file as eliot_init_file
 import tractor
@@ -13,14 +11,30 @@ from twitter_pqueue_scraper.batch_tasks.user_timeline import scrape_user_timelin
 from twitter_pqueue_scraper.batch_tasks.user_likes import scrape_user_likes
 from twitter_pqueue_scraper.batch_tasks.friend_ids import scrape_friend_ids
 from twitter_pqueue_scraper.batch_tasks.follower_ids import scrape_follower_ids
+from twitter_pqueue_scraper.util.db_pool import AsyncDBPool
+from twitter_pqueue_scraper.util.db_util import create_sqlalchemy_session
 from twitter_pqueue_scraper.util.redis_util import RedisGroupStreamClient
-from twitter_pqueue_scraper.execution.worker import TwitterWorker
+from twitter_pqueue_scraper.execution.constants import CONSUMER_NAME, PENDING_IDLE_MS
+from twitter_pqueue_scraper.execution.worker import IN_FLIGHT_LINES, TwitterWorker
 from twitter_pqueue_scraper.util.http_util import TwitterHttpSession
+from twitter_pqueue_scraper.util.identity_cache import IdentityCache
+from twitter_pqueue_scraper.util.quota import QuotaLedger
 
 
 # a per process cache
 WORKERS = {}
 
+# routing indexes over WORKERS, built once by _build_routing_index()
+WORKERS_BY_ROUTE = {}  # (account_key, work_type) -> [worker, ...]
+WORKERS_BY_WORK_TYPE = defaultdict(list)  # work_type -> [worker, ...]
+
+# in-flight lines are refreshed well within the forwarder's PENDING_IDLE_MS, see: main.reap_pending_lines()
+IN_FLIGHT_REFRESH_INTERVAL = PENDING_IDLE_MS / 1000 / 4
+# lines held longer than this stop being refreshed, so items that never get acked
+# (e.g. a batch that keeps failing) are still re-routed and eventually dead-lettered
+IN_FLIGHT_MAX_AGE = 12 * 60 * 60
+IN_FLIGHT_REFRESH_COUNT = 500
+
 
 BatchWorkerConfig = namedtuple('WorkerConfig', [
     'func', 'batch_size', 'batch_delay', 'channel_size', 'num_workers_per_account'
@@ -37,8 +51,25 @@ WORKER_TYPES = {
 }
 
 
-async def _triage_item_to_worker(item, actor_name):
-    global WORKERS
+def _build_routing_index():
+    WORKERS_BY_ROUTE.clear()
+    WORKERS_BY_WORK_TYPE.clear()
+
+    for worker_key in sorted(WORKERS.keys()):
+        _, account_key, work_type, _ = worker_key
+        worker = WORKERS[worker_key]
+        WORKERS_BY_ROUTE.setdefault((account_key, work_type), []).append(worker)
+        WORKERS_BY_WORK_TYPE[work_type].append(worker)
+
+
+def _choose_worker(workers):
+    if len(workers) == 1:
+        # most common case (where num_workers_per_account = 1)
+        return workers[0]
+    return min(workers, key=lambda w: w.queue_load)
+
+
+async def _triage_item_to_worker(item):
 
     work_type = item.get('work_type')
     account_key = item.get('account_key')
@@ -56,98 +87,63 @@ async def _triage_item_to_worker(item, actor_name):
         # push flush-item to the top of each queue
         # wait 0.8s for any recent items to be popped first
         await trio.sleep(0.8)
-        for key, worker in WORKERS.items():
-            if key[2] == work_type:
-                print(f"flushing: {key}")
-                worker.priority_queue.put_nowait(1, item)
+        for worker in WORKERS_BY_WORK_TYPE.get(work_type, []):
+            print(f"flushing: {worker.worker_key}")
+            worker.priority_queue.put_nowait(1, item)
         return
 
     if not account_key:
         print("error: missing account_key"); return
 
-    i = 0
-    relevant_keys = []
-    while True:
-        worker_key = (actor_name, account_key, work_type, i)
-        if worker_key not in WORKERS:
-            break
-        relevant_keys.append(worker_key)
-        i += 1
-
-    if not relevant_keys:
-        print(f"error: no relevant_keys found: {account_key}, {work_type}")
+    workers = WORKERS_BY_ROUTE.get((account_key, work_type))
+    if not workers:
+        print(f"error: no workers found: {account_key}, {work_type}")
         return
 
-    if len(relevant_keys) == 1:
-        # most common case (where num_workers_per_account = 1)
-        queue = WORKERS[relevant_keys[0]].priority_queue
-    else:
-        index = random.randint(0, len(relevant_keys)-1)
-        queue = WORKERS[relevant_keys[index]].priority_queue
+    _choose_worker(workers).priority_queue.put_nowait(priority, item)
+    if item.get('line_id'):
+        IN_FLIGHT_LINES[item['line_id']] = trio.current_time()
+
 
-    queue.put_nowait(priority, item)
+def _get_total_queue_size():
+    return sum([w.priority_queue.queue_size for w in WORKERS.values()])
 
 
 async def submit_items(items):
-    actor_name = tractor.current_actor().name
+    """ returns the total number of items queued in this actor-process """
     for item in items:
-        await _triage_item_to_worker(item, actor_name)
-
-'''
-async def fetch_queue_sizes():
-    global ACTOR_QUEUES
-
-    actor_name = tractor.current_actor().name
-
-    queue_sizes = {k: len(q) for (k, q) in ACTOR_QUEUES.items()}
-    return (actor_name, queue_sizes)
-'''
-
+        await _triage_item_to_worker(item)
+    return _get_total_queue_size()
 
-async def _pop_and_move_item(worker_obj):
 
-    q = worker_obj.priority_queue
-    if q.queue_size > 3000:
-        # no point in proceeding, the worker's send_channel is most likely blocked
-        return False
+async def fetch_queue_size():
+    return _get_total_queue_size()
 
-    try:
-        priority, item = q.get_nowait()
-    except trio.WouldBlock:
-        return True
 
-    try:
-        worker_obj.send_channel.send_nowait(item)
-    except trio.WouldBlock:
-        # put back on queue
-        q.put_nowait(priority, item)
-        await trio.sleep(0.2)
+async def daemon__refresh_in_flight_lines(redis_stream_name, consumer_group_name):
+    """
+    Items can wait in the queues far longer than PENDING_IDLE_MS (e.g. behind thousands
+    of slow friend_ids pages), so the idle time of their lines is reset periodically,
+    otherwise the forwarder would re-route (and eventually dead-letter) healthy lines.
+    If the actor crashes the refreshes stop, and its lines are re-routed as before.
+    """
+    # note: lines are owned by the forwarder's consumer, XCLAIM ... JUSTID keeps it that way
+    redis_stream = RedisGroupStreamClient(redis_stream_name, consumer_group_name, CONSUMER_NAME)
 
-    return False  # 'was_empty'
-
-
-async def daemon__move_items_from_queues_to_channels():
-    global WORKERS
-
-    last_successful_get = {}
     while True:
-        now = datetime.datetime.now()
-        was_empty = {}
-        for key, worker_obj in WORKERS.items():
-            was_empty[key] = await _pop_and_move_item(worker_obj)
-            if was_empty[key] is False:
-                last_successful_get[key] = now
+        await trio.sleep(IN_FLIGHT_REFRESH_INTERVAL)
 
-        for k, dt in last_successful_get.items():
-            if dt is not None and (now-dt).seconds > 40:
-                print(f"flushing: {k}")
-                flush_item = {'flush_group': True, 'work_type': k[2]}
-                await WORKERS[k].send_channel.send(flush_item)
-                last_successful_get[k] = None
+        min_queued_at = trio.current_time() - IN_FLIGHT_MAX_AGE
+        for line_id, queued_at in list(IN_FLIGHT_LINES.items()):
+            if queued_at < min_queued_at:
+                del IN_FLIGHT_LINES[line_id]
 
-        if all(was_empty.values()):
-            # all priority_queues were empty on this iteration, so wait
-            await trio.sleep(0.3)
+        line_ids = list(IN_FLIGHT_LINES.keys())
+        try:
+            for i in range(0, len(line_ids), IN_FLIGHT_REFRESH_COUNT):
+                await redis_stream.refresh_pending(*line_ids[i:i+IN_FLIGHT_REFRESH_COUNT])
+        except Exception as e:
+            print(f"warning: failed to refresh in-flight lines: {e}")
 
 
 async def actor_main(
@@ -162,13 +158,25 @@ async def actor_main(
 
     print(f"START: actor_daemon() in actor: {actor_name}")
 
+    # reflect the schema once for the whole actor-process, before any worker starts
+    await create_sqlalchemy_session()
+    global_ctx['db_pool'] = db_pool = AsyncDBPool()
+    global_ctx['identity_cache'] = identity_cache = IdentityCache(actor_name)
+    quota_ledger = QuotaLedger()
+
     async with trio.open_nursery() as n:
 
+        n.start_soon(db_pool.daemon__health_checks)
+        n.start_soon(identity_cache.daemon__report_stats)
+        n.start_soon(daemon__refresh_in_flight_lines, redis_stream_name, consumer_group_name)
+
         for work_type, worker_config in WORKER_TYPES.items():
 
             for account_key, account_details in api_keys.items():
 
                 twitter_session = TwitterHttpSession.create_from_account_dict(account_details)
+                twitter_session.account_key = account_key
+                twitter_session.quota_ledger = quota_ledger
 
                 num_workers_per_account = worker_config.num_workers_per_account
                 if twitter_session.http_session.proxy_url is not None:
@@ -193,9 +201,8 @@ async def actor_main(
                         worker_key, twitter_session, django_http_session=django_http_session
                     )
                     n.start_soon(w.worker_loop, global_ctx)
+                    n.start_soon(w.daemon__feed_batch_channel)
 
-        n.start_soon(
-            daemon__move_items_from_queues_to_channels
-        )
+        _build_routing_index()
 
     print(f"END: actor_daemon() in actor: {actor_name}")
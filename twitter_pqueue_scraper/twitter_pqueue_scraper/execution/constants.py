@@ -0,0 +1,15 @@
+'''
+Stream names and settings shared by the forwarder (main.py), the actors and the
+command line tools, kept here so the tools don't have to import main.py.
+'''
+import os
+
+
+REDIS_STREAM = 'twitter-items3'
+CONSUMER_GROUP = f"{REDIS_STREAM}-cg"
+DLQ_STREAM = f"{REDIS_STREAM}-dlq"
+CONSUMER_NAME = 'twitter-scraper-main'  # f"main-{uuid.uuid4().hex[:16]}"
+
+# pending (delivered but unacked) lines idle for this long are re-routed by the forwarder,
+# actors refresh the idle time of lines they still hold, see: actor.daemon__refresh_in_flight_lines()
+PENDING_IDLE_MS = int(os.environ.get('PENDING_IDLE_MS', 60 * 60 * 1000))
@@ -0,0 +1,65 @@
+import bisect
+import hashlib
+
+
+VNODES_PER_WEIGHT = 100  # virtual nodes per unit of weight, more vnodes = a more even spread
+
+
+def _hash(string):
+    return int(hashlib.md5(string.encode()).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """
+    Consistent-hash ring: each node (account_key) owns the arcs before its
+    virtual nodes, so adding or removing a node only moves the keys on its
+    own arcs (roughly 1/N of the keyspace) instead of remapping nearly every
+    key the way md5(key) % N does. A node with weight 2 gets twice the vnodes,
+    and so roughly twice the keys, of a node with weight 1.
+    """
+    def __init__(self, weights=None, vnodes_per_weight=VNODES_PER_WEIGHT):
+        self.vnodes_per_weight = vnodes_per_weight
+        self.weights = {}
+        self._hashes = []  # sorted
+        self._nodes = []  # node at the same index as its vnode's hash in self._hashes
+        for node, weight in (weights or {}).items():
+            self.add_node(node, weight)
+
+    def __len__(self):
+        return len(self.weights)
+
+    def __contains__(self, node):
+        return node in self.weights
+
+    @property
+    def nodes(self):
+        return sorted(self.weights.keys())
+
+    def _vnode_hashes(self, node, weight):
+        num_vnodes = max(1, int(round(weight * self.vnodes_per_weight)))
+        return [_hash(f"{node}#{i}") for i in range(num_vnodes)]
+
+    def add_node(self, node, weight=1):
+        if node in self.weights:
+            self.remove_node(node)
+        self.weights[node] = weight
+        for h in self._vnode_hashes(node, weight):
+            index = bisect.bisect(self._hashes, h)
+            self._hashes.insert(index, h)
+            self._nodes.insert(index, node)
+
+    def remove_node(self, node):
+        if node not in self.weights:
+            return
+        del self.weights[node]
+        keep = [(h, n) for h, n in zip(self._hashes, self._nodes) if n != node]
+        self._hashes = [h for h, _ in keep]
+        self._nodes = [n for _, n in keep]
+
+    def get_node(self, key):
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key))
+        if index == len(self._hashes):
+            index = 0  # wrap around the ring
+        return self._nodes[index]
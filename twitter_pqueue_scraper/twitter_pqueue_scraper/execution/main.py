@@ -1,7 +1,6 @@
 from collections import defaultdict
 import datetime
 import json
-import hashlib
 import os
 import random
 import uuid
@@ -10,17 +9,40 @@ from eliot import to_file as eliot_init_file
 import tractor
 import trio
 
-from twitter_pqueue_scraper.execution.actor import actor_main, submit_items
+from twitter_pqueue_scraper.execution.actor import (
+    actor_main, fetch_queue_size, submit_items
+)
+from twitter_pqueue_scraper.execution.constants import (
+    CONSUMER_GROUP, CONSUMER_NAME, DLQ_STREAM, PENDING_IDLE_MS, REDIS_STREAM
+)
+from twitter_pqueue_scraper.execution.scheduler import QuotaScheduler
 from twitter_pqueue_scraper.util.redis_util import RedisGroupStreamClient
+from twitter_pqueue_scraper.util.stream_retention import fetch_stream_stats, trim_stream
 
 
-REDIS_STREAM = 'twitter-items3'
-CONSUMER_GROUP = f"{REDIS_STREAM}-cg"
-CONSUMER_NAME = 'twitter-scraper-main'  # f"main-{uuid.uuid4().hex[:16]}"
-
 API_KEYS_FILEPATH = '/app/api-keys.json'
+API_KEYS_POLL_INTERVAL = 30  # seconds between checks for changes to api-keys.json
 NUM_ACCOUNTS_PER_ACTOR = 2  # adjusts the amount of async concurrency per actor-process
 
+# forwarding pipeline settings
+MIN_READ_COUNT = 50
+MAX_READ_COUNT = 1000
+READ_BLOCK_MS = 5000
+PORTAL_CHANNEL_SIZE = 4  # batches buffered per actor before the reader blocks
+MAX_SUBMIT_BATCH = 500  # queued batches are coalesced up to this many items
+ACTOR_QUEUE_HIGH_WATER = 3000  # stop feeding an actor while it has more items queued than this
+BACKPRESSURE_DELAY = 1
+METRICS_INTERVAL = 60
+
+# pending (delivered but unacked) line settings, see also: constants.PENDING_IDLE_MS
+MAX_DELIVERIES = 5  # lines delivered this many times without an ack are moved to DLQ_STREAM
+REAP_INTERVAL = 5 * 60
+REAP_CLAIM_COUNT = 200
+
+# stream retention settings, acked lines are kept for STREAM_RETENTION_SECONDS then trimmed
+STREAM_RETENTION_SECONDS = int(os.environ.get('STREAM_RETENTION_SECONDS', 60 * 60))
+TRIM_INTERVAL = 60
+
 
 def _get_routing_string(msg):
 
@@ -38,70 +60,353 @@ def _get_routing_string(msg):
     return st.strip()
 
 
-def _choose_account_key(routing_string, account_keys):
+class ForwardingMetrics(object):
 
-    num_workers = len(account_keys)
-    if num_workers == 1:
-        return account_keys[0]
+    def __init__(self, portal_names):
+        self.lines_routed = 0
+        self.pending = {name: 0 for name in portal_names}  # lines waiting in each portal's channel
+        self.max_lag = {name: 0.0 for name in portal_names}  # seconds from read to submit
+        self.last_report = trio.current_time()
 
-    h = hashlib.md5(routing_string.encode())
-    hsh = int(h.hexdigest(), 16)
-    index = hsh % num_workers
+    def add_portal(self, portal_name):
+        self.pending[portal_name] = 0
+        self.max_lag[portal_name] = 0.0
 
-    return account_keys[index]
+    def record_enqueued(self, portal_name, num_lines):
+        self.pending[portal_name] += num_lines
 
+    def record_submitted(self, portal_name, num_lines, enqueued_at):
+        self.pending[portal_name] -= num_lines
+        self.lines_routed += num_lines
+        lag = trio.current_time() - enqueued_at
+        self.max_lag[portal_name] = max(self.max_lag[portal_name], lag)
 
-async def daemon__forward_items(
-    portals, actor_names_by_accountkey
-):
+    def report(self):
+        now = trio.current_time()
+        lines_per_sec = self.lines_routed / max(now - self.last_report, 0.001)
+        per_portal = ', '.join([
+            f"{name}: pending={self.pending[name]} max_lag={self.max_lag[name]:.2f}s"
+            for name in sorted(self.pending.keys())
+        ])
+        print(f"forwarding: {lines_per_sec:.1f} lines/s, {per_portal}")
 
-    redis_stream = RedisGroupStreamClient(
-        REDIS_STREAM, CONSUMER_GROUP, CONSUMER_NAME
-    )
-    await redis_stream.xgroup_create()
+        self.lines_routed = 0
+        self.max_lag = {name: 0.0 for name in self.max_lag.keys()}
+        self.last_report = now
 
-    print('start flush')
-    await redis_stream.flush_old_lines()
-    print('end flush')
 
-    account_keys = [k for k in actor_names_by_accountkey.keys()]
-    account_keys.sort()
+async def daemon__report_metrics(metrics):
+    while True:
+        await trio.sleep(METRICS_INTERVAL)
+        metrics.report()
 
+
+def _next_read_count(count, num_read):
+    # grow while reads come back full, shrink towards what was actually available
+    if num_read >= count:
+        return min(count * 2, MAX_READ_COUNT)
+    return max(MIN_READ_COUNT, num_read)
+
+
+async def _route_lines(redis_stream, line_dicts, portal_names, actor_names_by_accountkey, scheduler):
+
+    to_submit = defaultdict(list)
+
+    for line_id, msg_dict in line_dicts.items():
+        msg_dict['line_id'] = line_id
+
+        if msg_dict.get('flush_group') or msg_dict.get('exit'):
+            # send flush/exit messages to all actors
+            for portal_name in portal_names:
+                to_submit[portal_name].append(msg_dict)
+            continue
+
+        routing_string = _get_routing_string(msg_dict)
+        if not routing_string:
+            print("warning: routing_string is blank, skipping item")
+            dedup_key = msg_dict.get('dedup_key')
+            await redis_stream.xack(line_id, dedup_keys=[dedup_key] if dedup_key else None)
+            continue
+        work_type = msg_dict.get('work_type')
+        if scheduler.is_sticky(work_type):
+            account_key = scheduler.choose_sticky_account_key(routing_string, work_type)
+        else:
+            account_key = scheduler.choose_account_key(work_type)  # most quota headroom
+        if account_key is None:
+            # note: left unacked, reap_pending_lines() re-routes it once an api key is added back
+            print(f"warning: no api accounts to route {line_id} to, leaving it pending")
+            continue
+        msg_dict['account_key'] = account_key  # key used to route to worker-task within actor-process
+        portal_name = actor_names_by_accountkey[account_key]
+        to_submit[portal_name].append(msg_dict)  # collect items into per-portal batches
+
+    return to_submit
+
+
+async def _send_to_portals(
+    redis_stream, send_channels, line_dicts, actor_names_by_accountkey, scheduler, metrics
+):
+    portal_names = list(send_channels.keys())  # actors can be added at runtime
+    to_submit = await _route_lines(
+        redis_stream, line_dicts, portal_names, actor_names_by_accountkey, scheduler
+    )
+    for portal_name, items in to_submit.items():
+        metrics.record_enqueued(portal_name, len(items))
+        # blocks when this actor's channel is full, which in turn
+        # stops the reader (backpressure all the way to redis)
+        await send_channels[portal_name].send((trio.current_time(), items))
+
+
+async def _read_and_route(
+    redis_stream, send_channels, actor_names_by_accountkey, scheduler, metrics
+):
+    count = MIN_READ_COUNT
     while True:
-        line_dicts, failed_ids = await redis_stream.xreadgroup()
+        line_dicts, failed_ids = await redis_stream.xreadgroup(
+            count=count, block=READ_BLOCK_MS
+        )
+        count = _next_read_count(count, len(line_dicts) + len(failed_ids))
         if not line_dicts:
-            await trio.sleep(0.3)
             continue
 
-        to_submit = defaultdict(list)
+        await _send_to_portals(
+            redis_stream, send_channels, line_dicts, actor_names_by_accountkey, scheduler, metrics
+        )
+
+
+async def reap_pending_lines(
+    redis_stream, send_channels, actor_names_by_accountkey, scheduler, metrics, min_idle_ms
+):
+    """
+    Re-routes lines that were delivered but not acked within min_idle_ms (e.g. an
+    actor crashed with them queued). Live actors keep refreshing the idle time of the
+    lines they still hold, so those aren't re-routed however long they wait. Lines that
+    have already been delivered MAX_DELIVERIES times are moved to DLQ_STREAM instead.
+    """
+    to_claim, num_dead = [], 0
+    async for line_id, _, idle_ms, delivery_count in redis_stream.fetch_pending_details(min_idle_ms):
+        if delivery_count >= MAX_DELIVERIES:
+            reason = f"not acked after {delivery_count} deliveries, idle for {idle_ms // 1000}s"
+            await redis_stream.move_to_dlq(DLQ_STREAM, line_id, reason, delivery_count)
+            num_dead += 1
+        else:
+            to_claim.append(line_id)
+
+    num_claimed = 0
+    for i in range(0, len(to_claim), REAP_CLAIM_COUNT):
+        line_dicts, failed_ids = await redis_stream.xclaim(
+            min_idle_ms, *to_claim[i:i+REAP_CLAIM_COUNT]
+        )
+        for line_id in failed_ids:
+            await redis_stream.move_to_dlq(DLQ_STREAM, line_id, 'failed to parse line')
+            num_dead += 1
+
+        control_ids = [
+            line_id for line_id, msg_dict in line_dicts.items()
+            if msg_dict.get('flush_group') or msg_dict.get('exit')
+        ]
+        if control_ids:
+            await redis_stream.xack(*control_ids)  # stale flush/exit messages are meaningless now
+        line_dicts = {k: v for k, v in line_dicts.items() if k not in control_ids}
+
+        if line_dicts:
+            num_claimed += len(line_dicts)
+            await _send_to_portals(
+                redis_stream, send_channels, line_dicts, actor_names_by_accountkey, scheduler, metrics
+            )
+
+    if num_claimed or num_dead:
+        print(f"pending lines: {num_claimed} re-routed, {num_dead} moved to {DLQ_STREAM}")
+
+
+async def daemon__reap_pending_lines(
+    redis_stream, send_channels, actor_names_by_accountkey, scheduler, metrics
+):
+    while True:
+        await trio.sleep(REAP_INTERVAL)
+        await reap_pending_lines(
+            redis_stream, send_channels, actor_names_by_accountkey, scheduler, metrics,
+            PENDING_IDLE_MS
+        )
+
+
+async def daemon__trim_stream(redis_stream):
+    while True:
+        try:
+            num_trimmed = await trim_stream(redis_stream, STREAM_RETENTION_SECONDS * 1000)
+            for stream_name in (REDIS_STREAM, DLQ_STREAM):
+                num_lines, memory_bytes = await fetch_stream_stats(redis_stream.redis_cli, stream_name)
+                print(f"stream {stream_name}: {num_lines} lines, {memory_bytes / 1024 / 1024:.1f}MB")
+            if num_trimmed:
+                print(f"trimmed {num_trimmed} acked lines from {REDIS_STREAM}")
+        except Exception as e:
+            print(f"warning: failed to trim stream: {e}")
+        await trio.sleep(TRIM_INTERVAL)
+
+
+async def _submit_to_portal(portal_name, portal, receive_channel, metrics):
+
+    async with receive_channel:
+        async for enqueued_at, items in receive_channel:
+
+            # coalesce any batches that queued up while the previous submit was running
+            while len(items) < MAX_SUBMIT_BATCH:
+                try:
+                    _, more_items = receive_channel.receive_nowait()
+                except trio.WouldBlock:
+                    break
+                items = items + more_items
+
+            queue_size = await portal.run(submit_items, items=items)
+            metrics.record_submitted(portal_name, len(items), enqueued_at)
+
+            while queue_size > ACTOR_QUEUE_HIGH_WATER:
+                await trio.sleep(BACKPRESSURE_DELAY)
+                queue_size = await portal.run(fetch_queue_size)
+
+
+def _get_account_weight(account_dict):
+    # optional, e.g. "weight": 2 for an account with twice the default rate limits
+    return float(account_dict.get('weight', 1))
+
+
+async def _launch_actors(actor_nursery, twitter_api_keys, portals, actor_names_by_accountkey):
+    """ assigns api keys to new actor-processes, returns {actor_name: portal} of those launched """
+    launched = {}
+    _account_keys = [k for k in twitter_api_keys.keys()]
+
+    while _account_keys:
+        proc_api_keys = {}
+        for i in range(NUM_ACCOUNTS_PER_ACTOR):
+            if not _account_keys:
+                break
+            k = _account_keys.pop(0)
+            proc_api_keys[k] = twitter_api_keys[k]
+
+        actor_name = f"proc-{len(portals)}"
+        portals[actor_name] = launched[actor_name] = await _launch_actor(
+            actor_name, actor_nursery, proc_api_keys
+        )
+
+        for key in proc_api_keys.keys():
+            actor_names_by_accountkey[key] = actor_name
+
+    return launched
+
+
+async def _get_api_keys_mtime():
+    try:
+        return await trio.to_thread.run_sync(os.path.getmtime, API_KEYS_FILEPATH)
+    except OSError:
+        return None
+
+
+async def daemon__watch_api_keys(
+    actor_nursery, twitter_api_keys, portals, actor_names_by_accountkey, scheduler, add_portal
+):
+    """ adds/removes accounts when api-keys.json changes, without a restart """
+    prev_mtime = await _get_api_keys_mtime()
+    current_keys = dict(twitter_api_keys)
+
+    while True:
+        await trio.sleep(API_KEYS_POLL_INTERVAL)
+        mtime = await _get_api_keys_mtime()
+        if mtime is None or mtime == prev_mtime:
+            continue
+        prev_mtime = mtime
+
+        api_keys = await _load_api_keys()
+        if not api_keys or not api_keys.get('twitter'):
+            print(f"warning: ignoring invalid or empty api-keys.json: {API_KEYS_FILEPATH}")
+            continue
+        new_keys = api_keys['twitter']
+
+        for account_key in set(current_keys) - set(new_keys):
+            # note: its actor keeps running, any items already routed to it are still processed
+            print(f"api key removed: {account_key}")
+            scheduler.remove_account(account_key)
+
+        to_launch = {}
+        for account_key, account_dict in new_keys.items():
+            if account_key in actor_names_by_accountkey:
+                # existing (or re-added) key, its weight may have changed
+                scheduler.set_account(account_key, _get_account_weight(account_dict))
+            else:
+                to_launch[account_key] = account_dict
+
+        if to_launch:
+            print(f"api keys added: {sorted(to_launch.keys())}")
+            launched = await _launch_actors(
+                actor_nursery, to_launch, portals, actor_names_by_accountkey
+            )
+            for portal_name, portal in launched.items():
+                add_portal(portal_name, portal)
+            for account_key, account_dict in to_launch.items():
+                scheduler.set_account(account_key, _get_account_weight(account_dict))
+
+        current_keys = dict(new_keys)
 
-        for line_id, msg_dict in line_dicts.items():
-            msg_dict['line_id'] = line_id
 
-            if msg_dict.get('flush_group') or msg_dict.get('exit'):
-                # send flush/exit messages to all actors
-                for portal_name in portals.keys():
-                    to_submit[portal_name].append(msg_dict)
-                continue
+async def daemon__forward_items(
+    actor_nursery, twitter_api_keys, portals, actor_names_by_accountkey
+):
 
-            routing_string = _get_routing_string(msg_dict)
-            if not routing_string:
-                print("warning: routing_string is blank, skipping item")
-                await redis_stream.xack(line_id)
-                continue
-            account_key = _choose_account_key(routing_string, account_keys)
-            msg_dict['account_key'] = account_key  # key used to route to worker-task within actor-process
-            portal_name = actor_names_by_accountkey[account_key]
-            to_submit[portal_name].append(msg_dict)  # collect items into per-portal batches
+    redis_stream = RedisGroupStreamClient(
+        REDIS_STREAM, CONSUMER_GROUP, CONSUMER_NAME
+    )
+    await redis_stream.xgroup_create()
 
-        for portal_name, items in to_submit.items():
-            p = portals[portal_name]
-            await p.run(submit_items, items=items)
+    metrics = ForwardingMetrics(portals.keys())
+
+    scheduler = QuotaScheduler({
+        k: _get_account_weight(d) for k, d in twitter_api_keys.items()
+    })
+    await scheduler.refresh()
+
+    async with trio.open_nursery() as n:
+        # one bounded channel and sender task per actor, so a slow
+        # actor doesn't hold up routing to the others
+        send_channels = {}
+
+        def _add_portal(portal_name, portal):
+            send_chan, receive_chan = trio.open_memory_channel(PORTAL_CHANNEL_SIZE)
+            send_channels[portal_name] = send_chan
+            metrics.add_portal(portal_name)
+            n.start_soon(_submit_to_portal, portal_name, portal, receive_chan, metrics)
+
+        for portal_name, portal in portals.items():
+            _add_portal(portal_name, portal)
+
+        n.start_soon(daemon__report_metrics, metrics)
+        n.start_soon(scheduler.daemon__seed_capacities)
+        n.start_soon(scheduler.daemon__refresh_headroom)
+        n.start_soon(
+            daemon__watch_api_keys, actor_nursery, twitter_api_keys, portals,
+            actor_names_by_accountkey, scheduler, _add_portal
+        )
+
+        # anything still pending at startup was lost with the previous run's actors,
+        # re-route it before reading new lines (so new lines aren't claimed twice)
+        print('start re-routing pending lines')
+        await reap_pending_lines(
+            redis_stream, send_channels, actor_names_by_accountkey, scheduler, metrics, 0
+        )
+        print('end re-routing pending lines')
+
+        n.start_soon(daemon__trim_stream, redis_stream)
+        n.start_soon(
+            daemon__reap_pending_lines, redis_stream, send_channels,
+            actor_names_by_accountkey, scheduler, metrics
+        )
+        n.start_soon(
+            _read_and_route, redis_stream, send_channels,
+            actor_names_by_accountkey, scheduler, metrics
+        )
 
     print("FINISHED: daemon__forward_items")
 
 
-async def get_api_keys():
+async def _load_api_keys():
 
     def _get_api_keys():
         with open(API_KEYS_FILEPATH) as f:
@@ -110,7 +415,12 @@ async def get_api_keys():
             except:
                 return None
 
-    api_keys = await trio.to_thread.run_sync(_get_api_keys)
+    return await trio.to_thread.run_sync(_get_api_keys)
+
+
+async def get_api_keys():
+
+    api_keys = await _load_api_keys()
 
     if api_keys is None:
         exit(f"failed to open api-keys.json file: {API_KEYS_FILEPATH}")
@@ -145,27 +455,13 @@ async def main():
             main_actor_name = tractor.current_actor().name
             print(f"main actor: {main_actor_name}")
 
-            _account_keys = [k for k in TWITTER_API_KEYS.keys()]
-
-            while _account_keys:
-                # assign API keys to actor-processes
-                proc_api_keys = {}
-                for i in range(NUM_ACCOUNTS_PER_ACTOR):
-                    if not _account_keys:
-                        break
-                    k = _account_keys.pop(0)
-                    proc_api_keys[k] =TWITTER_API_KEYS[k]
-
-                actor_name = f"proc-{len(portals)}"
-                portals[actor_name] = await _launch_actor(
-                    actor_name, actor_nursery, proc_api_keys
-                )
-
-                for key in proc_api_keys.keys():
-                    actor_names_by_accountkey[key] = actor_name
+            await _launch_actors(
+                actor_nursery, TWITTER_API_KEYS, portals, actor_names_by_accountkey
+            )
 
             task_nursery.start_soon(
-                daemon__forward_items, portals, actor_names_by_accountkey
+                daemon__forward_items, actor_nursery, TWITTER_API_KEYS,
+                portals, actor_names_by_accountkey
             )
 
 
@@ -0,0 +1,60 @@
+import heapq
+import itertools
+
+import trio
+
+
+class AwaitablePriorityQueue(object):
+    """
+    Drop-in for trio_util's PriorityQueue (put_nowait/get_nowait/queue_size)
+    that also has an awaitable get(), so a consumer is woken when an item
+    arrives instead of polling. Lower priority values are popped first,
+    items with equal priority are popped in FIFO order.
+    """
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._waiters = trio.lowlevel.ParkingLot()
+
+    @property
+    def queue_size(self):
+        return len(self._heap)
+
+    def put_nowait(self, priority, item):
+        heapq.heappush(self._heap, (priority, next(self._counter), item))
+        self._waiters.unpark()
+
+    def get_nowait(self):
+        if not self._heap:
+            raise trio.WouldBlock
+        priority, _, item = heapq.heappop(self._heap)
+        return priority, item
+
+    async def get(self):
+        await trio.lowlevel.checkpoint()
+        while not self._heap:
+            await self._waiters.park()
+        return self.get_nowait()
+
+
+async def feed_channel_from_queue(queue, send_channel, idle_timeout, on_idle):
+    """
+    Moves items from queue to send_channel as they arrive. send() blocks
+    while the channel is full, which holds items back in the priority queue.
+    on_idle() is awaited once after idle_timeout seconds without an item
+    (and not again until another item has been moved).
+    """
+    moved_since_idle = False
+    while True:
+        with trio.move_on_after(idle_timeout) as cancel_scope:
+            priority, item = await queue.get()
+
+        if cancel_scope.cancelled_caught:
+            if moved_since_idle:
+                await on_idle()
+                moved_since_idle = False
+            continue
+
+        # note: outside the timeout's scope, a cancelled send() would lose the item
+        await send_channel.send(item)
+        moved_since_idle = True
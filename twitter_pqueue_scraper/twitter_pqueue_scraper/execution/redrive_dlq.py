@@ -0,0 +1,59 @@
+'''
+Moves lines from the dead-letter stream back onto the work stream, where they
+are delivered as new lines (with a fresh delivery count):
+
+    python -m twitter_pqueue_scraper.execution.redrive_dlq [max_lines] [work_type]
+'''
+import sys
+
+import redio
+import trio
+
+from twitter_pqueue_scraper.execution.constants import DLQ_STREAM, REDIS_STREAM
+from twitter_pqueue_scraper.util.redis_util import REDIS_URL, RedisGroupStreamClient
+
+
+READ_COUNT = 200
+
+
+def _get_work_type(line_id, values):
+    parse_success, _, value_dict = RedisGroupStreamClient.parse_line((line_id, values))
+    return value_dict.get('work_type') if parse_success else None
+
+
+async def redrive(max_lines=None, work_type=None):
+
+    redis_cli = redio.Redis(REDIS_URL)
+
+    start_id, num_redriven, num_skipped = '-', 0, 0
+    while max_lines is None or num_redriven < max_lines:
+        lines = await redis_cli().xrange(DLQ_STREAM, start_id, '+', 'COUNT', str(READ_COUNT))
+        if not lines:
+            break
+        start_id = '(' + lines[-1][0].decode()
+
+        for line_id, values in lines:
+            if max_lines is not None and num_redriven >= max_lines:
+                break
+            if work_type and _get_work_type(line_id, values) != work_type:
+                num_skipped += 1
+                continue
+
+            # note: values are copied as-is (already serialized, v1 or v2), minus the dlq_* fields
+            field_values = []
+            for key, val in zip(values[::2], values[1::2]):
+                if not key.startswith(b'dlq_'):
+                    field_values.extend([key, val])
+
+            await redis_cli().xadd(REDIS_STREAM, '*', *field_values)
+            await redis_cli().xdel(DLQ_STREAM, line_id)
+            num_redriven += 1
+
+    print(f"re-drove {num_redriven} lines from {DLQ_STREAM} to {REDIS_STREAM} ({num_skipped} skipped)")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    _max_lines = int(args[0]) if args else None
+    _work_type = args[1] if len(args) > 1 else None
+    trio.run(redrive, _max_lines, _work_type)
@@ -0,0 +1,131 @@
+import os
+
+import msgpack
+import trio
+
+from trio_util.http_util import TrioHttpSession
+
+from twitter_pqueue_scraper.execution.hash_ring import HashRing
+from twitter_pqueue_scraper.util.quota import (
+    ENDPOINT_QUOTAS, ENDPOINT_SLUGS_BY_WORK_TYPE, QuotaLedger
+)
+
+
+DJANGO_HOSTNAME = os.environ.get('DJANGO_SERVER_HOSTNAME', 'localhost')
+DJANGO_PORT = os.environ.get('DJANGO_SERVER_PORT', '8000')
+QUOTA_PERIODS_URL = f"http://{DJANGO_HOSTNAME}:{DJANGO_PORT}/current-quota-periods"
+
+QUOTA_REFRESH_INTERVAL = 5  # seconds between reads of the redis usage counters
+QUOTA_SEED_INTERVAL = 15 * 60  # seconds between fetches of the webserver's ApiQuotaPeriods
+
+# cursored jobs keep going to the same account, via the hash ring
+STICKY_WORK_TYPES = ('friend_ids', 'follower_ids')
+
+# rough number of api requests an item will use, debited from the chosen
+# account's headroom until the next refresh reads the real usage from redis
+ITEM_COSTS = {
+    'user_info': 0.01,  # 100 profiles per users/lookup request
+    'user_timeline': 2,
+    'user_likes': 2,
+    'conversation_tweets': 2,
+}
+
+
+async def fetch_quota_capacities(account_keys):
+    """
+    returns {(account_key, endpoint_slug, duration_slug): units} for the current
+    ApiQuotaPeriods, periods missing on the webserver fall back to ENDPOINT_QUOTAS
+
+    note: these are the periods' limits, not units_remaining, the ledger subtracts
+    the redis usage counters from them itself
+    """
+    http_session = TrioHttpSession(ssl=False, verify=False)
+    endpoint_slugs = sorted(set([e for e, _, _ in ENDPOINT_QUOTAS]))
+
+    capacities = {}
+    for account_key in account_keys:
+        for endpoint_slug in endpoint_slugs:
+            url = f"{QUOTA_PERIODS_URL}/twitter/{endpoint_slug}/{account_key}"
+            try:
+                status, _, resp_obj = await http_session.get(url)
+            except Exception as e:
+                print(f"warning: failed to fetch quota periods ({e}), using defaults")
+                return capacities
+            if status != 200:
+                continue
+            for period in msgpack.loads(resp_obj.content, timestamp=3):
+                if period.get('units_total') is None:
+                    continue
+                key = (account_key, endpoint_slug, period['duration'])
+                capacities[key] = period['units_total']
+
+    return capacities
+
+
+class QuotaScheduler(object):
+    """
+    Chooses the account with the most quota headroom for each item's endpoint.
+    Headroom is read from the redis usage counters that actors debit as they
+    send requests (see: util/quota.QuotaLedger). Sticky work types are routed
+    with a consistent-hash ring instead, weighted by account_weights.
+    """
+    def __init__(self, account_weights, ledger=None):
+        self.ring = HashRing(account_weights)
+        self.account_keys = self.ring.nodes
+        self.ledger = ledger or QuotaLedger()
+        self.headroom = {}  # (account_key, endpoint_slug) -> units
+
+    def set_account(self, account_key, weight=1):
+        """ adds an account, or changes its weight, only its share of the ring moves """
+        self.ring.add_node(account_key, weight)
+        self.account_keys = self.ring.nodes
+
+    def remove_account(self, account_key):
+        self.ring.remove_node(account_key)
+        self.account_keys = self.ring.nodes
+
+    def is_sticky(self, work_type):
+        return work_type in STICKY_WORK_TYPES or work_type not in ENDPOINT_SLUGS_BY_WORK_TYPE
+
+    def choose_account_key(self, work_type):
+        """ returns None when there are no accounts, e.g. after the last api key was removed """
+        if not self.account_keys:
+            return None
+        endpoint_slug = ENDPOINT_SLUGS_BY_WORK_TYPE[work_type]
+        account_key = max(
+            self.account_keys, key=lambda k: self.headroom.get((k, endpoint_slug), 0)
+        )
+        self.record_routed(account_key, work_type)
+        return account_key
+
+    def choose_sticky_account_key(self, routing_string, work_type):
+        account_key = self.ring.get_node(routing_string)
+        if account_key is None:
+            return None  # empty ring
+        self.record_routed(account_key, work_type)
+        return account_key
+
+    def record_routed(self, account_key, work_type):
+        endpoint_slug = ENDPOINT_SLUGS_BY_WORK_TYPE.get(work_type)
+        if endpoint_slug is None:
+            return
+        route = (account_key, endpoint_slug)
+        self.headroom[route] = self.headroom.get(route, 0) - ITEM_COSTS.get(work_type, 1)
+
+    async def refresh(self):
+        self.headroom = await self.ledger.fetch_remaining(self.account_keys)
+
+    async def daemon__refresh_headroom(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"warning: failed to refresh quota headroom: {e}")
+            await trio.sleep(QUOTA_REFRESH_INTERVAL)
+
+    async def daemon__seed_capacities(self):
+        while True:
+            capacities = await fetch_quota_capacities(self.account_keys)
+            if capacities:
+                self.ledger.capacities = capacities
+            await trio.sleep(QUOTA_SEED_INTERVAL)
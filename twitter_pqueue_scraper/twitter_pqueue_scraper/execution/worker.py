@@ -3,9 +3,12 @@ import os
 import random
 
 import redio
+import trio
 from trio_util.pqueue_workers.items import ControlItem
-from trio_util.pqueue_workers.pqueue import PriorityQueue
 from trio_util.pqueue_workers.worker_groups import BatchWorker
+from twitter_pqueue_scraper.execution.pqueue import (
+    AwaitablePriorityQueue, feed_channel_from_queue
+)
 from twitter_pqueue_scraper.util.redis_util import RedisGroupStreamClient
 from twitter_pqueue_scraper.util.db_util import create_sqlalchemy_session
 from twitter_pqueue_scraper.util.items import (
@@ -13,6 +16,13 @@ from twitter_pqueue_scraper.util.items import (
 )
 
 
+IDLE_FLUSH_DELAY = 40  # seconds without new items before a partial batch is flushed
+
+# a per process index of the lines queued in this actor's workers and not acked yet,
+# line_id -> trio time it was queued, see: actor.daemon__refresh_in_flight_lines()
+IN_FLIGHT_LINES = {}
+
+
 class TwitterWorker(BatchWorker):
 
     def __init__(
@@ -26,15 +36,38 @@ class TwitterWorker(BatchWorker):
         self.worker_key = worker_key
         self.twitter_session = twitter_session
         self.django_http_session = django_http_session
-        self.priority_queue = PriorityQueue()
+        self.priority_queue = AwaitablePriorityQueue()
 
         super(TwitterWorker, self).__init__(worker_name, worker_config)
 
+    @property
+    def queue_load(self):
+        # items waiting in the priority queue plus those buffered in the batch channel
+        channel_stats = self.send_channel.statistics()
+        return self.priority_queue.queue_size + channel_stats.current_buffer_used
+
+    async def daemon__feed_batch_channel(self):
+        # wakes when an item is queued, replacing the old round-robin polling
+        # of every worker's queue in daemon__move_items_from_queues_to_channels()
+        await feed_channel_from_queue(
+            self.priority_queue, self.send_channel, IDLE_FLUSH_DELAY,
+            self._flush_idle_batch
+        )
+
+    async def _flush_idle_batch(self):
+        print(f"flushing: {self.worker_key}")
+        flush_item = {'flush_group': True, 'work_type': self.worker_key[2]}
+        await self.send_channel.send(flush_item)
+
     async def setup_worker_resources(self, global_ctx):
         # called from within self.worker_loop()
 
-        # todo: should we place these on the group-level to lower number of connections?
+        # note: sessions share the actor-process's engine and connection pool
         self.db_connection = await create_sqlalchemy_session()
+        self.db_pool = global_ctx['db_pool']
+        self.identity_cache = global_ctx['identity_cache']
+        # the session isn't safe for concurrent use, so concurrently fetched pages ingest one at a time
+        self.db_lock = trio.Lock()
         self.redis_stream = RedisGroupStreamClient(
             self.redis_stream_name, self.consumer_group_name, None
         )
@@ -51,7 +84,11 @@ class TwitterWorker(BatchWorker):
         if not succ:
             print(f'error: invalid item_dict: {item_dict}')
             if item_dict.get('line_id'):
-                await self.redis_stream.xack(item.line_id)
+                dedup_key = item_dict.get('dedup_key')
+                await self.redis_stream.xack(
+                    item_dict['line_id'], dedup_keys=[dedup_key] if dedup_key else None
+                )
+                IN_FLIGHT_LINES.pop(item_dict['line_id'], None)
 
         return succ, item_obj
 
@@ -59,4 +96,9 @@ class TwitterWorker(BatchWorker):
         line_ids = [item.line_id for item in curr_batch if item.line_id]
         if not line_ids:
             return
-        await self.redis_stream.xack(*line_ids)
+        dedup_keys = [
+            item.dedup_key for item in curr_batch if getattr(item, 'dedup_key', None)
+        ]
+        await self.redis_stream.xack(*line_ids, dedup_keys=dedup_keys)
+        for line_id in line_ids:
+            IN_FLIGHT_LINES.pop(line_id, None)
@@ -1,83 +1,23 @@
-import json
-import re
-
 from twitter_pqueue_scraper.ingestion.deferred_models import (
     DeferredTweet, DeferredReplyRel, DeferredRetweetRel, DeferredLikeRel,
     DeferredTwitterProfile, DeferredProfileMentionedInTweet
 )
 from twitter_pqueue_scraper.batch_tasks.util import parse_date_str
+from twitter_pqueue_scraper.ingestion.tweet_features import get_tweet_features, normalize_text
+from twitter_pqueue_scraper.util.json_util import dumps as json_dumps
 
 
-# for tips on how to preprocess tweet text for NLP, see page 4 here: https://arxiv.org/pdf/1708.03994.pdf
 def remove_links_and_mentions(tweet_di):
-
-    text = tweet_di['text'].strip()
-    if text.startswith('RT @'):
-        if text.rstrip() == 'RT @':
-            return ''
-        try:
-            text = text.lstrip('RT @').split(' ', 1)[1]
-        except:
-            import pdb; pdb.set_trace()
-            print()
-
-    # remove mentions
-    text = re.sub(r'@\w{1,15}', '', text, flags=re.I).strip()
-
-    # what about hashtags?
-
     urls = tweet_di.get('entities', {}).get('urls') or []
-    # urls = tweet_di['entities']['urls']
-
-    text_no_links = text
-    for url_di in urls:
-        text_no_links = text_no_links.replace(url_di['url'], '')
-    text_no_links = re.sub(re.escape('https://') + r'[^\s]+', ' ', text_no_links).strip()
-
-    for punc in (',', ':', '.', '?', '!'):
-        text_no_links = text_no_links.replace(punc, ' ')
-
-    text_no_links = re.sub(r'\s+', ' ', text_no_links).strip()
-    text_no_links = text_no_links.strip()
-
-    return text_no_links
+    return normalize_text(tweet_di['text'], urls)
 
 
 def get_status_type(tweet_di):
-
-    text = tweet_di['text']
-    urls = tweet_di.get('entities', {}).get('urls') or []
-
-    if len(urls) == 1 and urls[0]['url'] == text:
-        return 'link-only-status'
-
-    for media_di in tweet_di.get('entities', {}).get('media', []):
-        if media_di['url'] == text:
-            return 'media-object-status'  # media_di['type']
-
-    if not urls:
-        return 'text-only-status'
-
-    text_without_links = remove_links_and_mentions(tweet_di)
-
-    if not text_without_links:
-        return 'link-only-status'  # note: could be more than one link here
-    return 'text-with-link'
+    return get_tweet_features(tweet_di).status_type
 
 
 def get_tweet_scenario(timeline_tweet):
-    text = timeline_tweet['text'].strip()
-
-    if timeline_tweet['is_quote_status']:
-        return 'retweet-with-quote'
-    if timeline_tweet.get('retweeted_status'):
-        return 'retweet'     # if text.startswith('RT @'):
-    if timeline_tweet['in_reply_to_status_id_str'] is not None:
-        # don't use 'in_reply_to_user_id_str' because this gets set when a status
-        # begins with an @ mention, even though it's not a reply on a thread.
-        return 'reply'
-
-    return get_status_type(timeline_tweet)
+    return get_tweet_features(timeline_tweet).scenario
 
 
 def _create_deferred_replyto_tweet(tweet_di):
@@ -93,37 +33,30 @@ def _create_deferred_blank_quoted_tweet(id_str):
     )
 
 
-def _create_deferred_tweet(tweet_di, scrape_source):
-
-    if tweet_di['in_reply_to_status_id_str']:
-        tweet_type = 'reply'
-    elif tweet_di['is_quote_status']:
-        tweet_type = 'quote'
-    else:
-        tweet_type = 'status'
+def _create_deferred_tweet(tweet_di, scrape_source, features=None):
 
-    has_link = bool(tweet_di.get('entities', {}).get('urls'))
-    has_text = bool(remove_links_and_mentions(tweet_di))
+    if features is None:
+        features = get_tweet_features(tweet_di)
 
     def_tweet = DeferredTweet(
-        tweet_di['id_str'], json.dumps(tweet_di), scrape_source,
-        tweet_type, has_link, has_text, None, tweet_di['user']['id_str'],
-        None, parse_date_str(tweet_di['created_at'])
+        tweet_di['id_str'], json_dumps(tweet_di), scrape_source,
+        features.tweet_type, features.has_link, features.has_text, None,
+        tweet_di['user']['id_str'], None, parse_date_str(tweet_di['created_at'])
     )
     return def_tweet
 
 
-def _create_deferred_mentions(tweet_di):
+def _create_deferred_mentions(tweet_di, features):
 
     profiles, mention_rels = [], []
 
-    for profile_di in tweet_di.get('entities', {}).get('user_mentions', []):
+    for user_id, _ in features.mentions:
         profiles.append(
-            DeferredTwitterProfile(profile_di['id_str'], None, None)
+            DeferredTwitterProfile(user_id, None, None)
         )
         mention_rels.append(
             DeferredProfileMentionedInTweet(
-                profile_di['id_str'], None, tweet_di['id_str'], None
+                user_id, None, tweet_di['id_str'], None
             )
         )
     return profiles, mention_rels
@@ -131,13 +64,15 @@ def _create_deferred_mentions(tweet_di):
 
 def create_deferred_models(user_id, tweet_di, scenario=None):
 
+    # note: the features of tweet_di are computed once, nested tweets have their own
+    features = get_tweet_features(tweet_di)
     if scenario is None:
-        scenario = get_tweet_scenario(tweet_di)
+        scenario = features.scenario
 
-    def_profiles, def_mention_rels = _create_deferred_mentions(tweet_di)
+    def_profiles, def_mention_rels = _create_deferred_mentions(tweet_di, features)
 
     if scenario == 'user-like':
-        def_tweet = _create_deferred_tweet(tweet_di, 'user-like')
+        def_tweet = _create_deferred_tweet(tweet_di, 'user-like', features)
         def_like_rel = DeferredLikeRel(
             def_tweet.tweet_api_id, None, user_id, None,
             tweet_di['id_str'], parse_date_str(tweet_di['created_at'])
@@ -158,7 +93,7 @@ def create_deferred_models(user_id, tweet_di, scenario=None):
     if scenario == 'retweet-with-quote':
 
         if 'quoted_status' in tweet_di:
-            def_outer_tweet = _create_deferred_tweet(tweet_di, 'user-timeline')
+            def_outer_tweet = _create_deferred_tweet(tweet_di, 'user-timeline', features)
             def_inner_tweet = _create_deferred_tweet(
                 tweet_di['quoted_status'], 'user-timeline-quote'
             )
@@ -174,7 +109,7 @@ def create_deferred_models(user_id, tweet_di, scenario=None):
             # occurs when quoted status is "unavailable" and I've also found it to
             # happen when the user (whose timeline we're scraping) is quoting themselves?
             # (in which case it this blank tweet should get merged during deduplication)
-            def_outer_tweet = _create_deferred_tweet(tweet_di, 'user-timeline')
+            def_outer_tweet = _create_deferred_tweet(tweet_di, 'user-timeline', features)
             def_inner_tweet = _create_deferred_blank_quoted_tweet(
                 tweet_di['quoted_status_id_str']
             )
@@ -188,7 +123,7 @@ def create_deferred_models(user_id, tweet_di, scenario=None):
 
         else:
             # when quoted tweet is unavailable, I'm not sure why quoted_status_id_str exists only sometimes?
-            def_outer_tweet = _create_deferred_tweet(tweet_di, 'user-timeline')
+            def_outer_tweet = _create_deferred_tweet(tweet_di, 'user-timeline', features)
             return def_profiles + [def_outer_tweet] + def_mention_rels
 
     if scenario == 'reply':
@@ -197,7 +132,7 @@ def create_deferred_models(user_id, tweet_di, scenario=None):
             import pdb; pdb.set_trace()  # should never get here?
 
         def_replyto_tweet = _create_deferred_replyto_tweet(tweet_di)
-        def_reply_tweet = _create_deferred_tweet(tweet_di, 'user-timeline')
+        def_reply_tweet = _create_deferred_tweet(tweet_di, 'user-timeline', features)
         def_reply_rel = DeferredReplyRel(
             tweet_di['in_reply_to_status_id_str'], None,
             tweet_di['id_str'], None, parse_date_str(tweet_di['created_at'])
@@ -206,5 +141,5 @@ def create_deferred_models(user_id, tweet_di, scenario=None):
 
     else:
         # standalone status
-        def_tweet = _create_deferred_tweet(tweet_di, 'user-timeline')
+        def_tweet = _create_deferred_tweet(tweet_di, 'user-timeline', features)
         return def_profiles + [def_tweet] + def_mention_rels
@@ -1,21 +1,17 @@
-import json
-
-from twitter_pqueue_scraper.ingestion.create_deferred_models import remove_links_and_mentions, get_status_type
 from twitter_pqueue_scraper.ingestion.deferred_models import (
     DeferredReplyRel, DeferredTweet, DeferredTwitterProfile,
     DeferredRetweetRel, DeferredProfileMentionedInTweet, dedup_def_objects
 )
 from twitter_pqueue_scraper.batch_tasks.util import parse_date_str
+from twitter_pqueue_scraper.ingestion.tweet_features import get_tweet_features
+from twitter_pqueue_scraper.util.json_util import dumps as json_dumps
 
 
-def _create_deferred_mentions(tweet_di, users_by_id):
+def _create_deferred_mentions(tweet_di, features, users_by_id):
 
     def_objects = []
 
-    mentions = tweet_di.get('entities', {}).get('mentions') or []
-    mentions_sn = [di['username'].lower() for di in mentions]
-
-    for screen_name in mentions_sn:
+    for _, screen_name in features.mentions:
         user_id = users_by_id[screen_name]['id']
         def_objects.append(
             DeferredTwitterProfile(user_id, None, screen_name)
@@ -56,16 +52,13 @@ def _create_reply_rel(tweet_di, conversation_id, conversation_author, missing):
     return None
 
 
-def _create_single_deferred_tweet(tweet_di, conversation_id, tweet_type):
+def _create_single_deferred_tweet(tweet_di, conversation_id, tweet_type, features):
 
     scrape_source = 'recent-search-conversation'
 
-    has_link = bool(tweet_di.get('entities', {}).get('urls'))
-    has_text = bool(remove_links_and_mentions(tweet_di))
-
     def_tweet = DeferredTweet(
-        tweet_di['id'], json.dumps(tweet_di), scrape_source,
-        tweet_type, has_link, has_text, conversation_id,
+        tweet_di['id'], json_dumps(tweet_di), scrape_source,
+        tweet_type, features.has_link, features.has_text, conversation_id,
         tweet_di['author_id'], None, parse_date_str(tweet_di['created_at'])
     )
     return def_tweet
@@ -82,7 +75,8 @@ def _create_deferred_objects_for_tweet(
     tweets_by_id, users_by_id, is_reply
 ):
     author_id = tweet_di['author_id']
-    def_objects = _create_deferred_mentions(tweet_di, users_by_id)
+    features = get_tweet_features(tweet_di)
+    def_objects = _create_deferred_mentions(tweet_di, features, users_by_id)
 
     if is_reply:
         reply_rel = _create_reply_rel(
@@ -98,13 +92,13 @@ def _create_deferred_objects_for_tweet(
             break
 
     if quoted_status_id_str is None:
-        outer_tweet_type = 'reply' if is_reply else get_status_type(tweet_di)
+        outer_tweet_type = 'reply' if is_reply else features.status_type
     else:
         outer_tweet_type = 'reply-with-quote' if is_reply else 'retweet-with-quote'
 
     def_objects.append(
         _create_single_deferred_tweet(
-            tweet_di, conversation_id, outer_tweet_type
+            tweet_di, conversation_id, outer_tweet_type, features
         )
     )
     if author_id != conversation_author and author_id in users_by_id:
@@ -117,10 +111,11 @@ def _create_deferred_objects_for_tweet(
         return def_objects
 
     inner_tweet_di = tweets_by_id[quoted_status_id_str]
+    inner_features = get_tweet_features(inner_tweet_di)
     def_objects.append(
          _create_single_deferred_tweet(
             inner_tweet_di, conversation_id,
-            get_status_type(inner_tweet_di)
+            inner_features.status_type, inner_features
         )
     )
     author_id2 = inner_tweet_di['author_id']
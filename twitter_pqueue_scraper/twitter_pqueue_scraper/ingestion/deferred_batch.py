@@ -0,0 +1,196 @@
+'''
+Columnar (struct-of-arrays) form of the deferred models in deferred_models.py.
+
+A DeferredBatch holds one DeferredTable per model type, each table keeps a list per
+field rather than an object per row. Rows are keyed by a tuple of integer api ids
+(e.g. (tweet_api_id,) or (tweet_api_id, liked_by_user_id)), duplicates are merged a
+column at a time by dedup(), and the columns are COPY'd as-is into staging tables by
+ingest_plan.IngestPlan. Results match dedup_def_objects() followed by
+get_update_values(): the first non-None value of each field wins.
+'''
+from collections import defaultdict
+from operator import attrgetter
+
+from twitter_pqueue_scraper.ingestion.deferred_models import (
+    DeferredTwitterProfile, DeferredTweet, DeferredRetweetRel, DeferredReplyRel,
+    DeferredLikeRel, DeferredProfileMentionedInTweet,
+    DeferredProfileMentionedInProfileDescription
+)
+
+
+# (key fields, fallback field for rows without an api id)
+TABLE_KEYS = {
+    DeferredTwitterProfile: (('profile_api_id',), 'screen_name'),
+    DeferredTweet: (('tweet_api_id',), None),
+    DeferredRetweetRel: (('tweet_api_id', 'retweeted_by_user_id', 'retweet_api_id'), None),
+    DeferredProfileMentionedInTweet: (('mentioned_profile_api_id', 'tweet_api_id'), None),
+    DeferredProfileMentionedInProfileDescription: (('profile_api_id', 'mentioned_by_api_id'), None),
+    DeferredReplyRel: (('reply_to_api_id', 'reply_api_id'), None),
+    DeferredLikeRel: (('tweet_api_id', 'liked_by_user_id'), None),
+}
+
+# (api id field, db id field, 'tweet' or 'profile'), see: ingest_plan.IngestPlan
+FOREIGN_KEYS = {
+    DeferredTwitterProfile: [],
+    DeferredTweet: [('author_user_id', 'author_id', 'profile')],
+    DeferredRetweetRel: [
+        ('tweet_api_id', 'tweet_id', 'tweet'),
+        ('retweeted_by_user_id', 'retweeted_by_id', 'profile'),
+    ],
+    DeferredProfileMentionedInTweet: [
+        ('tweet_api_id', 'tweet_id', 'tweet'),
+        ('mentioned_profile_api_id', 'mentioned_profile_id', 'profile'),
+    ],
+    DeferredProfileMentionedInProfileDescription: [
+        ('profile_api_id', 'profile_id', 'profile'),
+        ('mentioned_by_api_id', 'mentioned_by_id', 'profile'),
+    ],
+    DeferredReplyRel: [
+        ('reply_to_api_id', 'reply_to_id', 'tweet'),
+        ('reply_api_id', 'reply_id', 'tweet'),
+    ],
+    DeferredLikeRel: [
+        ('tweet_api_id', 'tweet_id', 'tweet'),
+        ('liked_by_user_id', 'liked_by_id', 'profile'),
+    ],
+}
+
+
+def _to_int_keys(column):
+    if None not in column:
+        return list(map(int, column))
+    return [None if v is None else int(v) for v in column]
+
+
+class DeferredTable(object):
+
+    def __init__(self, DeferredClass):
+        self.DeferredClass = DeferredClass
+        self.fields = DeferredClass.get_fields()
+        self.columns = [[] for _ in self.fields]
+        self.get_row = attrgetter(*self.fields)
+
+        key_fields, fallback_field = TABLE_KEYS[DeferredClass]
+        self.key_idxs = [self.fields.index(fn) for fn in key_fields]
+        self.fallback_idx = None if fallback_field is None else self.fields.index(fallback_field)
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def column(self, field_name):
+        return self.columns[self.fields.index(field_name)]
+
+    def append(self, *values):
+        for column, value in zip(self.columns, values):
+            column.append(value)
+
+    def extend_rows(self, rows):
+        for column, values in zip(self.columns, zip(*rows)):
+            column.extend(values)
+
+    def _get_keys(self):
+        key_columns = [_to_int_keys(self.columns[i]) for i in self.key_idxs]
+        if self.fallback_idx is not None:
+            # e.g. a profile that only has a screen_name
+            fallback = self.columns[self.fallback_idx]
+            key_columns[0] = [
+                fb if k is None else k for k, fb in zip(key_columns[0], fallback)
+            ]
+        return list(zip(*key_columns))
+
+    def dedup(self):
+        """ merges rows with the same key into the first of them, in place """
+        num_rows = len(self)
+        keys = self._get_keys()
+
+        # iterating in reverse, the first row of each key is the one left in the dict
+        first_rows = dict(zip(reversed(keys), range(num_rows - 1, -1, -1)))
+        if len(first_rows) == num_rows:
+            return
+
+        owners = list(map(first_rows.__getitem__, keys))
+        dup_rows = [i for i, owner in enumerate(owners) if owner != i]
+        keep = sorted(first_rows.values())
+
+        for n, column in enumerate(self.columns):
+            if None in column:
+                for i in dup_rows:
+                    owner = owners[i]
+                    if column[owner] is None:
+                        column[owner] = column[i]
+            self.columns[n] = [column[i] for i in keep]
+
+    def get_value_dicts(self, tweets_by_api_id, profiles_by_userid):
+        """
+        same as get_update_values() on each row: api ids swapped for db ids, None values left out,
+        only used by benchmarks/deferred_models.py, IngestPlan stages the columns directly
+        """
+        lookups = {'tweet': tweets_by_api_id, 'profile': profiles_by_userid}
+        columns = dict(zip(self.fields, self.columns))
+
+        for api_field, id_field, lookup_name in FOREIGN_KEYS[self.DeferredClass]:
+            objects = lookups[lookup_name]
+            columns[id_field] = [
+                objects[api_id].id if api_id else obj_id
+                for api_id, obj_id in zip(columns.pop(api_field), columns[id_field])
+            ]
+
+        field_names = list(columns.keys())
+        return [
+            {fn: v for fn, v in zip(field_names, row) if v is not None}
+            for row in zip(*columns.values())
+        ]
+
+
+class DeferredBatch(object):
+
+    def __init__(self):
+        self.tables = {Cls: DeferredTable(Cls) for Cls in TABLE_KEYS}
+
+    @classmethod
+    def from_def_objects(cls, def_objects):
+        batch = cls()
+        batch.extend(def_objects)
+        return batch
+
+    def extend(self, def_objects):
+        rows_by_class = defaultdict(list)
+        for def_obj in def_objects:
+            rows_by_class[def_obj.__class__].append(def_obj)
+
+        for Cls, _def_objects in rows_by_class.items():
+            table = self.tables[Cls]
+            table.extend_rows(map(table.get_row, _def_objects))
+
+    def dedup(self):
+        for table in self.tables.values():
+            if len(table) > 1:
+                table.dedup()
+
+    @property
+    def profiles(self):
+        return self.tables[DeferredTwitterProfile]
+
+    @property
+    def tweets(self):
+        return self.tables[DeferredTweet]
+
+    @property
+    def retweet_rels(self):
+        return self.tables[DeferredRetweetRel]
+
+    @property
+    def reply_rels(self):
+        return self.tables[DeferredReplyRel]
+
+    @property
+    def like_rels(self):
+        return self.tables[DeferredLikeRel]
+
+    @property
+    def tweet_mention_rels(self):
+        return self.tables[DeferredProfileMentionedInTweet]
+
+    def get_user_ids(self):
+        author_user_ids = [uid for uid in self.tweets.column('author_user_id') if uid]
+        return author_user_ids + list(self.profiles.column('profile_api_id'))
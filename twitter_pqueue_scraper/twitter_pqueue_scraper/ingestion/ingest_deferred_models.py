@@ -1,130 +1,98 @@
-from collections import defaultdict
-
-from twitter_pqueue_scraper.ingestion.deferred_models import (
-    DeferredTwitterProfile, DeferredTweet, DeferredReplyRel, DeferredRetweetRel,
-    DeferredLikeRel, DeferredProfileMentionedInTweet, dedup_def_objects
-)
-from twitter_pqueue_scraper.util.db_util import (
-    get_or_create_by_key, get_or_create_by_multiple_keys
-)
-
-
-TABLE_NAMES = {
-    'retweet': 'twitter_retweetrel',
-    'reply': 'twitter_replyrel',
-    'like': 'twitter_likerel',
-    'tweet_mention': 'twitter_profilementionedintweet',
-    'profile_mention': 'twitter_profilementionedinprofiledescription'
-}
-REL_FIELDS = {
-    'retweet': ('tweet_id', 'retweeted_by_id'),
-    'reply': ('reply_id', 'reply_to_id'),
-    'like': ('tweet_id', 'liked_by_id'),
-    'tweet_mention': ('tweet_id', 'mentioned_profile_id'),
-    'profile_mention': ('profile_id', 'mentioned_profile_id')
-}
-
-
-async def get_or_create_tweets__from_def_tweets(
-    worker, def_tweets, authors_by_userid
-):
-    db_session, Base = worker.db_connection
-    Tweet = Base.classes.twitter_tweet
-
-    def_tweets_by_api_id = {dt.tweet_api_id: dt for dt in def_tweets}
-    tweet_api_ids = [dt.tweet_api_id for dt in def_tweets]
-
-    tweets_by_pk, tweets_by_api_id, _ = await get_or_create_by_key(
-        db_session, Tweet, 'tweet_api_id', tweet_api_ids
-    )
-
-    for api_id, tweet_obj in tweets_by_api_id.items():
-        def_tweet = def_tweets_by_api_id[api_id]
-        update = def_tweet.get_update_values(authors_by_userid)
-        for field, value in update.items():
-            setattr(tweet_obj, field, value)
+import trio
 
-    await db_session.commit_async()
+from twitter_pqueue_scraper.ingestion.deferred_batch import DeferredBatch
+from twitter_pqueue_scraper.ingestion.ingest_plan import IngestPlan
+from twitter_pqueue_scraper.util.db_util import is_foreign_key_violation
 
-    return tweets_by_api_id
-
-
-async def ingest_relationships__from_def_rels(
-    worker, def_rels, rel_type, tweets_by_api_id, authors_by_userid
-):
-    assert rel_type in ('retweet', 'reply', 'like', 'tweet_mention')
 
+async def ingest_batch(worker, batch, parent_user_ids=()):
+    """
+    writes profiles, tweets and all relationships of a DeferredBatch in one
+    transaction, the caller must hold worker.db_lock
+    """
+    # note: ProfileMentionedInProfileDescription are not ingested here, they are
+    # created directly in: batch_tasks.user_info._ingest_profile_description_mentions
     db_session, Base = worker.db_connection
-    ModelClass = getattr(Base.classes, TABLE_NAMES[rel_type])
-
-    value_dicts = {}
-    field1, field2 = REL_FIELDS[rel_type]
-    for dr in def_rels:
-        di = dr.get_update_values(tweets_by_api_id, authors_by_userid)
-        key = (di[field1], di[field2])  # use key to prevent duplicates
-        value_dicts[key] = di
-
-    value_dicts = [di for (key, di) in value_dicts.items()]
-
-    rel_objects = await get_or_create_by_multiple_keys(
-        db_session, ModelClass, value_dicts,
-        key_fields=[field1, field2]
-    )
-    return rel_objects
+    identity_cache = worker.identity_cache
+
+    # note: the plan reads the identity cache, so it's built here rather than in the thread
+    await identity_cache.check_generation()
+    await identity_cache.prefetch('profile', batch.get_user_ids() + list(parent_user_ids))
+    plan = IngestPlan(batch, parent_user_ids, identity_cache=identity_cache)
+    try:
+        await trio.to_thread.run_sync(plan.execute, db_session)
+    except Exception as e:
+        if not is_foreign_key_violation(e) or not any(plan.cached_api_ids.values()):
+            raise
+        # a cached pk is stale (e.g. its profile was merged away after it was cached),
+        # forget every cached pk the plan used and resolve all ids by joins instead
+        print(f"warning: stale cached ids, retrying without the identity cache: {e}")
+        for lookup_name, api_ids in plan.cached_api_ids.items():
+            await identity_cache.forget(lookup_name, api_ids)
+        plan = IngestPlan(batch, parent_user_ids)
+        await trio.to_thread.run_sync(plan.execute, db_session)
+
+    await identity_cache.publish('profile', plan.profile_ids)
+    await identity_cache.publish('tweet', plan.tweet_ids)
+    return plan
 
 
 async def ingest_deferred_models(
     worker, def_objects, parent_author_userid=None
 ):
-
-    db_session, Base = worker.db_connection
-    TwitterProfile = Base.classes.twitter_twitterprofile
-
-    def_objects = dedup_def_objects(def_objects)
-
-    def_profiles = [do for do in def_objects if isinstance(do, DeferredTwitterProfile)]
-    def_tweets = [do for do in def_objects if isinstance(do, DeferredTweet)]
-    def_tweet_mention_rels = [dr for dr in def_objects if isinstance(dr, DeferredProfileMentionedInTweet)]
-    def_retweet_rels = [dr for dr in def_objects if isinstance(dr, DeferredRetweetRel)]
-    def_reply_rels = [dr for dr in def_objects if isinstance(dr, DeferredReplyRel)]
-    def_like_rels = [dr for dr in def_objects if isinstance(dr, DeferredLikeRel)]
-
-    user_ids = [t.author_user_id for t in def_tweets if t.author_user_id]
-    user_ids = user_ids + [p.profile_api_id for p in def_profiles]
-    if parent_author_userid:
-        user_ids.append(parent_author_userid)
-
-    profiles_by_obj_id, profiles_by_userid, new_profile_ids = await get_or_create_by_key(
-        db_session, TwitterProfile, 'user_id', user_ids,
-        defaults={'manually_added': False}
-    )
-    tweets_by_api_id = await get_or_create_tweets__from_def_tweets(
-        worker, def_tweets, profiles_by_userid
-    )
-
-    if def_retweet_rels:
-        await ingest_relationships__from_def_rels(
-            worker, def_retweet_rels, 'retweet',
-            tweets_by_api_id, profiles_by_userid
-        )
-
-    if def_reply_rels:
-        await ingest_relationships__from_def_rels(
-            worker, def_reply_rels, 'reply', tweets_by_api_id,
-            profiles_by_userid
-        )
-
-    if def_like_rels:
-        await ingest_relationships__from_def_rels(
-            worker, def_like_rels, 'like', tweets_by_api_id,
-            profiles_by_userid
-        )
-
-    if def_tweet_mention_rels:
-        await ingest_relationships__from_def_rels(
-            worker, def_like_rels, 'tweet_mention',
-            tweets_by_api_id, profiles_by_userid
-        )
-
-    # note: ProfileMentionedInProfileDescription are not ingested here, they are
-    # created directly in: batch_tasks.user_info._ingest_profile_description_mentions
+    """ def_objects is a list of deferred model objects or a DeferredBatch, see: ingest_batch() """
+    if isinstance(def_objects, DeferredBatch):
+        batch = def_objects
+    else:
+        batch = DeferredBatch.from_def_objects(def_objects)
+
+    parent_user_ids = [parent_author_userid] if parent_author_userid else []
+    await ingest_batch(worker, batch, parent_user_ids)
+
+
+class _PendingWrite(object):
+
+    def __init__(self):
+        self.batch = DeferredBatch()
+        self.parent_user_ids = []
+        self.num_pages = 0
+        self.committed = False
+
+
+class IngestBatcher(object):
+    """
+    Group commit for the concurrent fetches of a batch task. Pages that arrive while
+    another write holds worker.db_lock are merged, and written by whichever of them
+    gets the lock first, so one transaction can cover the pages of many users.
+
+    ingest() only returns once its page is committed, so a checkpoint saved after it
+    never points past data that isn't stored.
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self._pending = None
+        self.num_pages = 0
+        self.num_writes = 0
+
+    async def ingest(self, def_objects, parent_author_userid=None):
+
+        if self._pending is None:
+            self._pending = _PendingWrite()
+        pending = self._pending
+        pending.batch.extend(def_objects)
+        if parent_author_userid:
+            pending.parent_user_ids.append(parent_author_userid)
+        pending.num_pages += 1
+
+        async with self.worker.db_lock:
+            if self._pending is pending:
+                self._pending = None  # later pages go into the next write
+                await ingest_batch(self.worker, pending.batch, pending.parent_user_ids)
+                pending.committed = True
+                self.num_pages += pending.num_pages
+                self.num_writes += 1
+
+        if not pending.committed:
+            # note: the page was merged into a write that failed in another task
+            raise RuntimeError('batched ingest failed, see the error above')
@@ -0,0 +1,260 @@
+'''
+Writes a whole DeferredBatch (profiles, tweets and every relationship table) in one
+transaction, with a fixed number of statements however many users the batch covers.
+
+Rows are staged by api id: each non-empty deferred table is COPY'd into a temp table
+and the api ids are resolved to db ids by joins in the write statements, so no ids
+need to be read back between tables. Round trips: one to create the staging tables,
+one COPY per staging table (at most 6), one for all write statements, one to commit.
+
+With an IdentityCache (see: util/identity_cache.py) db ids that are already known are
+staged as well and only the rest are joined, profiles known to exist aren't staged for
+insert at all. The ids of the staged profiles and tweets are read back by the last
+write statement, to fill the cache. A stale cached id fails the write with a foreign
+key violation, the caller then forgets the ids in cached_api_ids and writes the batch
+again with a plan that joins every id (see: ingest_deferred_models.ingest_batch).
+'''
+from twitter_pqueue_scraper.ingestion.deferred_batch import FOREIGN_KEYS
+from twitter_pqueue_scraper.ingestion.deferred_models import (
+    DeferredRetweetRel, DeferredReplyRel, DeferredLikeRel, DeferredProfileMentionedInTweet
+)
+from twitter_pqueue_scraper.util.bulk_ingest import create_copy_buffer
+
+
+REL_TABLE_NAMES = {
+    DeferredRetweetRel: 'twitter_retweetrel',
+    DeferredReplyRel: 'twitter_replyrel',
+    DeferredLikeRel: 'twitter_likerel',
+    DeferredProfileMentionedInTweet: 'twitter_profilementionedintweet',
+}
+BOOLEAN_FIELDS = ('has_link', 'has_text', 'is_quote')
+
+STAGE_PROFILES = '_stage_profile'
+STAGE_TWEETS = '_stage_tweet'
+
+INSERT_PROFILES_SQL = f"""
+    INSERT INTO twitter_twitterprofile (user_id, manually_added)
+    SELECT s.user_id, false FROM {STAGE_PROFILES} s
+    ON CONFLICT (user_id) DO NOTHING;
+"""
+# note: tweets that already exist are updated before new ones are inserted, so
+# new rows aren't written twice. Only non-null staged values overwrite existing ones.
+UPDATE_TWEETS_SQL = f"""
+    UPDATE twitter_tweet t SET
+        json_data = COALESCE(s.json_data, t.json_data),
+        scrape_source = COALESCE(s.scrape_source, t.scrape_source),
+        tweet_type = COALESCE(s.tweet_type, t.tweet_type),
+        has_link = COALESCE(s.has_link, t.has_link),
+        has_text = COALESCE(s.has_text, t.has_text),
+        conversation_id = COALESCE(s.conversation_id, t.conversation_id),
+        author_id = COALESCE(s.author_id, p.id, t.author_id),
+        publish_datetime = COALESCE(s.publish_datetime, t.publish_datetime)
+    FROM {STAGE_TWEETS} s
+    LEFT JOIN twitter_twitterprofile p ON s.author_id IS NULL AND p.user_id = s.author_user_id
+    WHERE t.tweet_api_id = s.tweet_api_id;
+"""
+INSERT_TWEETS_SQL = f"""
+    INSERT INTO twitter_tweet (
+        tweet_api_id, json_data, scrape_source, tweet_type, has_link, has_text,
+        conversation_id, author_id, publish_datetime
+    )
+    SELECT
+        s.tweet_api_id, s.json_data, s.scrape_source, s.tweet_type, s.has_link, s.has_text,
+        s.conversation_id, COALESCE(s.author_id, p.id), s.publish_datetime
+    FROM {STAGE_TWEETS} s
+    LEFT JOIN twitter_twitterprofile p ON s.author_id IS NULL AND p.user_id = s.author_user_id
+    WHERE NOT EXISTS (SELECT 1 FROM twitter_tweet t WHERE t.tweet_api_id = s.tweet_api_id)
+    ON CONFLICT DO NOTHING;
+"""
+SELECT_PROFILE_IDS_SQL = f"""
+    SELECT 'profile', p.user_id, p.id FROM twitter_twitterprofile p
+    JOIN {STAGE_PROFILES} s ON s.user_id = p.user_id"""
+SELECT_TWEET_IDS_SQL = f"""
+    SELECT 'tweet', t.tweet_api_id, t.id FROM twitter_tweet t
+    JOIN {STAGE_TWEETS} s ON s.tweet_api_id = t.tweet_api_id"""
+
+
+def _get_column_type(DeferredClass, field_name):
+    if field_name.endswith('_datetime'):
+        return 'timestamptz'
+    if field_name in BOOLEAN_FIELDS:
+        return 'boolean'
+    if field_name in [id_field for _, id_field, _ in FOREIGN_KEYS[DeferredClass]]:
+        return 'integer'
+    return 'text'
+
+
+def _get_create_stage_sql(stage_table, DeferredClass, fields):
+    columns_str = ', '.join([f"{fn} {_get_column_type(DeferredClass, fn)}" for fn in fields])
+    return f"CREATE TEMP TABLE {stage_table} ({columns_str}) ON COMMIT DROP;"
+
+
+def _get_insert_rels_sql(RelClass, stage_table):
+    """
+    resolves each api id that wasn't staged with its db id by a join, a rel whose
+    tweet or profile isn't stored is skipped
+    """
+    table_name = REL_TABLE_NAMES[RelClass]
+    foreign_keys = FOREIGN_KEYS[RelClass]
+    fk_fields = [fn for fk in foreign_keys for fn in fk[:2]]
+    value_fields = [fn for fn in RelClass.get_fields() if fn not in fk_fields]
+
+    joins, id_values = [], []
+    for n, (api_field, id_field, lookup_name) in enumerate(foreign_keys):
+        alias = f"j{n}"
+        if lookup_name == 'tweet':
+            table_str, key_field = 'twitter_tweet', 'tweet_api_id'
+        else:
+            table_str, key_field = 'twitter_twitterprofile', 'user_id'
+        joins.append(
+            f"LEFT JOIN {table_str} {alias} "
+            f"ON s.{id_field} IS NULL AND {alias}.{key_field} = s.{api_field}"
+        )
+        id_values.append(f"COALESCE(s.{id_field}, {alias}.id)")
+
+    id_fields = [id_field for _, id_field, _ in foreign_keys]
+    columns_str = ', '.join(id_fields + value_fields)
+    values_str = ', '.join(id_values + [f"s.{fn}" for fn in value_fields])
+    keys_match = ' AND '.join([f"r.{fn} = {val}" for fn, val in zip(id_fields, id_values)])
+    keys_found = ' AND '.join([f"{val} IS NOT NULL" for val in id_values])
+    joins_str = '\n    '.join(joins)
+
+    return f"""
+    INSERT INTO {table_name} ({columns_str})
+    SELECT DISTINCT ON ({', '.join(id_values)}) {values_str}
+    FROM {stage_table} s
+    {joins_str}
+    WHERE {keys_found}
+        AND NOT EXISTS (SELECT 1 FROM {table_name} r WHERE {keys_match})
+    ON CONFLICT DO NOTHING;
+    """
+
+
+class IngestPlan(object):
+
+    def __init__(self, batch, parent_user_ids=(), identity_cache=None):
+        self.stages = []  # (stage_table, create_sql, column_names, rows)
+        self.statements = []  # run in order, in one round trip
+        self.counts = {}
+        self.identity_cache = identity_cache
+        self.profile_ids, self.tweet_ids = {}, {}  # pks by api id, set by execute()
+        self._cached_pks = {'profile': {}, 'tweet': {}}  # identity cache results by api id, see: _resolve()
+
+        batch.dedup()
+
+        user_ids = set(batch.get_user_ids() + list(parent_user_ids))
+        user_ids.discard(None)
+        if identity_cache is not None:
+            # note: a cached profile exists, it doesn't need to be inserted
+            user_ids = list(user_ids)
+            cached = self._resolve('profile', user_ids)
+            user_ids = [uid for uid, pk in zip(user_ids, cached) if pk is None]
+        if user_ids:
+            self.stages.append((
+                STAGE_PROFILES, f"CREATE TEMP TABLE {STAGE_PROFILES} (user_id text) ON COMMIT DROP;",
+                ['user_id'], [(uid,) for uid in user_ids]
+            ))
+            self.statements.append(INSERT_PROFILES_SQL)
+            self.counts['profiles'] = len(user_ids)
+
+        if len(batch.tweets):
+            self._add_stage(STAGE_TWEETS, batch.tweets)
+            self.statements.extend([UPDATE_TWEETS_SQL, INSERT_TWEETS_SQL])
+            self.counts['tweets'] = len(batch.tweets)
+
+        for RelClass, table_name in REL_TABLE_NAMES.items():
+            rels_table = batch.tables[RelClass]
+            if not len(rels_table):
+                continue
+            stage_table = f"_stage_{table_name[len('twitter_'):]}"
+            self._add_stage(stage_table, rels_table)
+            self.statements.append(_get_insert_rels_sql(RelClass, stage_table))
+            self.counts[table_name] = len(rels_table)
+
+        select_ids = []
+        if 'profiles' in self.counts:
+            select_ids.append(SELECT_PROFILE_IDS_SQL)
+        if 'tweets' in self.counts:
+            select_ids.append(SELECT_TWEET_IDS_SQL)
+        if select_ids:
+            self.statements.append('\n    UNION ALL'.join(select_ids) + ';')
+
+    def _get_stage_column(self, deferred_table, field_name):
+        column = deferred_table.column(field_name)
+        if self.identity_cache is None:
+            return column
+        for api_field, id_field, lookup_name in FOREIGN_KEYS[deferred_table.DeferredClass]:
+            if id_field == field_name:
+                api_ids = [
+                    api_id if pk is None else None
+                    for pk, api_id in zip(column, deferred_table.column(api_field))
+                ]
+                cached = self._resolve(lookup_name, api_ids)
+                return [pk if pk is not None else cached_pk for pk, cached_pk in zip(column, cached)]
+        return column
+
+    def _resolve(self, lookup_name, api_ids):
+        """
+        cached pks (or None) for the api ids, each api id is looked up in the identity
+        cache once per plan, so its hit/miss counts reflect distinct ids
+        """
+        cached_pks = self._cached_pks[lookup_name]
+        to_resolve = list({
+            api_id for api_id in api_ids if api_id is not None and api_id not in cached_pks
+        })
+        if to_resolve:
+            cached_pks.update(zip(to_resolve, self.identity_cache.resolve(lookup_name, to_resolve)))
+        return [None if api_id is None else cached_pks[api_id] for api_id in api_ids]
+
+    @property
+    def cached_api_ids(self):
+        """ {lookup_name: [api_id, ...]} of the cached pks the plan used """
+        return {
+            lookup_name: [api_id for api_id, pk in cached_pks.items() if pk is not None]
+            for lookup_name, cached_pks in self._cached_pks.items()
+        }
+
+    def _add_stage(self, stage_table, deferred_table):
+        DeferredClass = deferred_table.DeferredClass
+        fields = deferred_table.fields
+        rows = list(zip(*[self._get_stage_column(deferred_table, fn) for fn in fields]))
+        self.stages.append((
+            stage_table, _get_create_stage_sql(stage_table, DeferredClass, fields), fields, rows
+        ))
+
+    @property
+    def num_round_trips(self):
+        if not self.stages:
+            return 0
+        return len(self.stages) + 3  # create staging tables, COPY each, write, commit
+
+    def execute(self, db_session):
+        """ blocking, run it in a thread """
+        if not self.stages:
+            return
+
+        # note: db_session.connection() joins the session's current transaction,
+        # the staging tables are dropped when it's committed
+        cursor = db_session.connection().connection.cursor()
+        try:
+            cursor.execute('\n'.join([create_sql for _, create_sql, _, _ in self.stages]))
+            for stage_table, _, fields, rows in self.stages:
+                cursor.copy_expert(
+                    f"COPY {stage_table} ({', '.join(fields)}) FROM STDIN",
+                    create_copy_buffer(rows)
+                )
+            cursor.execute('\n'.join(self.statements))
+            id_rows = cursor.fetchall() if cursor.description else []
+        except Exception:
+            db_session.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        db_session.commit()
+
+        for lookup_name, api_id, pk in id_rows:
+            if lookup_name == 'profile':
+                self.profile_ids[api_id] = pk
+            else:
+                self.tweet_ids[api_id] = pk
@@ -0,0 +1,100 @@
+'''
+Classifies a tweet and normalizes its text in one pass over the tweet dict.
+
+get_tweet_features() works with v1 and v2 tweets. scenario and tweet_type are only
+set for v1 tweets, v2 tweets are classified by their conversation instead (see:
+create_deferred_models_v2). Text is normalized with precompiled patterns: links,
+mentions, punctuation and whitespace are stripped in a single regex substitution.
+'''
+from collections import namedtuple
+import re
+
+
+# for tips on how to preprocess tweet text for NLP, see page 4 here: https://arxiv.org/pdf/1708.03994.pdf
+NOISE_RE = re.compile(r'https://[^\s]+|@\w{1,15}|[\s,:.?!]+')
+
+TweetFeatures = namedtuple('TweetFeatures', [
+    'scenario',  # v1 only, see: get_tweet_scenario()
+    'tweet_type',  # v1 only, 'reply', 'quote' or 'status'
+    'status_type',
+    'has_link',
+    'has_text',
+    'mentions',  # [(user_id, screen_name)], screen_name is lower case
+])
+
+
+def normalize_text(text, urls):
+    """ the text without links, mentions and punctuation, with whitespace collapsed """
+    text = text.strip()
+    if text.startswith('RT @'):
+        parts = text.lstrip('RT @').split(' ', 1)
+        if len(parts) == 1:
+            return ''  # only the retweeted screen name
+        text = parts[1]
+
+    for url_di in urls:
+        text = text.replace(url_di['url'], '')
+    return NOISE_RE.sub(' ', text).strip()
+
+
+def _get_status_type(text, urls, entities, has_text):
+
+    if len(urls) == 1 and urls[0]['url'] == text:
+        return 'link-only-status'
+
+    for media_di in entities.get('media', []):
+        if media_di['url'] == text:
+            return 'media-object-status'  # media_di['type']
+
+    if not urls:
+        return 'text-only-status'
+    if not has_text:
+        return 'link-only-status'  # note: could be more than one link here
+    return 'text-with-link'
+
+
+def _get_mentions(entities):
+    if 'user_mentions' in entities:  # v1
+        return [
+            (di['id_str'], di['screen_name'].lower()) for di in entities['user_mentions']
+        ]
+    return [
+        (di.get('id'), di['username'].lower()) for di in entities.get('mentions') or []
+    ]
+
+
+def get_tweet_features(tweet_di):
+
+    text = tweet_di['text']
+    entities = tweet_di.get('entities') or {}
+    urls = entities.get('urls') or []
+
+    has_text = bool(normalize_text(text, urls))
+    status_type = _get_status_type(text, urls, entities, has_text)
+
+    scenario, tweet_type = None, None
+    if 'in_reply_to_status_id_str' in tweet_di:  # v1
+        reply_to_id = tweet_di['in_reply_to_status_id_str']
+        is_quote = tweet_di['is_quote_status']
+
+        if is_quote:
+            scenario = 'retweet-with-quote'
+        elif tweet_di.get('retweeted_status'):
+            scenario = 'retweet'
+        elif reply_to_id is not None:
+            # don't use 'in_reply_to_user_id_str' because this gets set when a status
+            # begins with an @ mention, even though it's not a reply on a thread.
+            scenario = 'reply'
+        else:
+            scenario = status_type
+
+        if reply_to_id:
+            tweet_type = 'reply'
+        elif is_quote:
+            tweet_type = 'quote'
+        else:
+            tweet_type = 'status'
+
+    return TweetFeatures(
+        scenario, tweet_type, status_type, bool(urls), has_text, _get_mentions(entities)
+    )
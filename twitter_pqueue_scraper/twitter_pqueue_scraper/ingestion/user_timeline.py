@@ -1,8 +1,8 @@
 from twitter_pqueue_scraper.ingestion.create_deferred_models import create_deferred_models
-from twitter_pqueue_scraper.ingestion.ingest_deferred_models import ingest_deferred_models
 
 
-async def ingest_user_timeline(worker, user_id, user_timeline_data):
+async def ingest_user_timeline(batcher, user_id, user_timeline_data):
+    """ batcher is an IngestBatcher shared by the batch's concurrent fetches """
 
     def_objects = []
     for tweet_di in user_timeline_data:
@@ -11,6 +11,4 @@ async def ingest_user_timeline(worker, user_id, user_timeline_data):
         )
         def_objects.extend(do)
 
-    await ingest_deferred_models(
-        worker, def_objects, parent_author_userid=user_id
-    )
+    await batcher.ingest(def_objects, parent_author_userid=user_id)
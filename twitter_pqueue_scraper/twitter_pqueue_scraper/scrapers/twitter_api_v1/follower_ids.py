@@ -3,8 +3,9 @@ import sys
 from eliot import start_action
 import trio
 
-from twitter_pqueue_scraper.scrapers.twitter_api_v1.util import get_cursored
+from twitter_pqueue_scraper.scrapers.twitter_api_v1.util import collect_cursored, get_cursored
 from twitter_pqueue_scraper.util.http_util import TwitterHttpSession
+from twitter_pqueue_scraper.util.json_util import loads_response
 
 
 DEFAULT_FOLLOWER_ID_PAGES = 3
@@ -18,12 +19,26 @@ async def _get_follower_ids(twitter_session, user_id, cursor=None):
         print('warning: /1.1/friends/list.json returned status: %s' % status)
         return None, None, status
 
-    di = resp_obj.json()
+    di = loads_response(resp_obj)
     ids = [str(i) for i in di['ids']]
 
     return ids, di['next_cursor_str'], status
 
 
+def iter_follower_ids_pages(
+    twitter_session, user_id, max_pages=DEFAULT_FOLLOWER_ID_PAGES,
+    initial_cursor=None, delay_override=None
+):
+    """
+    async generator of (ids, next_cursor, status_code), one per page
+    note: not checkpointed in redis, the caller saves the cursor in the db after each page
+    """
+    return get_cursored(
+        twitter_session, _get_follower_ids, user_id, max_pages,
+        initial_cursor, delay_override
+    )
+
+
 async def get_follower_ids(
     twitter_session, user_id, max_pages=DEFAULT_FOLLOWER_ID_PAGES,
     initial_cursor=None, delay_override=None
@@ -33,7 +48,6 @@ async def get_follower_ids(
         max_pages=max_pages, func_name='_get_follower_ids'
     )
     with start_action(**action_args):
-        return await get_cursored(
-            twitter_session, _get_follower_ids, user_id, max_pages,
-            initial_cursor, delay_override
-        )
+        return await collect_cursored(iter_follower_ids_pages(
+            twitter_session, user_id, max_pages, initial_cursor, delay_override
+        ))
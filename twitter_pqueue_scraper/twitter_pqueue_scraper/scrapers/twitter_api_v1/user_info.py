@@ -3,6 +3,7 @@ import sys
 import trio
 
 from twitter_pqueue_scraper.util.http_util import TwitterHttpSession
+from twitter_pqueue_scraper.util.json_util import loads_response
 
 
 async def _handle_40x(twitter_session, user_id_strings, status_codes):
@@ -54,7 +55,7 @@ async def get_user_info__chunk(
         print(f'warning: {url} gave unexpected status_code: {status_code}')
         return []
 
-    results = resp_obj.json()
+    results = loads_response(resp_obj)
     for di in results:
         di['screen_name'] = di['screen_name'].lower()
         di['is_available'] = not di['protected']
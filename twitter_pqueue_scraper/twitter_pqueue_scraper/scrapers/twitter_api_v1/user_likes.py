@@ -1,28 +1,53 @@
 from collections import defaultdict
 
 from twitter_pqueue_scraper.scrapers.twitter_api_v1.user_info import get_user_info__chunk
+from twitter_pqueue_scraper.util.checkpoints import get_checkpoints
+from twitter_pqueue_scraper.util.json_util import loads_response
 
 
-async def get_user_likes(twitter_session, user_id, num_pages, since_id=None):
+async def iter_user_likes_pages(
+    twitter_session, user_id, num_pages, since_id=None, checkpoint_min_saved_at=None
+):
+    """
+    async generator of (success, likes), one per page, newest first.
+    Pages go backwards with max_id, since_id only bounds the oldest like returned.
+    max_id is checkpointed after each page, see: scrapers/twitter_api_v1/util.get_cursored()
+    """
+    checkpoints = get_checkpoints()
+    max_id = await checkpoints.load('user_likes', user_id, checkpoint_min_saved_at)
+    if max_id:
+        print(f"get_user_likes resuming from checkpoint: {user_id}, {max_id}")
 
-    result_count = num_pages * 200
+    for i in range(num_pages):
 
-    likes = []
-    while len(likes) <= result_count:
-
-        status, resp_obj = await twitter_session.get_user_likes(user_id, since_id)
+        status, resp_obj = await twitter_session.get_user_likes(
+            user_id, since_id=since_id, max_id=max_id
+        )
 
         if status != 200:
             print('warning: /1.1/favorites/list.json?user_id=%s gave status: %s' % (user_id, status))
-            return False, likes
+            yield False, []
+            return  # keep the checkpoint, so the next attempt retries this page
 
-        _likes = resp_obj.json()
+        _likes = loads_response(resp_obj)
         if not _likes:
             break
-        if since_id and since_id == _likes[-1]['id']:
-            break
+        yield True, _likes
+        max_id = _likes[-1]['id'] - 1  # max_id is inclusive
+        await checkpoints.save('user_likes', user_id, max_id)
+
+    await checkpoints.clear('user_likes', user_id)
+
+
+async def get_user_likes(twitter_session, user_id, num_pages, since_id=None):
+
+    likes = []
+    async for success, _likes in iter_user_likes_pages(
+        twitter_session, user_id, num_pages, since_id=since_id
+    ):
+        if not success:
+            return False, likes
         likes.extend(_likes)
-        since_id = likes[-1]['id']
 
     return True, likes
 
@@ -3,8 +3,9 @@ import sys
 from eliot import start_action
 import trio
 
-from twitter_pqueue_scraper.scrapers.twitter_api_v1.util import get_cursored
+from twitter_pqueue_scraper.scrapers.twitter_api_v1.util import collect_cursored, get_cursored
 from twitter_pqueue_scraper.util.http_util import TwitterHttpSession
+from twitter_pqueue_scraper.util.json_util import loads_response
 
 DEFAULT_TIMELINE_PAGES = 8
 
@@ -22,31 +23,48 @@ async def _get_user_timeline(twitter_session, user_id, cursor=None, since_id=Non
         print('warning: /1.1/friends/list.json returned status: %s' % status)
         return None, None, status
 
-    di = resp_obj.json()
+    di = loads_response(resp_obj)
     if not di:
         return None, None, status
 
     return di, di[-1]['id'], status
 
 
-async def get_user_timeline(
+async def iter_user_timeline_pages(
     twitter_session, user_id, max_pages=DEFAULT_TIMELINE_PAGES,
-    initial_cursor=None, delay_override=None, since_id=None
+    initial_cursor=None, delay_override=None, since_id=None, checkpoint_min_saved_at=None
 ):
+    """
+    async generator of (tweets, next_cursor, status_code), one per page. With a since_id
+    only the newest page is fetched, else pages go back from the newest tweet (or from
+    a checkpoint newer than checkpoint_min_saved_at, see: util.get_cursored())
+    """
     if since_id:
-        return await _get_user_timeline(
+        yield await _get_user_timeline(
             twitter_session, user_id, cursor=None, since_id=since_id
         )
+        return
+
+    async for page in get_cursored(
+        twitter_session, _get_user_timeline, user_id, max_pages,
+        initial_cursor, delay_override, checkpoint_name='user_timeline',
+        checkpoint_min_saved_at=checkpoint_min_saved_at
+    ):
+        yield page
 
+
+async def get_user_timeline(
+    twitter_session, user_id, max_pages=DEFAULT_TIMELINE_PAGES,
+    initial_cursor=None, delay_override=None, since_id=None
+):
     action_args = dict(
         action_type="get_cursored", user_id=user_id,
         max_pages=max_pages, func_name='_get_user_timeline'
     )
     with start_action(**action_args):
-        return await get_cursored(
-            twitter_session, _get_user_timeline, user_id, max_pages,
-            initial_cursor, delay_override
-        )
+        return await collect_cursored(iter_user_timeline_pages(
+            twitter_session, user_id, max_pages, initial_cursor, delay_override, since_id
+        ))
 
 
 async def _once(user_id, cursor=None):
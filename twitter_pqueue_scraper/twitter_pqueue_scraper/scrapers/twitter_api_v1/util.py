@@ -1,35 +1,61 @@
-
 import trio
 
+from twitter_pqueue_scraper.util.checkpoints import get_checkpoints
+
 
 async def get_cursored(
     twitter_http_session, func, user_id, max_pages,
-    initial_cursor=None, delay_override=None
+    initial_cursor=None, delay_override=None, checkpoint_name=None, checkpoint_min_saved_at=None
 ):
-
-    if delay_override is None:
-        request_delay = 59
-        if func.__name__ == '_get_user_timeline':
-            request_delay = 0
-    else:
-        request_delay = delay_override
-
-    items, next_cursor = [], initial_cursor
-    status_code = None
+    """
+    async generator, yields (items, next_cursor, status_code) for each page as it
+    arrives. Stops after a failed or empty page, or once the cursor is exhausted.
+
+    With a checkpoint_name (the work_type), the cursor is checkpointed after each
+    page and a scrape resumes from the checkpoint left by an interrupted one, unless
+    it was saved before checkpoint_min_saved_at (see: CursorCheckpoints.load()).
+    Don't use one when the caller keeps its own cursor (e.g. in the db), the two
+    can't be compared.
+    """
+    # note: requests are paced by the session's rate limit buckets (see: util/rate_limit.py),
+    # delay_override only adds an extra fixed delay between pages
+    request_delay = delay_override or 0
+
+    next_cursor = initial_cursor
+    checkpoints = get_checkpoints()
+    if checkpoint_name:
+        saved_cursor = await checkpoints.load(checkpoint_name, user_id, checkpoint_min_saved_at)
+        if saved_cursor:
+            print(f"{func.__name__} resuming from checkpoint: {user_id}, {saved_cursor}")
+            next_cursor = saved_cursor
 
     for i in range(max_pages):
 
         print(f"{func.__name__} page_num: {i}")
 
+        if i and request_delay:
+            await trio.sleep(request_delay)
+
         _items, next_cursor, status_code = await func(
             twitter_http_session, user_id, cursor=next_cursor
         )
-        if not _items:
-            break
-        await trio.sleep(request_delay)
+        yield _items, next_cursor, status_code
 
-        items.extend(_items)
-        if next_cursor == '0':
+        # note: by the time the generator resumes, the caller has processed the page
+        if status_code != 200:
+            return  # keep the checkpoint, so the next attempt retries this page
+        if not _items or next_cursor == '0':
             break
+        if checkpoint_name:
+            await checkpoints.save(checkpoint_name, user_id, next_cursor)
+
+    if checkpoint_name:
+        await checkpoints.clear(checkpoint_name, user_id)
+
 
+async def collect_cursored(pages):
+    """ accumulates the pages from get_cursored(), returns (items, next_cursor, status_code) """
+    items, next_cursor, status_code = [], None, None
+    async for _items, next_cursor, status_code in pages:
+        items.extend(_items or [])
     return items, next_cursor, status_code
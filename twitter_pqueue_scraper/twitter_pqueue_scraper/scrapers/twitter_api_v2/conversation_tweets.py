@@ -5,7 +5,9 @@ import urllib
 import trio
 
 from twitter_pqueue_scraper.batch_tasks.util import parse_date_str
+from twitter_pqueue_scraper.util.checkpoints import get_checkpoints
 from twitter_pqueue_scraper.util.http_util import TwitterHttpSession
+from twitter_pqueue_scraper.util.json_util import loads_response
 from twitter_pqueue_scraper.ingestion.create_deferred_models_v2 import create_deferred_models__conversation
 
 
@@ -30,7 +32,7 @@ async def _get_conversation_tweets(twitter_session, conversation_id, cursor=None
         print(f'warning: /2/tweets/search/recent?query=conversation_id returned status: {status_code}')
         return [], [], [], [], None, status_code
 
-    resp_json = resp_obj.json()
+    resp_json = loads_response(resp_obj)
 
     result_count = resp_json.get('meta', {}).get('result_count')
     if result_count == 0:
@@ -47,42 +49,64 @@ async def _get_conversation_tweets(twitter_session, conversation_id, cursor=None
     return reply_tweets, tweets_included, users, errors, next_token, status_code
 
 
-async def get_cursored(
-    twitter_http_session, conversation_id, max_pages
-):
+DEFAULT_CONVERSATION_PAGES = 3
 
-    request_delay = 1  # based on app limit of 450/15-minutes
 
-    reply_tweets, tweets_included, users, errors = [], [], [], []
-    next_cursor, status_code = None, None
+async def get_cursored(
+    twitter_http_session, conversation_id, max_pages, checkpoint_name='conversation_tweets'
+):
+    """
+    async generator, yields (reply_tweets, tweets_included, users, errors, next_cursor, status_code)
+    for each page. The next_token is checkpointed after each page, see: scrapers/twitter_api_v1/util.py
+    """
+    # note: requests are paced by the session's rate limit buckets (see: util/rate_limit.py)
+
+    next_cursor = None
+    checkpoints = get_checkpoints()
+    if checkpoint_name:
+        next_cursor = await checkpoints.load(checkpoint_name, conversation_id)
+        if next_cursor:
+            print(f"_get_conversation_tweets resuming from checkpoint: {conversation_id}, {next_cursor}")
 
     for i in range(max_pages):
         print(f"_get_conversation_tweets page_num: {i}")
 
-        _reply_tweets, _tweets_included, _users, _errors, next_cursor, status_code = await _get_conversation_tweets(
+        page = await _get_conversation_tweets(
             twitter_http_session, conversation_id, cursor=next_cursor
         )
-        if not _reply_tweets:
+        yield page
+
+        _reply_tweets, _, _, _, next_cursor, status_code = page
+        if status_code != 200:
+            return  # keep the checkpoint, so the next attempt retries this page
+        if not _reply_tweets or next_cursor == '0':
             break
-        await trio.sleep(request_delay)
+        if checkpoint_name:
+            await checkpoints.save(checkpoint_name, conversation_id, next_cursor)
+
+    if checkpoint_name:
+        await checkpoints.clear(checkpoint_name, conversation_id)
+
+
+def iter_conversation_tweets_pages(twitter_session, conversation_id, max_pages=DEFAULT_CONVERSATION_PAGES):
+    return get_cursored(twitter_session, conversation_id, max_pages)
+
 
+async def get_conversation_tweets(twitter_session, conversation_id):
+
+    reply_tweets, tweets_included, users, errors = [], [], [], []
+    status_code = None
+
+    async for page in iter_conversation_tweets_pages(twitter_session, conversation_id):
+        _reply_tweets, _tweets_included, _users, _errors, _, status_code = page
         reply_tweets.extend(_reply_tweets)
         tweets_included.extend(_tweets_included)
         users.extend(_users)
         errors.extend(_errors)
 
-        if next_cursor == '0':
-            break
-
     return reply_tweets, tweets_included, users, errors, status_code
 
 
-async def get_conversation_tweets(twitter_session, conversation_id):
-    return await get_cursored(
-        twitter_session, conversation_id, 3
-    )
-
-
 '''
 https://developer.twitter.com/en/docs/twitter-api/conversation-id
 
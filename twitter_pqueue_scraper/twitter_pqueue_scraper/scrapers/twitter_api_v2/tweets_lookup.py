@@ -3,6 +3,7 @@ import sys
 import trio
 
 from twitter_pqueue_scraper.util.http_util import TwitterHttpSession
+from twitter_pqueue_scraper.util.json_util import loads_response
 
 
 async def get_tweets(twitter_session, tweet_ids):
@@ -17,7 +18,7 @@ async def get_tweets(twitter_session, tweet_ids):
             print('warning: /2/tweets/ returned status: %s' % status_code)
             continue
 
-        for di in resp_obj.json()['data']:
+        for di in loads_response(resp_obj)['data']:
             tweet_data[di['id']] = di
 
     return tweet_data
@@ -0,0 +1,178 @@
+'''
+Set-based alternative to db_util.get_or_create_by_key() and
+db_util.get_or_create_by_multiple_keys().
+
+Rows are staged with COPY into a temp table, new rows are created with a single
+INSERT ... ON CONFLICT DO NOTHING RETURNING id and every row (new or existing) is
+resolved with one join back against the staging table. No ORM objects are built,
+the results are light-weight namedtuple rows holding 'id' and the key fields.
+'''
+from collections import namedtuple
+import datetime
+import io
+import uuid
+
+import trio
+
+
+COPY_NULL = '\\N'
+
+
+def _copy_escape(value):
+    # escapes a value for COPY's default text format
+    if value is None:
+        return COPY_NULL
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def create_copy_buffer(rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join([_copy_escape(val) for val in row]))
+        buf.write('\n')
+    buf.seek(0)
+    return buf
+
+
+def _dedup_value_dicts(value_dicts, key_fields, defaults):
+    # first occurrence of each key wins, same as the ORM helpers
+    deduped = {}
+    for val_dict in value_dicts:
+        key = tuple([val_dict[k] for k in key_fields])
+        if key in deduped:
+            continue
+        if defaults:
+            val_dict = {**val_dict, **defaults}
+        deduped[key] = val_dict
+    return deduped
+
+
+def _get_columns(value_dicts, key_fields):
+    columns = list(key_fields)
+    for val_dict in value_dicts:
+        for col in val_dict.keys():
+            if col not in columns:
+                columns.append(col)
+    return columns
+
+
+def _bulk_get_or_create(
+    db_session, table_name, key_fields, columns, rows, update_fields
+):
+    stage_table = f"_stage_{table_name}_{uuid.uuid4().hex[:8]}"
+    columns_str = ', '.join(columns)
+    key_fields_str = ', '.join(key_fields)
+    keys_match = ' AND '.join([f"t.{k} = s.{k}" for k in key_fields])
+
+    # note: db_session.connection() joins the session's current transaction,
+    # so the staging table is dropped when db_session.commit() is called below
+    cursor = db_session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            f"CREATE TEMP TABLE {stage_table} ON COMMIT DROP AS "
+            f"SELECT {columns_str} FROM {table_name} WITH NO DATA;"
+        )
+        cursor.copy_expert(
+            f"COPY {stage_table} ({columns_str}) FROM STDIN",
+            create_copy_buffer(rows)
+        )
+        cursor.execute(
+            f"INSERT INTO {table_name} ({columns_str}) "
+            f"SELECT {columns_str} FROM {stage_table} s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table_name} t WHERE {keys_match}) "
+            f"ON CONFLICT DO NOTHING RETURNING id;"
+        )
+        new_ids = [tup[0] for tup in cursor.fetchall()]
+
+        if update_fields:
+            # only non-null staged values overwrite existing ones
+            set_str = ', '.join([f"{f} = COALESCE(s.{f}, t.{f})" for f in update_fields])
+            cursor.execute(
+                f"UPDATE {table_name} t SET {set_str} FROM {stage_table} s "
+                f"WHERE {keys_match};"
+            )
+
+        select_str = ', '.join([f"t.{k}" for k in key_fields])
+        cursor.execute(
+            f"SELECT t.id, {select_str} FROM {table_name} t "
+            f"JOIN {stage_table} s ON {keys_match};"
+        )
+        found_rows = cursor.fetchall()
+    except Exception:
+        db_session.rollback()  # e.g. a foreign key violation, the caller may retry
+        raise
+    finally:
+        cursor.close()
+
+    db_session.commit()
+    return found_rows, new_ids
+
+
+async def _run_bulk_get_or_create(
+    db_session, ModelClass, key_fields, value_dicts, defaults, update_fields
+):
+    table_name = ModelClass.__table__.name
+    RowClass = namedtuple(f"{table_name}_row", ['id'] + list(key_fields))
+
+    deduped = _dedup_value_dicts(value_dicts, key_fields, defaults)
+    if not deduped:
+        return {}, {}, []
+
+    columns = _get_columns(deduped.values(), key_fields)
+    rows = [
+        [val_dict.get(col) for col in columns] for val_dict in deduped.values()
+    ]
+    update_fields = [f for f in (update_fields or []) if f in columns and f not in key_fields]
+
+    found_rows, new_ids = await trio.to_thread.run_sync(
+        _bulk_get_or_create, db_session, table_name,
+        key_fields, columns, rows, update_fields
+    )
+
+    objects_by_id, objects_by_key = {}, {}
+    for tup in found_rows:
+        obj = RowClass(*tup)
+        objects_by_id[obj.id] = obj
+        objects_by_key[tup[1] if len(key_fields) == 1 else tuple(tup[1:])] = obj
+
+    return objects_by_id, objects_by_key, new_ids
+
+
+async def bulk_get_or_create_by_key(
+    db_session, ModelClass, key_name, key_values, defaults=None, value_dicts=None,
+    update_fields=None
+):
+    """
+    Same return shape as db_util.get_or_create_by_key(): (objects_by_id,
+    objects_by_key, new_ids), except that the objects are namedtuple rows.
+    value_dicts may carry extra column values for each key, update_fields
+    lists the columns that should also be written to rows that already exist.
+    """
+    if value_dicts is None:
+        value_dicts = [{key_name: val} for val in key_values]
+    return await _run_bulk_get_or_create(
+        db_session, ModelClass, [key_name], value_dicts, defaults, update_fields
+    )
+
+
+async def bulk_get_or_create_by_multiple_keys(
+    db_session, ModelClass, value_dicts, defaults=None, key_fields=None
+):
+    """
+    Set-based version of db_util.get_or_create_by_multiple_keys(), objects_by_key
+    is keyed by a tuple of the key_fields values.
+    """
+    if not value_dicts:
+        return {}, {}, []
+    if key_fields is None:
+        key_fields = [k for k in value_dicts[0].keys() if k.endswith('_id')]
+    return await _run_bulk_get_or_create(
+        db_session, ModelClass, list(key_fields), value_dicts, defaults, None
+    )
@@ -0,0 +1,74 @@
+'''
+Resumable cursor checkpoints for cursored endpoints, shared by all actor-processes through redis.
+
+Checkpoints are kept in one redis hash per work_type, e.g. twitter-checkpoints:user_timeline,
+with a field per entity id (user_id or conversation_id). A cursored scrape saves the next
+cursor after each page has been processed and clears it once the scrape finishes, so a
+checkpoint only outlives a scrape that crashed or failed part-way through. The next scrape
+of the same entity resumes from it.
+'''
+import time
+
+import msgpack
+import redio
+
+from twitter_pqueue_scraper.util.redis_util import REDIS_URL
+
+
+CHECKPOINT_KEY_PREFIX = 'twitter-checkpoints'
+CHECKPOINT_MAX_AGE = 7 * 24 * 60 * 60  # seconds, older checkpoints are discarded instead of resumed
+
+
+class CursorCheckpoints(object):
+
+    def __init__(self):
+        self.redis_cli = redio.Redis(REDIS_URL)
+
+    @staticmethod
+    def _get_key(work_type):
+        return f"{CHECKPOINT_KEY_PREFIX}:{work_type}"
+
+    async def load(self, work_type, entity_id, min_saved_at=None):
+        """
+        returns the saved cursor, or None. min_saved_at (epoch seconds) is when the
+        caller's own state last moved on, e.g. the entity's last successful scrape,
+        an older checkpoint is stale and discarded rather than resumed
+        """
+        try:
+            value = await self.redis_cli().hget(self._get_key(work_type), str(entity_id))
+            if value is None:
+                return None
+            checkpoint = msgpack.loads(value)
+            saved_at = checkpoint['saved_at']
+            if time.time() - saved_at > CHECKPOINT_MAX_AGE or (min_saved_at and saved_at < min_saved_at):
+                await self.clear(work_type, entity_id)
+                return None
+            return checkpoint['cursor']
+        except Exception as e:
+            print(f"warning: failed to load checkpoint: {work_type}, {entity_id}: {e}")
+            return None
+
+    async def save(self, work_type, entity_id, cursor):
+        checkpoint = msgpack.dumps({'cursor': cursor, 'saved_at': time.time()})
+        try:
+            await self.redis_cli().hset(self._get_key(work_type), str(entity_id), checkpoint)
+        except Exception as e:
+            # the scrape carries on, a crash would just resume from an earlier page
+            print(f"warning: failed to save checkpoint: {work_type}, {entity_id}: {e}")
+
+    async def clear(self, work_type, entity_id):
+        try:
+            await self.redis_cli().hdel(self._get_key(work_type), str(entity_id))
+        except Exception as e:
+            print(f"warning: failed to clear checkpoint: {work_type}, {entity_id}: {e}")
+
+
+# a per process cache
+_CHECKPOINTS = None
+
+
+def get_checkpoints():
+    global _CHECKPOINTS
+    if _CHECKPOINTS is None:
+        _CHECKPOINTS = CursorCheckpoints()
+    return _CHECKPOINTS
@@ -0,0 +1,180 @@
+'''
+A small, bounded pool of natively async Postgres connections for trio.
+
+psycopg2's asynchronous connections expose a socket and a poll() method, so
+queries are driven with trio.lowlevel.wait_readable()/wait_writable() instead
+of a thread hop per query. Limitations of psycopg2's async mode apply: no COPY,
+no executemany() and connections are in autocommit mode unless
+AsyncDBConnection.transaction() is used.
+'''
+from contextlib import asynccontextmanager
+import time
+
+import psycopg2
+from psycopg2 import extensions
+import trio
+
+from twitter_pqueue_scraper.util.db_util import _create_db_connection_str
+
+
+DB_POOL_SIZE = 10
+HEALTH_CHECK_INTERVAL = 30  # seconds a connection may sit idle before it is pinged
+CONNECT_TIMEOUT = 10
+
+
+async def _wait_for_poll(conn):
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        if state == extensions.POLL_READ:
+            await trio.lowlevel.wait_readable(conn.fileno())
+        elif state == extensions.POLL_WRITE:
+            await trio.lowlevel.wait_writable(conn.fileno())
+        else:
+            raise psycopg2.OperationalError(f"unexpected poll() state: {state}")
+
+
+class AsyncDBConnection(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.last_used = time.monotonic()
+
+    @classmethod
+    async def connect(cls, dsn):
+        conn = psycopg2.connect(dsn, async_=1)
+        with trio.fail_after(CONNECT_TIMEOUT):
+            await _wait_for_poll(conn)
+        return cls(conn)
+
+    @property
+    def closed(self):
+        return bool(self.conn.closed)
+
+    def close(self):
+        if not self.conn.closed:
+            self.conn.close()
+
+    async def _execute(self, sql, params=None):
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+        await _wait_for_poll(self.conn)
+        self.last_used = time.monotonic()
+        return cursor
+
+    async def query(self, sql, params=None):
+        """ returns a list of dicts, one per row """
+        cursor = await self._execute(sql, params)
+        try:
+            columns = [col.name for col in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    async def query_one(self, sql, params=None):
+        rows = await self.query(sql, params)
+        return rows[0] if rows else None
+
+    async def execute(self, sql, params=None):
+        """ returns the number of rows affected """
+        cursor = await self._execute(sql, params)
+        rowcount = cursor.rowcount
+        cursor.close()
+        return rowcount
+
+    @asynccontextmanager
+    async def transaction(self):
+        await self.execute('BEGIN')
+        try:
+            yield self
+        except BaseException:
+            with trio.CancelScope(shield=True):
+                try:
+                    await self.execute('ROLLBACK')
+                except psycopg2.Error:
+                    pass  # the pool discards this connection anyway
+            raise
+        await self.execute('COMMIT')
+
+    async def is_healthy(self):
+        if self.closed:
+            return False
+        try:
+            with trio.fail_after(CONNECT_TIMEOUT):
+                await self.execute('SELECT 1')
+        except (psycopg2.Error, trio.TooSlowError):
+            return False
+        return True
+
+
+class AsyncDBPool(object):
+    """
+    One pool is shared by every worker in an actor-process, see: actor_main().
+    At most max_size connections are open at once, callers wait for a free slot.
+    """
+    def __init__(self, dsn=None, max_size=DB_POOL_SIZE):
+        self.dsn = dsn or _create_db_connection_str()
+        self.max_size = max_size
+        self._limiter = trio.CapacityLimiter(max_size)
+        self._idle = []
+
+    async def _get_connection(self):
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.closed:
+                continue
+            if time.monotonic() - conn.last_used > HEALTH_CHECK_INTERVAL:
+                if not await conn.is_healthy():
+                    conn.close()
+                    continue
+            return conn
+        return await AsyncDBConnection.connect(self.dsn)
+
+    @asynccontextmanager
+    async def connection(self):
+        async with self._limiter:
+            conn = await self._get_connection()
+            try:
+                yield conn
+            except BaseException:
+                # the connection may be mid-query (e.g. cancelled), don't reuse it
+                conn.close()
+                raise
+            if not conn.closed:
+                self._idle.append(conn)
+
+    async def query(self, sql, params=None):
+        async with self.connection() as conn:
+            return await conn.query(sql, params)
+
+    async def query_one(self, sql, params=None):
+        async with self.connection() as conn:
+            return await conn.query_one(sql, params)
+
+    async def execute(self, sql, params=None):
+        async with self.connection() as conn:
+            return await conn.execute(sql, params)
+
+    async def check_health(self):
+        """ ping idle connections, dropping any that are broken """
+        for _ in range(len(self._idle)):
+            async with self._limiter:  # pinged connections count towards max_size
+                if not self._idle:
+                    break
+                conn = self._idle.pop(0)
+                if await conn.is_healthy():
+                    self._idle.append(conn)
+                else:
+                    print('warning: dropping unhealthy db connection')
+                    conn.close()
+
+    async def daemon__health_checks(self, interval=HEALTH_CHECK_INTERVAL):
+        while True:
+            await trio.sleep(interval)
+            await self.check_health()
+
+    def close(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle.clear()
@@ -1,12 +1,36 @@
+import hashlib
 import os
+import pickle
+import stat
+import tempfile
+import threading
+import time
 
+from psycopg2.errorcodes import FOREIGN_KEY_VIOLATION
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, text
+from sqlalchemy import MetaData, create_engine, text
 from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.pool import NullPool
 import trio
 
 
+# a per process cache of (engine, Base), reflection is expensive so it
+# should only happen once per actor-process, not once per worker
+_ENGINE_AND_BASE = None
+_ENGINE_LOCK = threading.Lock()
+
+# sessions of all workers in an actor-process share this pool
+SQLALCHEMY_POOL_SIZE = 6
+SQLALCHEMY_MAX_OVERFLOW = 10
+SQLALCHEMY_POOL_RECYCLE = 1800
+
+# reflected table metadata is cached here, keyed by the applied django migrations
+# note: the cache is unpickled, so the directory must be private to this user (see: _is_private)
+SCHEMA_CACHE_DIR = os.environ.get(
+    'SCHEMA_CACHE_DIR', os.path.join(tempfile.gettempdir(), f"twitter-schema-cache-{os.getuid()}")
+)
+REFLECTED_TABLE_PREFIX = 'twitter_'
+
+
 def _create_db_connection_str():
     username = os.environ['POSTGRESQL_USERNAME']
     password = os.environ['POSTGRESQL_PASSWORD']
@@ -37,15 +61,111 @@ class DBSession(Session):
         return await trio.to_thread.run_sync(self.add_all, objects)
 
 
-def _create_sqlalchemy_session():
-
-    Base = automap_base()
-    engine = create_engine(
-        # disable connection pooling until asyncio support improves
-        _create_db_connection_str(), poolclass=NullPool
+def is_foreign_key_violation(e):
+    """ e is a psycopg2 error, or a sqlalchemy error wrapping one """
+    orig = getattr(e, 'orig', e)
+    return getattr(orig, 'pgcode', None) == FOREIGN_KEY_VIOLATION
+
+
+def _get_migration_state_key(engine):
+    # note: django_migrations is an ordinary table, this isn't a catalog query
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT app, name FROM django_migrations ORDER BY app, name;"
+        )).fetchall()
+    migrations_str = ','.join([f"{app}.{name}" for (app, name) in rows])
+    return hashlib.md5(migrations_str.encode()).hexdigest()[:16]
+
+
+def _is_private(path, is_dir):
+    """ owned by this user, not writable by anyone else and not a symlink """
+    st = os.lstat(path)
+    if is_dir and not stat.S_ISDIR(st.st_mode):
+        return False
+    if not is_dir and not stat.S_ISREG(st.st_mode):
+        return False
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _get_schema_cache_dir():
+    """ returns SCHEMA_CACHE_DIR, created with mode 0700 if missing, or None if it isn't private """
+    try:
+        os.makedirs(SCHEMA_CACHE_DIR, mode=0o700, exist_ok=True)
+        if _is_private(SCHEMA_CACHE_DIR, is_dir=True):
+            return SCHEMA_CACHE_DIR
+    except OSError as e:
+        print(f"warning: schema cache dir unavailable {SCHEMA_CACHE_DIR}: {e}")
+        return None
+    print(f"warning: schema cache disabled, {SCHEMA_CACHE_DIR} is not private to this user")
+    return None
+
+
+def _load_metadata(engine, use_cache=True):
+    """
+    Returns the MetaData of the django tables and whether it came from the cache.
+    The cache file is only valid for the exact set of applied migrations, so
+    running a new migration invalidates it.
+    """
+    cache_filepath = None
+    cache_dir = _get_schema_cache_dir() if use_cache else None
+    if cache_dir:
+        state_key = _get_migration_state_key(engine)
+        cache_filepath = os.path.join(cache_dir, f"twitter-schema-{state_key}.pickle")
+        if os.path.exists(cache_filepath) and not _is_private(cache_filepath, is_dir=False):
+            print(f"warning: ignoring schema cache {cache_filepath}, it's not private to this user")
+        elif os.path.exists(cache_filepath):
+            try:
+                with open(cache_filepath, 'rb') as f:
+                    return pickle.load(f), True
+            except Exception as e:
+                print(f"warning: failed to load schema cache {cache_filepath}: {e}")
+
+    metadata = MetaData()
+    metadata.reflect(
+        engine, only=lambda table_name, _: table_name.startswith(REFLECTED_TABLE_PREFIX)
     )
-    # reflect the tables
-    Base.prepare(engine, reflect=True)
+    if cache_filepath:
+        tmp_filepath = f"{cache_filepath}.{os.getpid()}.tmp"
+        fd = os.open(tmp_filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(metadata, f)
+        os.replace(tmp_filepath, cache_filepath)  # atomic, other actors may be reading
+
+    return metadata, False
+
+
+def _create_automap_base(metadata):
+    Base = automap_base(metadata=metadata)
+    Base.prepare()  # classes are mapped from the existing metadata, no reflection
+    return Base
+
+
+def _get_engine_and_base():
+    global _ENGINE_AND_BASE
+
+    with _ENGINE_LOCK:
+        if _ENGINE_AND_BASE is None:
+            bf = time.perf_counter()
+            engine = create_engine(
+                _create_db_connection_str(),
+                pool_size=SQLALCHEMY_POOL_SIZE,
+                max_overflow=SQLALCHEMY_MAX_OVERFLOW,
+                pool_recycle=SQLALCHEMY_POOL_RECYCLE,
+                pool_pre_ping=True  # health check connections on checkout
+            )
+            metadata, from_cache = _load_metadata(engine)
+            Base = _create_automap_base(metadata)
+            _ENGINE_AND_BASE = (engine, Base)
+
+            time_taken = time.perf_counter() - bf
+            source = 'cache' if from_cache else 'reflection'
+            print(f"db schema loaded from {source}, took: {time_taken:.3f}s")
+
+    return _ENGINE_AND_BASE
+
+
+def _create_sqlalchemy_session():
+    engine, Base = _get_engine_and_base()
     session = DBSession(engine)
     return session, Base
 
@@ -11,6 +11,10 @@ import trio
 
 from trio_util.http_util import TrioHttpSession
 
+from twitter_pqueue_scraper.util.json_util import loads_response
+from twitter_pqueue_scraper.util.quota import get_endpoint_slug
+from twitter_pqueue_scraper.util.rate_limit import get_rate_limit_bucket
+
 
 RETRY_LIMIT = 10
 
@@ -44,6 +48,8 @@ class TwitterHttpSession(object):
         self.consumer_key = account_dict.get('consumer_key')
         self.consumer_secret_key = account_dict.get('consumer_secret_key')
         self.app_bearer_token = None
+        self.account_key = None
+        self.quota_ledger = None  # set by actor_main(), see: util/quota.py
 
     @staticmethod
     def create_from_account_dict(account_dict):
@@ -78,18 +84,32 @@ class TwitterHttpSession(object):
     def _get_auth_headers(self):
         return {"Authorization": f"Bearer {self.bearer_token}"}
 
+    def get_rate_budget(self, url, app_auth=False):
+        """ requests left in url's current rate limit window, None if not known yet """
+        headers = self._get_auth_headers()
+        if app_auth:
+            if self.app_bearer_token is None:
+                return None
+            headers = {"Authorization": f"Bearer {self.app_bearer_token}"}
+        return get_rate_limit_bucket(headers, url).remaining
+
     @log_call(include_args=['method', 'url'], include_result=False)
     async def do_request(self, method, url, headers=None, data=None, auth=None):
 
         if headers is None:
             headers = self._get_auth_headers()
 
+        # shared by every session (in this process) with the same credentials
+        rate_limit = get_rate_limit_bucket(headers, url)
+
         for i in range(RETRY_LIMIT):
             try:
-                return await _do_request(
+                status, resp_obj = await _do_request(
                     self.http_session, method, url,
-                    headers=headers, data=data, auth=auth
+                    headers=headers, data=data, auth=auth, rate_limit=rate_limit
                 )
+                await self._debit_quota(url)
+                return status, resp_obj
             except (httpx.TimeoutException, httpx.NetworkError):
                 if i != RETRY_LIMIT-1:
                     print(f'warning: connection issues, retrying: {method} {url}')
@@ -100,6 +120,16 @@ class TwitterHttpSession(object):
                 print()
         return 522, None  # connection timed out
 
+    async def _debit_quota(self, url):
+        endpoint_slug = get_endpoint_slug(url)
+        if self.quota_ledger is None or endpoint_slug is None:
+            return
+        try:
+            await self.quota_ledger.debit(self.account_key, endpoint_slug)
+        except Exception as e:
+            # don't fail the request, the scheduler just routes on slightly stale usage
+            print(f"warning: failed to debit quota: {self.account_key}, {endpoint_slug}: {e}")
+
     async def get_follower_ids(self, user_id, cursor=None):
 
         url = f'https://api.twitter.com/1.1/followers/ids.json?user_id={user_id}&stringify_ids=true&count=5000'
@@ -129,11 +159,13 @@ class TwitterHttpSession(object):
         status, resp_obj = await self.do_request('get', url)
         return status, resp_obj
 
-    async def get_user_likes(self, user_id, since_id=None):
+    async def get_user_likes(self, user_id, since_id=None, max_id=None):
 
         url = f"https://api.twitter.com/1.1/favorites/list.json?user_id={user_id}&count=200&include_entities=true"
         if since_id:
             url = url + '&since_id=' + str(since_id)
+        if max_id:
+            url = url + '&max_id=' + str(max_id)
 
         status, resp_obj = await self.do_request('get', url)
         return status, resp_obj
@@ -175,7 +207,7 @@ class TwitterHttpSession(object):
         if status_code != 200:
             return None
 
-        self.app_bearer_token = resp_obj.json()['access_token']
+        self.app_bearer_token = loads_response(resp_obj)['access_token']
         return self.app_bearer_token
 
     async def v2__get_conversation_tweets(self, conversation_id, cursor=None):
@@ -204,10 +236,15 @@ class TwitterHttpSession(object):
         return await self.do_request('get', url)
 
 
-async def _do_request(http_session, method, url, headers=None, data=None, auth=None):
+async def _do_request(
+    http_session, method, url, headers=None, data=None, auth=None, rate_limit=None
+):
     # print('doing request: %s' % url[23:60])
     method = method.upper()
 
+    if rate_limit is not None:
+        await rate_limit.acquire()
+
     if method == 'GET':
         print(f'GET: {url[:140]}')
         with start_action(action_type=u"get_request"):
@@ -233,24 +270,16 @@ async def _do_request(http_session, method, url, headers=None, data=None, auth=N
                     url, headers=headers, data=data, auth=auth
                 )
 
+    if rate_limit is not None:
+        rate_limit.update(status, resp_obj.headers)
+
     if status == 429:
-        # wait and retry
-        print('status 429, waiting 6 minutes: %s' % url)
-        await trio.sleep(360)
+        # retry, the rate_limit bucket waits until the window resets
+        print('status 429, retrying after rate limit reset: %s' % url)
         with start_action(action_type=u"request_retry"):
             return await _do_request(
-                http_session, method, url, headers=headers, data=data, auth=auth
+                http_session, method, url, headers=headers, data=data, auth=auth,
+                rate_limit=rate_limit
             )
 
-    elif 'x-rate-limit-remaining' in resp_obj.headers:
-        val = int(resp_obj.headers['x-rate-limit-remaining'])
-        # note: these waits are in addition to the request delay in parent function (usually 60s)
-        if val == 1:
-            await trio.sleep(40)
-        elif val == 0:
-            print('x-rate-limit-remaining == 0, waiting 6 minutes: %s' % url)
-            await trio.sleep(360)
-
     return status, resp_obj
-
-
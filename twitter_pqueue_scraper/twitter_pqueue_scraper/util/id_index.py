@@ -0,0 +1,128 @@
+'''
+Db primary keys by api id, shared by all actor-processes through redis.
+
+A redis hash, twitter-idx:profile (user_id -> TwitterProfile.id). Actors resolve ids
+here before going to the db and publish() the ids of every profile they write. An actor that is about to create
+a row claim()s its api id first: a claim is a key with a ttl, set with SET NX, so only
+one actor creates the row and the others resolve it from the index once it's published.
+
+Tweets aren't indexed: there is one entry per row ever written, so the hash would grow
+without bound, and a tweet is rarely written again by another actor, the per-actor
+cache covers them (see: util/identity_cache.py).
+
+The webserver removes the entries of merged profiles, the index can be rebuilt from
+postgres and checked against it with: manage.py rebuild_id_index / check_id_index
+'''
+import redio
+
+from twitter_pqueue_scraper.util.redis_util import REDIS_URL
+
+
+# note: keep in sync with the webserver's twitter/util/redis_util.py
+ID_INDEX_KEYS = {
+    'profile': 'twitter-idx:profile',
+}
+CLAIM_KEY_PREFIX = 'twitter-idx-claim'
+CLAIM_TTL = 60  # seconds, a claim is released early when the row's id is published
+
+CLAIMED = 0
+CLAIMED_ELSEWHERE = -1
+
+# KEYS: index hash  ARGV: claim key prefix, ttl, owner, api_id1, api_id2...
+# returns, for each api id: its pk when it's indexed, else CLAIMED or CLAIMED_ELSEWHERE
+RESOLVE_OR_CLAIM_LUA = """
+local results = {}
+for i = 4, #ARGV do
+    local pk = redis.call('HGET', KEYS[1], ARGV[i])
+    if pk then
+        results[#results + 1] = tonumber(pk)
+    elseif redis.call('SET', ARGV[1] .. ARGV[i], ARGV[3], 'NX', 'EX', ARGV[2]) then
+        results[#results + 1] = 0
+    else
+        results[#results + 1] = -1
+    end
+end
+return results
+"""
+
+# KEYS: claim keys  ARGV: owner
+# deletes only this owner's claims, a claim that expired may have been re-claimed elsewhere
+RELEASE_CLAIMS_LUA = """
+for i = 1, #KEYS do
+    if redis.call('GET', KEYS[i]) == ARGV[1] then
+        redis.call('DEL', KEYS[i])
+    end
+end
+return 0
+"""
+
+
+def _get_claim_prefix(kind):
+    return f"{CLAIM_KEY_PREFIX}:{kind}:"
+
+
+def _get_claim_keys(kind, api_ids):
+    claim_prefix = _get_claim_prefix(kind)
+    return [f"{claim_prefix}{api_id}" for api_id in api_ids]
+
+
+class SharedIdIndex(object):
+
+    def __init__(self, owner):
+        self.redis_cli = redio.Redis(REDIS_URL)
+        self.owner = owner  # e.g. the actor's name, stored in its claims
+
+    async def resolve(self, kind, api_ids):
+        """ returns {api_id: pk} for the api ids that are indexed """
+        api_ids = list(api_ids)
+        if not api_ids:
+            return {}
+        pks = await self.redis_cli().hget(ID_INDEX_KEYS[kind], api_ids)  # HMGET
+        return {api_id: int(pk) for api_id, pk in zip(api_ids, pks) if pk is not None}
+
+    async def claim(self, kind, api_ids):
+        """
+        Returns (pks_by_api_id, claimed, claimed_elsewhere). The caller should create
+        the rows of the claimed api ids and publish() their ids, rows claimed elsewhere
+        are being created by another actor.
+        """
+        api_ids = list(api_ids)
+        if not api_ids:
+            return {}, [], []
+        results = await self.redis_cli().eval(
+            RESOLVE_OR_CLAIM_LUA, 1, ID_INDEX_KEYS[kind],
+            _get_claim_prefix(kind), CLAIM_TTL, self.owner, *api_ids
+        )
+        pks_by_api_id, claimed, claimed_elsewhere = {}, [], []
+        for api_id, result in zip(api_ids, results):
+            if result == CLAIMED:
+                claimed.append(api_id)
+            elif result == CLAIMED_ELSEWHERE:
+                claimed_elsewhere.append(api_id)
+            else:
+                pks_by_api_id[api_id] = result
+        return pks_by_api_id, claimed, claimed_elsewhere
+
+    async def publish(self, kind, pks_by_api_id):
+        """ indexes the ids of rows that were written, releasing this owner's claims on them """
+        if not pks_by_api_id:
+            return
+        claim_keys = _get_claim_keys(kind, pks_by_api_id)
+        await self.redis_cli().hset(
+            ID_INDEX_KEYS[kind], pks_by_api_id
+        ).eval(RELEASE_CLAIMS_LUA, len(claim_keys), *claim_keys, self.owner)
+
+    async def release(self, kind, api_ids):
+        """ releases claims without publishing, e.g. when creating the rows failed """
+        api_ids = list(api_ids)
+        if not api_ids:
+            return
+        claim_keys = _get_claim_keys(kind, api_ids)
+        await self.redis_cli().eval(RELEASE_CLAIMS_LUA, len(claim_keys), *claim_keys, self.owner)
+
+    async def remove(self, kind, api_ids):
+        """ removes entries that turned out to be stale, e.g. a pk that caused a foreign key violation """
+        api_ids = list(api_ids)
+        if not api_ids:
+            return
+        await self.redis_cli().hdel(ID_INDEX_KEYS[kind], *api_ids)
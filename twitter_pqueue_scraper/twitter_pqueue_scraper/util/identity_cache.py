@@ -0,0 +1,157 @@
+'''
+A bounded, per actor-process cache of db primary keys by api id: TwitterProfile.id by
+user_id and Tweet.id by tweet_api_id.
+
+Ingestion consults it before the db, so authors, mentioned users and tweets that show
+up batch after batch are resolved without a lookup, and fills it from every ingest
+result. Entries can only go stale when rows are merged/removed, so the webserver's
+merge-twitter-profiles view increments a redis generation counter (IDENTITY_GENERATION_KEY)
+and the cache is cleared whenever it sees a new generation, see: check_generation().
+
+Profile misses are looked up in the index shared by all actors (see: util/id_index.py)
+with prefetch(), and written profiles are published to it, so a profile written by one
+actor is resolved by the others without a db lookup. Tweets are only cached per actor.
+
+note: all workers of an actor share the cache from the trio thread, it's not thread-safe
+'''
+from collections import OrderedDict
+import os
+
+import redio
+import trio
+
+from twitter_pqueue_scraper.util.id_index import ID_INDEX_KEYS, SharedIdIndex
+from twitter_pqueue_scraper.util.redis_util import REDIS_URL
+
+
+IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 200000))  # entries per table
+# note: keep in sync with the webserver's twitter/util/redis_util.py
+IDENTITY_GENERATION_KEY = 'twitter-identity-generation'
+STATS_INTERVAL = 300  # seconds between hit-rate reports
+
+
+class LRUCache(object):
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items  # note: not counted as a lookup
+
+    def get(self, key):
+        pk = self._items.get(key)
+        if pk is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return pk
+
+    def put(self, key, pk):
+        self._items[key] = pk
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def put_many(self, pks_by_key):
+        for key, pk in pks_by_key.items():
+            self.put(key, pk)
+
+    def discard(self, key):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+    @property
+    def hit_rate(self):
+        num_lookups = self.hits + self.misses
+        return self.hits / num_lookups if num_lookups else 0.0
+
+
+class IdentityCache(object):
+
+    def __init__(self, owner, max_size=IDENTITY_CACHE_SIZE):
+        self.redis_cli = redio.Redis(REDIS_URL)
+        self.shared = SharedIdIndex(owner)
+        self.profiles = LRUCache(max_size)
+        self.tweets = LRUCache(max_size)
+        self.generation = None
+        self.num_invalidations = 0
+        self.num_forgotten = 0
+        self.shared_hits, self.shared_misses = 0, 0
+
+    def get_table(self, lookup_name):
+        """ lookup_name is 'profile' or 'tweet', as in deferred_batch.FOREIGN_KEYS """
+        return self.profiles if lookup_name == 'profile' else self.tweets
+
+    def resolve(self, lookup_name, api_ids):
+        """ a list of cached pks (or None) for the api ids """
+        table = self.get_table(lookup_name)
+        return [None if api_id is None else table.get(api_id) for api_id in api_ids]
+
+    def clear(self):
+        self.profiles.clear()
+        self.tweets.clear()
+
+    async def prefetch(self, lookup_name, api_ids):
+        """ copies the pks of api ids that aren't cached from the shared index """
+        if lookup_name not in ID_INDEX_KEYS:
+            return
+        table = self.get_table(lookup_name)
+        missing = {api_id for api_id in api_ids if api_id is not None and api_id not in table}
+        if not missing:
+            return
+        pks_by_api_id = await self.shared.resolve(lookup_name, missing)
+        table.put_many(pks_by_api_id)
+        self.shared_hits += len(pks_by_api_id)
+        self.shared_misses += len(missing) - len(pks_by_api_id)
+
+    async def publish(self, lookup_name, pks_by_api_id):
+        """ caches the pks of rows that were written and adds them to the shared index """
+        self.get_table(lookup_name).put_many(pks_by_api_id)
+        if lookup_name in ID_INDEX_KEYS:
+            await self.shared.publish(lookup_name, pks_by_api_id)
+
+    async def forget(self, lookup_name, api_ids):
+        """ drops pks that turned out to be stale, here and in the shared index """
+        table = self.get_table(lookup_name)
+        api_ids = list(api_ids)
+        for api_id in api_ids:
+            table.discard(api_id)
+        self.num_forgotten += len(api_ids)
+        if lookup_name in ID_INDEX_KEYS:
+            await self.shared.remove(lookup_name, api_ids)
+
+    async def check_generation(self):
+        """ call before using cached pks, clears the cache if profiles were merged since """
+        generation = await self.redis_cli().get(IDENTITY_GENERATION_KEY)
+        if generation == self.generation:
+            return
+        if self.generation is not None or len(self.profiles) or len(self.tweets):
+            self.num_invalidations += 1
+            self.clear()
+        self.generation = generation
+
+    def get_stats(self):
+        stats = {
+            'invalidations': self.num_invalidations, 'forgotten': self.num_forgotten,
+            'shared_hits': self.shared_hits, 'shared_misses': self.shared_misses,
+        }
+        for name, table in [('profiles', self.profiles), ('tweets', self.tweets)]:
+            stats[name] = {
+                'size': len(table), 'hits': table.hits, 'misses': table.misses,
+                'hit_rate': round(table.hit_rate, 3), 'evictions': table.evictions,
+            }
+        return stats
+
+    async def daemon__report_stats(self, interval=STATS_INTERVAL):
+        while True:
+            await trio.sleep(interval)
+            print(f"identity cache: {self.get_stats()}")
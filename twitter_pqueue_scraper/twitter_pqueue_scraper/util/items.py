@@ -1,8 +1,11 @@
 
 class TwitterConversationWorkItem(object):
 
-    def __init__(self, line_id=None, conversation_id=None, work_type=None, **kwargs):
+    def __init__(
+        self, line_id=None, conversation_id=None, work_type=None, dedup_key=None, **kwargs
+    ):
         self.line_id = line_id
+        self.dedup_key = dedup_key
         self.conversation_id = conversation_id
         self.work_type = work_type
 
@@ -20,15 +23,17 @@ class TwitterProfileWorkItem(object):
 
     def __init__(
         self, line_id=None, obj_id=None, work_type=None, user_id=None,
-        screen_name=None, user_info=None, since_id=None,
-        mentioned_by_user=None, completion_event_uid=None, **kwargs
+        screen_name=None, user_info=None, has_user_info=None, since_id=None,
+        mentioned_by_user=None, completion_event_uid=None, dedup_key=None, **kwargs
     ):
         self.line_id = line_id
+        self.dedup_key = dedup_key
         self.obj_id = obj_id
         self.work_type = work_type
         self.user_id = str(user_id) if user_id else None
         self.screen_name = screen_name.lower() if screen_name else None
-        self.user_info = user_info
+        self.user_info = user_info  # note: lines added before has_user_info carry the full blob
+        self.has_user_info = bool(has_user_info or user_info)
         self.since_id = since_id
         self.mentioned_by_user = mentioned_by_user
         self.completion_event_uid = completion_event_uid
@@ -42,7 +47,7 @@ class TwitterProfileWorkItem(object):
         user_id = msg_di.get('user_id')
         screen_name = msg_di.get('screen_name')
 
-        user_info = msg_di.get('user_info')
+        has_user_info = msg_di.get('has_user_info') or msg_di.get('user_info')
 
         if not work_type:
             return False, None
@@ -55,8 +60,8 @@ class TwitterProfileWorkItem(object):
         else:
             if not (obj_id and type(obj_id) is int):
                 return False, None
-            # user_info required to check is_available & number of followers/friends
-            if not (user_id and user_info):
+            # the webserver only sends profiles that have user_info and are available
+            if not (user_id and has_user_info):
                 return False, None
 
         return True, TwitterProfileWorkItem(**msg_di)
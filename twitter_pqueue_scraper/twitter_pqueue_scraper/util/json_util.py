@@ -0,0 +1,46 @@
+'''
+JSON encoding/decoding for api responses and stored tweet/user json.
+
+Uses orjson when it's installed, otherwise the standard library. JSON_BACKEND=json
+forces the standard library. orjson writes compact json (no spaces after separators)
+and only encodes 64-bit integers and str keys, anything it rejects is retried with
+the standard library, it decodes larger integers as floats (twitter ids are 64-bit).
+
+note: keep in sync with the webserver's twitter/util/json_util.py
+'''
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson' if orjson else 'json')
+
+
+def _loads__orjson(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return json.loads(data)
+
+
+def _dumps__orjson(obj):
+    """ returns a str, same as json.dumps() """
+    try:
+        return orjson.dumps(obj).decode()
+    except TypeError:
+        return json.dumps(obj)
+
+
+if JSON_BACKEND == 'orjson':
+    loads, dumps = _loads__orjson, _dumps__orjson
+else:
+    loads, dumps = json.loads, json.dumps
+
+
+def loads_response(resp_obj):
+    """ replaces resp_obj.json(), decodes the raw body without building a str first """
+    return loads(resp_obj.content)
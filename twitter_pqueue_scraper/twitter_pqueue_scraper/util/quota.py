@@ -0,0 +1,111 @@
+'''
+Live per-account, per-endpoint api quota usage, shared by all actor-processes through redis.
+
+Usage is counted in one redis key per (account, endpoint, quota period), e.g.
+twitter-quota:my-account-1:twitter:user-info:quarter-hour:1893456, which expires
+once its period has ended. Actors debit() a unit for every request they send,
+the main actor reads the counters to route work (see: execution/scheduler.py).
+'''
+import time
+import urllib.parse
+
+import redio
+
+from twitter_pqueue_scraper.util.redis_util import REDIS_URL
+
+
+QUOTA_KEY_PREFIX = 'twitter-quota'
+EXPIRE_MARGIN = 60  # seconds a counter is kept after its period ends
+
+# note: periods are aligned the same way as ApiQuotaPeriod's (contiguous from midnight UTC)
+PERIOD_DURATIONS = {
+    'minute': 60,
+    'quarter-hour': 15 * 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
+
+# keep in sync with ENDPOINT_QUOTAS['twitter'] in twitter_webserver/twitter/models.py,
+# these are the defaults when the webserver doesn't have an ApiQuotaPeriod for an account
+ENDPOINT_QUOTAS = [
+    ('twitter:user-info', 'quarter-hour', 300),
+    ('twitter:user-timeline', 'quarter-hour', 1500),
+    ('twitter:user-timeline', 'day', 100000),
+    ('twitter:user-likes', 'quarter-hour', 75),
+    ('twitter:friend-ids', 'quarter-hour', 15),
+    ('twitter:follower-ids', 'quarter-hour', 15),
+    ('twitter:conversation-tweets', 'quarter-hour', 450),
+    ('twitter:tweets-lookup', 'quarter-hour', 300),
+]
+
+ENDPOINT_SLUGS_BY_PATH = {
+    '/1.1/users/lookup.json': 'twitter:user-info',
+    '/1.1/statuses/user_timeline.json': 'twitter:user-timeline',
+    '/1.1/favorites/list.json': 'twitter:user-likes',
+    '/1.1/friends/ids.json': 'twitter:friend-ids',
+    '/1.1/followers/ids.json': 'twitter:follower-ids',
+    '/2/tweets/search/recent': 'twitter:conversation-tweets',
+    '/2/tweets': 'twitter:tweets-lookup',
+}
+
+ENDPOINT_SLUGS_BY_WORK_TYPE = {
+    'user_info': 'twitter:user-info',
+    'user_timeline': 'twitter:user-timeline',
+    'user_likes': 'twitter:user-likes',
+    'friend_ids': 'twitter:friend-ids',
+    'follower_ids': 'twitter:follower-ids',
+    'conversation_tweets': 'twitter:conversation-tweets',
+}
+
+
+def get_endpoint_slug(url):
+    return ENDPOINT_SLUGS_BY_PATH.get(urllib.parse.urlsplit(url).path)
+
+
+def _get_period_key(account_key, endpoint_slug, duration_slug, now):
+    """ returns the counter's key and the seconds until its period ends """
+    duration = PERIOD_DURATIONS[duration_slug]
+    period_num = int(now // duration)
+    key = f"{QUOTA_KEY_PREFIX}:{account_key}:{endpoint_slug}:{duration_slug}:{period_num}"
+    return key, duration - (now % duration)
+
+
+class QuotaLedger(object):
+
+    def __init__(self, capacities=None):
+        self.redis_cli = redio.Redis(REDIS_URL)
+        # (account_key, endpoint_slug, duration_slug) -> units, overrides ENDPOINT_QUOTAS
+        self.capacities = capacities or {}
+
+    def get_capacity(self, account_key, endpoint_slug, duration_slug, default_units):
+        return self.capacities.get((account_key, endpoint_slug, duration_slug), default_units)
+
+    async def debit(self, account_key, endpoint_slug, units=1):
+        now = time.time()
+        cmd = self.redis_cli().multi()
+        for _endpoint_slug, duration_slug, _ in ENDPOINT_QUOTAS:
+            if _endpoint_slug != endpoint_slug:
+                continue
+            key, secs_remaining = _get_period_key(account_key, endpoint_slug, duration_slug, now)
+            cmd = cmd.incrby(key, units).expire(key, int(secs_remaining) + EXPIRE_MARGIN)
+        await cmd.exec()
+
+    async def fetch_remaining(self, account_keys):
+        """ returns {(account_key, endpoint_slug): units remaining in its tightest period} """
+        now = time.time()
+        keys, key_details = [], []
+        for account_key in account_keys:
+            for endpoint_slug, duration_slug, units in ENDPOINT_QUOTAS:
+                key, _ = _get_period_key(account_key, endpoint_slug, duration_slug, now)
+                capacity = self.get_capacity(account_key, endpoint_slug, duration_slug, units)
+                keys.append(key)
+                key_details.append((account_key, endpoint_slug, capacity))
+
+        used_values = await self.redis_cli().mget(*keys)
+
+        remaining = {}
+        for (account_key, endpoint_slug, capacity), used in zip(key_details, used_values):
+            units_left = capacity - int(used or 0)
+            route = (account_key, endpoint_slug)
+            remaining[route] = min(remaining.get(route, units_left), units_left)
+        return remaining
@@ -0,0 +1,125 @@
+'''
+Per-(credentials, endpoint) rate limiting for the twitter api.
+
+Twitter reports each endpoint's limit in the x-rate-limit-limit,
+x-rate-limit-remaining and x-rate-limit-reset (epoch seconds) response
+headers. A RateLimitBucket tracks those values, and acquire() is awaited
+before every request: it spreads the remaining requests evenly across what
+is left of the window, and when nothing remains it sleeps until the reset.
+
+Buckets live in a per-process registry, so every worker in an actor-process
+that uses the same credentials shares the same buckets.
+'''
+import hashlib
+import time
+import urllib.parse
+
+import trio
+
+
+DEFAULT_WINDOW = 15 * 60  # used when a 429 doesn't include x-rate-limit-reset
+RESET_MARGIN = 2  # seconds, allows for clock skew with twitter's servers
+LOG_WAIT_THRESHOLD = 10  # only log waits longer than this (seconds)
+
+# a per process cache: (credentials_key, endpoint) -> RateLimitBucket
+RATE_LIMIT_BUCKETS = {}
+
+
+def _get_endpoint(url):
+    # e.g. '/1.1/followers/ids.json', query parameters don't affect the limit
+    return urllib.parse.urlsplit(url).path
+
+
+def _get_credentials_key(headers):
+    auth_header = (headers or {}).get('Authorization') or ''
+    if isinstance(auth_header, str):
+        auth_header = auth_header.encode()
+    return hashlib.md5(auth_header).hexdigest()
+
+
+def get_rate_limit_bucket(headers, url):
+    key = (_get_credentials_key(headers), _get_endpoint(url))
+    if key not in RATE_LIMIT_BUCKETS:
+        RATE_LIMIT_BUCKETS[key] = RateLimitBucket(*key)
+    return RATE_LIMIT_BUCKETS[key]
+
+
+class RateLimitBucket(object):
+
+    def __init__(self, credentials_key, endpoint):
+        self.credentials_key = credentials_key
+        self.endpoint = endpoint
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None  # epoch seconds, as reported by twitter
+        self.next_request_at = 0
+        self.lock = trio.Lock()
+
+    def __repr__(self):
+        return (
+            f"RateLimitBucket({self.credentials_key[:8]}, {self.endpoint}, "
+            f"remaining={self.remaining}/{self.limit})"
+        )
+
+    def _refill_if_reset(self, now):
+        if self.reset_at is not None and now >= self.reset_at + RESET_MARGIN:
+            self.remaining = self.limit
+            self.reset_at = None
+
+    async def _sleep_until(self, wake_at, reason):
+        secs = wake_at - time.time()
+        if secs <= 0:
+            return
+        if secs > LOG_WAIT_THRESHOLD:
+            print(f"rate limit: waiting {secs:.0f}s ({reason}): {self}")
+        await trio.sleep(secs)
+
+    async def acquire(self):
+        """ wait until a request may be sent on this bucket """
+        # note: the lock is held while sleeping, so requests go out one at a time
+        async with self.lock:
+            self._refill_if_reset(time.time())
+
+            if self.remaining is not None and self.remaining <= 0:
+                reset_at = self.reset_at or time.time() + DEFAULT_WINDOW
+                await self._sleep_until(reset_at + RESET_MARGIN, 'exhausted')
+                self.remaining = self.limit
+                self.reset_at = None
+
+            await self._sleep_until(self.next_request_at, 'pacing')
+
+            now = time.time()
+            interval = 0
+            if self.remaining and self.reset_at is not None:
+                # spread what's left evenly across the rest of the window
+                interval = max(self.reset_at + RESET_MARGIN - now, 0) / self.remaining
+            self.next_request_at = now + interval
+
+            if self.remaining is not None:
+                # optimistic, update() corrects this from the response headers
+                self.remaining -= 1
+
+    def update(self, status, headers):
+        """ record the limits reported by a response """
+        try:
+            limit = int(headers['x-rate-limit-limit'])
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset_at = int(headers['x-rate-limit-reset'])
+        except (KeyError, TypeError, ValueError):
+            limit, remaining, reset_at = None, None, None
+
+        if status == 429:
+            self.remaining = 0
+            self.reset_at = reset_at or time.time() + DEFAULT_WINDOW
+            return
+
+        if remaining is None:
+            return  # this endpoint doesn't report rate limits
+
+        self.limit = limit
+        if reset_at == self.reset_at and self.remaining is not None:
+            # responses to concurrent requests can arrive out of order
+            self.remaining = min(self.remaining, remaining)
+        else:
+            self.remaining = remaining
+            self.reset_at = reset_at
@@ -9,20 +9,33 @@ REDIS_HOSTNAME = os.environ.get('REDIS_HOSTNAME', 'localhost')
 REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
 REDIS_URL = f"redis://{REDIS_HOSTNAME}:{REDIS_PORT}"
 
+# 'v1': one field per value, each value msgpack'd separately
+# 'v2': a single field, named after the version, holding the whole msgpack'd dict
+# note: both are always decoded, so readers can be upgraded before writers switch to v2
+STREAM_WIRE_FORMAT = os.environ.get('STREAM_WIRE_FORMAT', 'v1')
+WIRE_FORMAT_V2_FIELD = b'v2'
+
 
 class RedisGroupStreamClient(object):
 
-    def __init__(self, stream_name, group_name, consumer_name):
+    def __init__(self, stream_name, group_name, consumer_name, wire_format=None):
         self.stream_name = stream_name
         self.group_name = group_name
         self.consumer_name = consumer_name
+        self.wire_format = wire_format or STREAM_WIRE_FORMAT
         self.redis_cli = redio.Redis(REDIS_URL)
 
     async def xgroup_create(self):
         return await self.redis_cli().xgroup('CREATE', self.stream_name, self.group_name, '$', 'MKSTREAM')
 
-    async def xack(self, *line_ids):
-        await self.redis_cli().xack(self.stream_name, self.group_name, *line_ids)
+    async def xack(self, *line_ids, dedup_keys=None):
+        if dedup_keys:
+            # releases the producer's dedup keys, so the same work can be queued again
+            await self.redis_cli().multi().xack(
+                self.stream_name, self.group_name, *line_ids
+            ).delete(*dedup_keys).exec()
+        else:
+            await self.redis_cli().xack(self.stream_name, self.group_name, *line_ids)
 
     @staticmethod
     def _serialize_line(msg_dict):
@@ -41,13 +54,26 @@ class RedisGroupStreamClient(object):
 
         return field_values_unwrapped
 
+    @staticmethod
+    def _serialize_line_v2(msg_dict):
+        msg_dict = {k: v for k, v in msg_dict.items() if k != 'max_length'}
+        try:
+            return [WIRE_FORMAT_V2_FIELD, msgpack.dumps(msg_dict)]
+        except:
+            return None
+
+    def serialize_line(self, msg_dict):
+        if self.wire_format == 'v2':
+            return self._serialize_line_v2(msg_dict)
+        return self._serialize_line(msg_dict)
+
     async def xadd(self, max_length=None, **kwargs):
 
         if not kwargs:
             print('error: xadd received no kwargs')
             return False, None
 
-        field_values_unwrapped = self._serialize_line(kwargs)
+        field_values_unwrapped = self.serialize_line(kwargs)
 
         if max_length:
             assert type(max_length) is int or max_length.isdigit()
@@ -62,7 +88,7 @@ class RedisGroupStreamClient(object):
 
         cooroutine = self.redis_cli().multi()
         for msg in list_of_msgdicts:
-            field_values_unwrapped = self._serialize_line(msg)
+            field_values_unwrapped = self.serialize_line(msg)
             if field_values_unwrapped is None:
                 return False, None
             cooroutine = cooroutine.xadd(self.stream_name, '*', *field_values_unwrapped)
@@ -71,17 +97,18 @@ class RedisGroupStreamClient(object):
 
         return True, result
 
-    async def xreadgroup(self, count=200, start_id='>'):
+    async def xreadgroup(self, count=200, start_id='>', block=0):
         # start_id='>' means that the data has not been read by the members of the group so far.
         # Setting this to '0' returns data that has been read but unacknowedged (I think)
+        # block is in milliseconds, 0 blocks until a line arrives
 
         count = str(count)
-        args = ['GROUP', self.group_name, self.consumer_name, 'COUNT', count, 'BLOCK', '0',  'STREAMS', self.stream_name, start_id]
+        args = ['GROUP', self.group_name, self.consumer_name, 'COUNT', count, 'BLOCK', str(block),  'STREAMS', self.stream_name, start_id]
 
         result = await self.redis_cli().xreadgroup(*args)
 
-        if result is False:
-            return None
+        if not result:
+            return {}, []  # BLOCK timed out
         if type(result) is redio.exc.ServerError:
             import pdb; pdb.set_trace()
 
@@ -101,28 +128,79 @@ class RedisGroupStreamClient(object):
 
     @staticmethod
     def parse_line(raw_line):
+        """ decodes v1 and v2 lines, and v2 lines with extra v1 fields (e.g. the dlq_* fields) """
         value_dict = {}
         line_id, values = raw_line
         line_id = line_id.decode()
-        while values:
-            key, val = values[:2]
-            try:
-                value_dict[key.decode()] = msgpack.loads(val)
-            except:
-                return False, line_id, None
-            values = values[2:]
+
+        field_values = iter(values)
+        try:
+            for key, val in zip(field_values, field_values):
+                if key == WIRE_FORMAT_V2_FIELD:
+                    value_dict.update(msgpack.loads(val))
+                else:
+                    value_dict[key.decode()] = msgpack.loads(val)
+        except:
+            return False, line_id, None
 
         return True, line_id, value_dict
 
-    async def flush_old_lines(self):
-        pending_ids = []
-        async for id in self.fetch_pending_ids(False):
-            pending_ids.append(id)
-            if len(pending_ids) > 200:
-                # await self.xreadgroup(start_id=pending_ids_chunk[0], count=len(pending_ids_chunk))  # ids need to be re-read before ack
-                print(f"xack {pending_ids[0]} to {pending_ids[-1]} ({len(pending_ids)})")
-                res = await self.xack(*pending_ids)
-                pending_ids.clear()
+    async def fetch_pending_details(self, min_idle_ms=0, count=500):
+        """ async generator of (line_id, consumer_name, idle_ms, delivery_count) for pending lines """
+        start_id = '-'
+        while True:
+            details = await self.redis_cli().xpending(
+                self.stream_name, self.group_name,
+                'IDLE', str(min_idle_ms), start_id, '+', str(count)
+            )
+            if not details:
+                break
+            for line_id, consumer_name, idle_ms, delivery_count in details:
+                yield line_id.decode(), consumer_name.decode(), int(idle_ms), int(delivery_count)
+            start_id = '(' + details[-1][0].decode()  # exclusive, requires redis >= 6.2
+
+    async def xclaim(self, min_idle_ms, *line_ids):
+        """ claims pending lines for this consumer, returns (line_dicts, failed_ids) like xreadgroup() """
+        lines = await self.redis_cli().xclaim(
+            self.stream_name, self.group_name, self.consumer_name, str(min_idle_ms), *line_ids
+        )
+
+        line_dicts, failed_ids = {}, []
+        for raw_line in lines or []:
+            if not raw_line:
+                continue  # the line was deleted (e.g. trimmed) while pending
+            parse_success, line_id, value_dict = self.parse_line(raw_line)
+            if not parse_success:
+                failed_ids.append(line_id)
+                continue
+            line_dicts[line_id] = value_dict
+        return line_dicts, failed_ids
+
+    async def refresh_pending(self, *line_ids):
+        """
+        resets the idle time of pending lines without re-delivering them (the delivery
+        count is unchanged), lines acked in the meantime are ignored by redis
+        """
+        await self.redis_cli().xclaim(
+            self.stream_name, self.group_name, self.consumer_name, '0', *line_ids, 'JUSTID'
+        )
+
+    async def move_to_dlq(self, dlq_stream_name, line_id, reason, delivery_count=None):
+        """ copies a line to the dead-letter stream with the reason it failed, then acks it """
+        lines = await self.redis_cli().xrange(self.stream_name, line_id, line_id)
+        dedup_keys = None
+        if lines:
+            _, values = lines[0]
+            dlq_values = list(values) + self._serialize_line({
+                'dlq_reason': reason,
+                'dlq_line_id': line_id,
+                'dlq_delivery_count': delivery_count,
+            })
+            await self.redis_cli().xadd(dlq_stream_name, '*', *dlq_values)
+            parse_success, _, value_dict = self.parse_line(lines[0])
+            if parse_success and value_dict.get('dedup_key'):
+                dedup_keys = [value_dict['dedup_key']]
+        await self.xack(line_id, dedup_keys=dedup_keys)
 
     async def get_pending_summary(self):
         # note: this gives us delivery counts, which can help detect and remove messages
@@ -0,0 +1,64 @@
+'''
+Bounded retention for the work stream.
+
+Lines are only ever acked, never deleted, so without trimming the stream keeps every
+item that was ever scheduled. A line can be deleted once every consumer group has
+both delivered and acked it, i.e. its id is below each group's last-delivered-id and
+lowest pending id. Acked lines are also kept for retention_ms (e.g. for XRANGE
+debugging), so the stream holds the undelivered/unacked tail plus that window.
+'''
+import time
+
+from twitter_pqueue_scraper.util.redis_util import RedisGroupStreamClient
+
+
+def _parse_line_id(line_id):
+    ms, _, seq = line_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def _min_line_id(*line_ids):
+    line_ids = [line_id for line_id in line_ids if line_id]
+    if not line_ids:
+        return None
+    return min(line_ids, key=_parse_line_id)
+
+
+async def get_safe_trim_id(redis_cli, stream_name, retention_ms):
+    """ returns the id that all lines below can be trimmed, or None if nothing can be """
+    groups = await redis_cli().xinfo('GROUPS', stream_name)
+
+    bounds = [f"{int(time.time() * 1000) - retention_ms}-0"]
+    for group_info in groups or []:
+        group_dict = dict(zip(group_info[::2], group_info[1::2]))
+        group_name = group_dict[b'name'].decode()
+        last_delivered_id = group_dict[b'last-delivered-id'].decode()
+        if last_delivered_id == '0-0':
+            return None  # the group hasn't read anything yet
+
+        bounds.append(last_delivered_id)
+        if group_dict[b'pending']:
+            # summary form: [count, lowest_id, highest_id, consumers]
+            summary = await redis_cli().xpending(stream_name, group_name)
+            bounds.append(summary[1].decode())
+
+    if len(bounds) == 1:
+        return None  # no consumer groups, nothing is known to be processed
+    return _min_line_id(*bounds)
+
+
+async def trim_stream(redis_stream: RedisGroupStreamClient, retention_ms):
+    """ trims acked lines older than retention_ms, returns the number of lines deleted """
+    stream_name = redis_stream.stream_name
+    trim_id = await get_safe_trim_id(redis_stream.redis_cli, stream_name, retention_ms)
+    if trim_id is None:
+        return 0
+    # note: '~' only removes whole radix tree nodes, so it never trims past trim_id
+    return await redis_stream.redis_cli().xtrim(stream_name, 'MINID', '~', trim_id)
+
+
+async def fetch_stream_stats(redis_cli, stream_name):
+    """ returns (num_lines, memory_bytes) """
+    num_lines = await redis_cli().xlen(stream_name)
+    memory_bytes = await redis_cli().memory('USAGE', stream_name)
+    return num_lines, memory_bytes or 0
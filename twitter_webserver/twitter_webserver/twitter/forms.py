@@ -244,6 +244,9 @@ class SelectScrapeTasksForm(forms.Form):
         choices=PRIORITY_CHOICES, initial=2, label='priority', required=False
     )
     limit = forms.IntegerField(label='limit', required=False)
+    only_due = forms.BooleanField(
+        initial=True, required=False, label='only profiles due a scrape'
+    )
     flush_queues = forms.BooleanField(initial=True, required=False)
 
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from twitter.util.id_index import CHUNK_SIZE, INDEXED_MODELS, check_id_index
+from twitter.util.redis_util import invalidate_identity_caches
+
+
+NUM_EXAMPLES = 10
+
+
+class Command(BaseCommand):
+    '''
+    e.g. python manage.py check_id_index --tables=profile --fix
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', action='store', type=str, default='profile')
+        parser.add_argument('--chunk-size', action='store', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--fix', action='store_true', help='remove stale entries, add missing ones')
+
+    def handle(self, *args, **options):
+
+        kinds = [s.strip() for s in options['tables'].split(',') if s.strip()]
+        for kind in kinds:
+            if kind not in INDEXED_MODELS:
+                exit(f"unexpected table: {kind}, expected one of: {list(INDEXED_MODELS)}")
+
+        num_stale = 0
+        for kind in kinds:
+            num_entries, stale, missing = check_id_index(
+                None, kind, chunk_size=options['chunk_size'], fix=options['fix']
+            )
+            print(f"{kind}: {num_entries} entries, {len(stale)} stale, {len(missing)} missing")
+            for api_id, pk in stale[:NUM_EXAMPLES]:
+                print(f"  stale: {api_id} -> {pk}")
+            for api_id, pk in missing[:NUM_EXAMPLES]:
+                print(f"  missing: {api_id} ({pk})")
+            num_stale += len(stale)
+
+        if options['fix'] and num_stale:
+            invalidate_identity_caches()  # scrapers may have cached the stale pks
@@ -37,8 +37,8 @@ class Command(BaseCommand):
                             account_slug=account_slug,
                             service_slug=service_slug,
                             endpoint_slug=endpoint_slug,
-                            start_datetime__gt=period_midpoint,
-                            end_datetime__lt=period_midpoint,
+                            start_datetime__lt=period_midpoint,
+                            end_datetime__gt=period_midpoint,
                             duration_slug=duration_slug
                         ).first()
 
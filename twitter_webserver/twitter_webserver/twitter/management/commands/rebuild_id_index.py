@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from twitter.util.id_index import CHUNK_SIZE, INDEXED_MODELS, rebuild_id_index
+from twitter.util.redis_util import invalidate_identity_caches
+
+
+class Command(BaseCommand):
+    '''
+    e.g. python manage.py rebuild_id_index --tables=profile
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', action='store', type=str, default='profile')
+        parser.add_argument('--chunk-size', action='store', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+
+        kinds = [s.strip() for s in options['tables'].split(',') if s.strip()]
+        for kind in kinds:
+            if kind not in INDEXED_MODELS:
+                exit(f"unexpected table: {kind}, expected one of: {list(INDEXED_MODELS)}")
+
+        for kind in kinds:
+
+            def _on_progress(num_entries):
+                print(f"{kind}: {num_entries} entries written")
+
+            num_entries = rebuild_id_index(
+                None, kind, chunk_size=options['chunk_size'], on_progress=_on_progress
+            )
+            print(f"done: {kind}, {num_entries} entries")
+
+        # scrapers may have cached pks the old index held
+        invalidate_identity_caches()
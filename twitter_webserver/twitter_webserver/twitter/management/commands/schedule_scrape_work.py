@@ -0,0 +1,44 @@
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from twitter.util.scheduling import run_schedule_job
+
+
+WORK_TYPES = ['user_info', 'user_timeline', 'user_likes', 'friend_ids', 'follower_ids']
+
+
+class Command(BaseCommand):
+    '''
+    e.g. python manage.py schedule_scrape_work user_timeline,user_likes --tags=journalists --limit=50000
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('work_types', action='store', type=str)
+        parser.add_argument('--tags', action='store', type=str, required=True)
+        parser.add_argument('--priority', action='store', type=int, default=2)
+        parser.add_argument('--limit', action='store', type=int, default=None)
+        parser.add_argument('--all', action='store_true', help='include profiles not due a scrape')
+        parser.add_argument('--flush', action='store_true')
+
+    def handle(self, *args, **options):
+
+        work_types = [s.strip() for s in options['work_types'].split(',') if s.strip()]
+        for work_type in work_types:
+            if work_type not in WORK_TYPES:
+                exit(f"unexpected work_type: {work_type}, expected one of: {WORK_TYPES}")
+        tag_slugs = options['tags'].split(',')
+
+        def _on_progress(work_type, num_sent, num_suppressed, num_skipped):
+            print(f"{work_type}: {num_sent} sent, {num_suppressed} already queued, {num_skipped} skipped")
+
+        job_id = uuid.uuid4().hex[:16]
+        print(f"schedule job: {job_id}")
+
+        results = run_schedule_job(
+            job_id, tag_slugs, work_types,
+            priority=options['priority'], only_due=not options['all'],
+            limit=options['limit'], flush=options['flush'], on_progress=_on_progress
+        )
+        for work_type, (num_sent, num_suppressed) in results.items():
+            print(f"done: {work_type}, {num_sent} sent, {num_suppressed} already queued")
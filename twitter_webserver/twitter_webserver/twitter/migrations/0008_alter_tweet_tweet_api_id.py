@@ -0,0 +1,18 @@
+# Generated by Django 3.2.4 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('twitter', '0007_auto_20210613_2154'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tweet',
+            name='tweet_api_id',
+            field=models.CharField(db_index=True, max_length=40),
+        ),
+    ]
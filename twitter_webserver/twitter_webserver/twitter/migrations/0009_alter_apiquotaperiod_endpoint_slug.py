@@ -0,0 +1,18 @@
+# Generated by Django 3.2.4 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('twitter', '0008_alter_tweet_tweet_api_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apiquotaperiod',
+            name='endpoint_slug',
+            field=models.CharField(choices=[('azure:named-entity-recognition', 'azure:named-entity-recognition'), ('twitter:user-info', 'twitter:user-info'), ('twitter:user-timeline', 'twitter:user-timeline'), ('twitter:user-likes', 'twitter:user-likes'), ('twitter:friend-ids', 'twitter:friend-ids'), ('twitter:follower-ids', 'twitter:follower-ids'), ('twitter:conversation-tweets', 'twitter:conversation-tweets'), ('twitter:tweets-lookup', 'twitter:tweets-lookup')], max_length=99),
+        ),
+    ]
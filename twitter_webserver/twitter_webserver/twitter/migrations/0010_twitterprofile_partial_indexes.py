@@ -0,0 +1,33 @@
+# Generated by Django 3.2.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('twitter', '0009_alter_apiquotaperiod_endpoint_slug'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='twitterprofile',
+            index=models.Index(condition=models.Q(('user_info__isnull', False), models.Q(('is_available__isnull', True), ('is_available', True), _connector='OR')), fields=['id'], name='profile_schedulable_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='twitterprofile',
+            index=models.Index(condition=models.Q(('user_info__isnull', False), models.Q(('is_available__isnull', True), ('is_available', True), _connector='OR')), fields=['user_timeline_prev_scrape_success'], name='profile_timeline_success_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='twitterprofile',
+            index=models.Index(condition=models.Q(('user_info__isnull', False), models.Q(('is_available__isnull', True), ('is_available', True), _connector='OR')), fields=['user_likes_prev_scrape_success'], name='profile_likes_success_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='twitterprofile',
+            index=models.Index(condition=models.Q(('user_info__isnull', False), models.Q(('is_available__isnull', True), ('is_available', True), _connector='OR')), fields=['friend_ids_prev_scrape_success'], name='profile_friends_success_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='twitterprofile',
+            index=models.Index(condition=models.Q(('user_info__isnull', False), models.Q(('is_available__isnull', True), ('is_available', True), _connector='OR')), fields=['follower_ids_prev_scrape_success'], name='profile_followers_success_idx'),
+        ),
+    ]
@@ -1,12 +1,12 @@
 from collections import defaultdict
 from datetime import timedelta
-import json
 import uuid
 
-from django.db.models import Q
+from django.db.models import Count, ExpressionWrapper, Q
 from django.db import models, transaction
 from util_shared.datetime_utils import get_utc_now
 
+from .util.json_util import get_cached_json
 from .util.model_util import merge_uniquetogether_rels
 
 
@@ -74,18 +74,43 @@ ENDPOINT_QUOTAS = {
         ('twitter:user-info', 'quarter-hour', 300),
         ('twitter:user-timeline', 'quarter-hour', 1500),
         ('twitter:user-timeline', 'day', 100000),  # user-timeline has two simultaneously quota-limits
+        ('twitter:user-likes', 'quarter-hour', 75),
+        ('twitter:friend-ids', 'quarter-hour', 15),
+        ('twitter:follower-ids', 'quarter-hour', 15),
+        ('twitter:conversation-tweets', 'quarter-hour', 450),
+        ('twitter:tweets-lookup', 'quarter-hour', 300),
 
         # note: the v2 API has a project-level cap of tweets, shared by multiple endpoints, of 500,000/month
     ]
 }
 
+# work is due when the previous successful scrape is older than this (or never happened)
+WORKLOAD_STALENESS = {
+    'user_timeline': ('user_timeline_prev_scrape_success', timedelta(days=7)),
+    'user_likes': ('user_likes_prev_scrape_success', timedelta(days=7)),
+    'friend_ids': ('friend_ids_prev_scrape_success', timedelta(days=90)),
+    'follower_ids': ('follower_ids_prev_scrape_success', timedelta(days=90)),
+}
+USER_INFO_STALENESS = timedelta(days=14)  # based on the previous attempt, not success
+
+# note: the partial indexes on TwitterProfile use these as their conditions, queries must
+# include the same predicates for postgres to use them (see: TwitterProfileQuerySet)
+AVAILABLE_Q = Q(is_available__isnull=True) | Q(is_available=True)
+SCHEDULABLE_Q = Q(user_info__isnull=False) & AVAILABLE_Q
+
+# the columns send_scrape_work() reads from a profile
+SCHEDULE_FIELDS = [
+    'id', 'user_id', 'screen_name', 'is_available', 'user_timeline_since_id', 'user_likes_since_id'
+]
+
 _ENDPOINT_CHOICES = []
 _API_SERVICE_CHOICES = []
 
 for service_slug, endpoint_tuples in ENDPOINT_QUOTAS.items():
     _API_SERVICE_CHOICES.append((service_slug, service_slug))
     for (endpoint_slug, duration, units) in endpoint_tuples:
-        _ENDPOINT_CHOICES.append((endpoint_slug, endpoint_slug))
+        if (endpoint_slug, endpoint_slug) not in _ENDPOINT_CHOICES:
+            _ENDPOINT_CHOICES.append((endpoint_slug, endpoint_slug))
 
 
 
@@ -113,11 +138,19 @@ class ApiQuotaPeriod(models.Model):
 
             'start_datetime': self.start_datetime,
             'end_datetime': self.end_datetime,
-            'duration': self.period_duration,
+            'duration': self.duration_slug,
 
-            'units_remaining': self.units_remaining
+            'units_remaining': self.units_remaining,
+            'units_total': self.get_units_total()
         }
 
+    def get_units_total(self):
+        """ the period's limit, from ENDPOINT_QUOTAS (units_remaining starts out at this) """
+        for endpoint_slug, duration_slug, units in ENDPOINT_QUOTAS.get(self.service_slug, []):
+            if endpoint_slug == self.endpoint_slug and duration_slug == self.duration_slug:
+                return units
+        return None
+
 
 class TagCategory(models.Model):
 
@@ -137,15 +170,10 @@ class Tag(models.Model):
 
     @classmethod
     def get_profiles_with_tags(cls, tag_slugs, available_only=True):
-        tag_slugs = [s.strip().lower() for s in tag_slugs]
-        profiles = []
-        for tag in Tag.objects.filter(slug__in=tag_slugs).prefetch_related('profiles'):
-            if available_only:
-                _profiles = [p for p in tag.profiles.all() if p.is_available in (None, True)]
-            else:
-                _profiles = [p for p in tag.profiles.all()]
-
-            profiles.extend(_profiles)
+        # note: returns a queryset, each profile once even if it has several of the tags
+        profiles = TwitterProfile.objects.with_tags(tag_slugs)
+        if available_only:
+            profiles = profiles.available()
         return profiles
 
 
@@ -203,6 +231,51 @@ class ProfileFollowsProfileRel(models.Model):
         )
 
 
+def _get_due_q(work_type, now):
+    if work_type == 'user_info':
+        return Q(user_info__isnull=True) | Q(
+            user_info_prev_scrape_attempt__lt=now - USER_INFO_STALENESS
+        )
+
+    field_name, max_age = WORKLOAD_STALENESS[work_type]
+    return SCHEDULABLE_Q & (
+        Q(**{f'{field_name}__isnull': True}) | Q(**{f'{field_name}__lt': now - max_age})
+    )
+
+
+class TwitterProfileQuerySet(models.QuerySet):
+
+    def with_tags(self, tag_slugs):
+        # a semi-join on the tag rels, instead of a DISTINCT over every column (including user_info)
+        tag_slugs = [s.strip().lower() for s in tag_slugs]
+        tag_rels = TwitterProfileTagRel.objects.filter(tag__slug__in=tag_slugs)
+        return self.filter(id__in=tag_rels.values('twitter_profile_id'))
+
+    def available(self):
+        return self.filter(AVAILABLE_Q)
+
+    def schedulable(self):
+        # has user_info and isn't private/deleted, required for all work_types except user_info
+        return self.filter(SCHEDULABLE_Q)
+
+    def due_for(self, work_type, now=None):
+        return self.filter(_get_due_q(work_type, now or get_utc_now()))
+
+    def for_scheduling(self):
+        # the user_info blobs aren't loaded, send_scrape_work() only needs to know they exist
+        return self.only(*SCHEDULE_FIELDS).annotate(has_user_info=ExpressionWrapper(
+            Q(user_info__isnull=False), output_field=models.BooleanField()
+        ))
+
+    def count_due(self, work_types, now=None):
+        """ returns {work_type: num_profiles_due}, using a single query """
+        now = now or get_utc_now()
+        return self.aggregate(**{
+            work_type: Count('id', filter=_get_due_q(work_type, now))
+            for work_type in work_types
+        })
+
+
 class TwitterProfile(models.Model):
 
     screen_name = models.CharField(max_length=60, blank=True, null=True)
@@ -248,6 +321,29 @@ class TwitterProfile(models.Model):
         'TwitterProfile', through=ProfileFollowsProfileRel
     )
 
+    objects = TwitterProfileQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=SCHEDULABLE_Q, name='profile_schedulable_idx'),
+            models.Index(
+                fields=['user_timeline_prev_scrape_success'], condition=SCHEDULABLE_Q,
+                name='profile_timeline_success_idx'
+            ),
+            models.Index(
+                fields=['user_likes_prev_scrape_success'], condition=SCHEDULABLE_Q,
+                name='profile_likes_success_idx'
+            ),
+            models.Index(
+                fields=['friend_ids_prev_scrape_success'], condition=SCHEDULABLE_Q,
+                name='profile_friends_success_idx'
+            ),
+            models.Index(
+                fields=['follower_ids_prev_scrape_success'], condition=SCHEDULABLE_Q,
+                name='profile_followers_success_idx'
+            ),
+        ]
+
     @property
     def admin_choice_display(self):
         user_str = self.screen_name or self.user_id or 'UNKNOWN_USER'
@@ -263,72 +359,51 @@ class TwitterProfile(models.Model):
             return f'@{self.screen_name}'
         return self.user_id or 'UNKNOWN_USER'
 
+    @property
+    def user_info_dict(self):
+        """ parsed once per instance, see: get_cached_json() """
+        return get_cached_json(self, 'user_info')
+
     @property
     def display_name(self):
         if self.user_info:
-            di = json.loads(self.user_info)
-            return di['name']
+            return self.user_info_dict['name']
         return self.screen_name_or_userid
 
     @property
     def profile_image_url(self):
         if self.user_info:
-            di = json.loads(self.user_info)
-            return di['profile_image_url_https']
+            return self.user_info_dict['profile_image_url_https']
         return None
 
     @property
     def is_due_userinfo_scrape(self):
+        return self.is_valid_for_workload('user_info')
 
-        if self.user_info_prev_scrape_attempt:
-            now = get_utc_now()
-            if (now - self.user_info_prev_scrape_attempt).days > 14:
-                return True
-
-        if self.user_info is None:
-            return True
-        return False
+    def is_valid_for_workload(self, work_type, now=None):
+        # note: the same rules as TwitterProfileQuerySet.due_for(), for a single profile
+        now = now or get_utc_now()
 
-    def is_valid_for_workload(self, work_type, dates):
-        now, week_ago, three_months_ago = dates
-
-        if not work_type.startswith('user_info'):
-            if self.is_available is False:
-                # todo: if user_info_prev_scrape_success < three_months_ago, schedule a recheck
-                return False
+        if work_type == 'user_info':
             if self.user_info is None:
-                return False
-
-        if work_type == 'user_timeline':
-            if self.user_timeline is None:
-                return True
-            if self.user_timeline_prev_scrape_success is None or self.user_timeline_prev_scrape_success < week_ago:
                 return True
-            return False
+            prev_attempt = self.user_info_prev_scrape_attempt
+            return prev_attempt is not None and prev_attempt < now - USER_INFO_STALENESS
 
-        if work_type == 'user_likes':
-            if self.user_likes is None:
-                return True
-            if self.user_likes_prev_scrape_success is None or self.user_likes_prev_scrape_success < week_ago:
-                return True
+        if self.is_available is False:
+            # todo: if user_info_prev_scrape_success < three_months_ago, schedule a recheck
             return False
-
-        if work_type == 'friend_ids':
-            if self.friend_ids is None:
-                return True
-            if self.friend_ids_prev_scrape_success is None or self.friend_ids_prev_scrape_success < three_months_ago:
-                return True
+        if self.user_info is None:
             return False
 
-        if work_type == 'follower_ids':
-            if self.follower_ids is None:
-                return True
-            if self.follower_ids_prev_scrape_success is None or self.follower_ids_prev_scrape_success < three_months_ago:
-                return True
+        if work_type not in WORKLOAD_STALENESS:
+            print(f'warning: is_valid_for_workload() unknown work_type: {work_type}')
             return False
 
-        print('warning: is_valid_for_workload() unknown scenario')
-        return False
+        field_name, max_age = WORKLOAD_STALENESS[work_type]
+        prev_success = getattr(self, field_name)
+        return prev_success is None or prev_success < now - max_age
+
     '''
             # original queries:
             'user_timeline': profiles.filter(
@@ -355,7 +430,7 @@ class TwitterProfile(models.Model):
 
 class Tweet(models.Model):
 
-    tweet_api_id = models.CharField(max_length=40)
+    tweet_api_id = models.CharField(max_length=40, db_index=True)
     json_data = models.TextField(blank=True, null=True)
     scrape_source = models.CharField(  # describes where json_data was fetched from
         max_length=40, blank=True, null=True, choices=TWEET_SOURCES
@@ -391,13 +466,17 @@ class Tweet(models.Model):
                     tweet_obj.author_id = id_to_keep
                     tweet_obj.save()
 
+    @property
+    def json_data_dict(self):
+        """ parsed once per instance, see: get_cached_json() """
+        return get_cached_json(self, 'json_data')
+
     @property
     def text(self):
         if self.json_data is None:
             return 'NONE'
         try:
-            di = json.loads(self.json_data)
-            return di['text'].strip()
+            return self.json_data_dict['text'].strip()
         except:
             import pdb; pdb.set_trace()
             return 'EXCEPTION-PARSING-JSON-DATA'
@@ -420,15 +499,13 @@ class Tweet(models.Model):
     def favorite_count(self):
         if not self.json_data:
             return '?'
-        di = json.loads(self.json_data)
-        return di['favorite_count']
+        return self.json_data_dict['favorite_count']
 
     @property
     def retweet_count(self):
         if not self.json_data:
             return '?'
-        di = json.loads(self.json_data)
-        return di['retweet_count']
+        return self.json_data_dict['retweet_count']
 
 
 class ProfileMentionedInTweet(models.Model):
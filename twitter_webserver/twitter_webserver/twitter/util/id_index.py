@@ -0,0 +1,95 @@
+'''
+Rebuilds and checks the redis index of pks by api id that the scraper actors share
+(see: the scraper's util/id_index.py).
+
+The index is a cache of postgres: a missing entry only costs a scraper a db lookup,
+a stale entry (a pk that was deleted or belongs to another api id) is what must not
+happen. Entries published by scrapers while the index is being rebuilt are lost, they
+are added again the next time their rows are written.
+'''
+import redis
+
+from twitter.models import TwitterProfile
+from twitter.util.redis_util import (
+    ID_INDEX_KEYS, REDIS_HOSTNAME, REDIS_PORT, _iter_chunks
+)
+
+
+INDEXED_MODELS = {
+    'profile': (TwitterProfile, 'user_id'),
+}
+CHUNK_SIZE = 10000
+
+
+def _get_redis_cli(redis_cli):
+    return redis_cli or redis.Redis(host=REDIS_HOSTNAME, port=REDIS_PORT)
+
+
+def _iter_db_rows(kind, chunk_size):
+    """ (api_id, pk) rows, the lowest pk comes last, so it wins if an api id has several rows """
+    ModelClass, key_field = INDEXED_MODELS[kind]
+    rows = ModelClass.objects.exclude(**{f"{key_field}__isnull": True}).exclude(
+        **{key_field: ''}
+    ).order_by('-id').values_list(key_field, 'id')
+    return rows.iterator(chunk_size=chunk_size)
+
+
+def rebuild_id_index(redis_cli, kind, chunk_size=CHUNK_SIZE, on_progress=None):
+    """ writes the index to a temporary key, then swaps it in, returns the number of entries """
+    redis_cli = _get_redis_cli(redis_cli)
+    index_key = ID_INDEX_KEYS[kind]
+    tmp_key = f"{index_key}:rebuild"
+    redis_cli.delete(tmp_key)
+
+    num_entries = 0
+    for chunk in _iter_chunks(_iter_db_rows(kind, chunk_size), chunk_size):
+        redis_cli.hset(tmp_key, mapping=dict(chunk))
+        num_entries += len(chunk)
+        if on_progress:
+            on_progress(num_entries)
+
+    if num_entries:
+        redis_cli.rename(tmp_key, index_key)
+    else:
+        redis_cli.delete(index_key)
+    return num_entries
+
+
+def _find_stale(kind, entries):
+    """ entries is a list of (api_id, pk) from the index """
+    ModelClass, key_field = INDEXED_MODELS[kind]
+    api_ids_by_pk = dict(ModelClass.objects.filter(
+        id__in=[pk for _, pk in entries]
+    ).values_list('id', key_field))
+    return [(api_id, pk) for api_id, pk in entries if api_ids_by_pk.get(pk) != api_id]
+
+
+def check_id_index(redis_cli, kind, chunk_size=CHUNK_SIZE, fix=False):
+    """
+    Compares the index with postgres, returns (num_entries, stale, missing): stale
+    entries point to a row that doesn't exist or has another api id, missing rows
+    have no entry. With fix=True stale entries are removed and missing ones added.
+    """
+    redis_cli = _get_redis_cli(redis_cli)
+    index_key = ID_INDEX_KEYS[kind]
+
+    num_entries, stale = 0, []
+    entries = (
+        (api_id.decode(), int(pk)) for api_id, pk in redis_cli.hscan_iter(index_key, count=chunk_size)
+    )
+    for chunk in _iter_chunks(entries, chunk_size):
+        num_entries += len(chunk)
+        stale.extend(_find_stale(kind, chunk))
+
+    missing = []
+    for chunk in _iter_chunks(_iter_db_rows(kind, chunk_size), chunk_size):
+        pks = redis_cli.hmget(index_key, [api_id for api_id, _ in chunk])
+        missing.extend([row for row, pk in zip(chunk, pks) if pk is None])
+
+    if fix:
+        for chunk in _iter_chunks(stale, chunk_size):
+            redis_cli.hdel(index_key, *[api_id for api_id, _ in chunk])
+        for chunk in _iter_chunks(missing, chunk_size):
+            redis_cli.hset(index_key, mapping=dict(chunk))
+
+    return num_entries, stale, missing
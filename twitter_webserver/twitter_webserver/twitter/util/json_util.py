@@ -0,0 +1,58 @@
+'''
+JSON encoding/decoding for stored tweet/user json and request bodies.
+
+Uses orjson when it's installed, otherwise the standard library. JSON_BACKEND=json
+forces the standard library. orjson writes compact json (no spaces after separators)
+and only encodes 64-bit integers and str keys, anything it rejects is retried with
+the standard library, it decodes larger integers as floats (twitter ids are 64-bit).
+
+note: keep in sync with the scraper's util/json_util.py
+'''
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson' if orjson else 'json')
+
+
+def _loads__orjson(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return json.loads(data)
+
+
+def _dumps__orjson(obj):
+    """ returns a str, same as json.dumps() """
+    try:
+        return orjson.dumps(obj).decode()
+    except TypeError:
+        return json.dumps(obj)
+
+
+if JSON_BACKEND == 'orjson':
+    loads, dumps = _loads__orjson, _dumps__orjson
+else:
+    loads, dumps = json.loads, json.dumps
+
+
+def get_cached_json(obj, field_name):
+    """
+    The parsed value of a json text field, each model instance parses its value at most
+    once. It's parsed again if the field is assigned a different value (e.g. by
+    refresh_from_db), returns None if the field is empty.
+    """
+    value = getattr(obj, field_name)
+    if not value:
+        return None
+
+    cache = obj.__dict__.setdefault('_json_cache', {})
+    cached = cache.get(field_name)
+    if cached is None or cached[0] is not value:
+        cached = cache[field_name] = (value, loads(value))
+    return cached[1]
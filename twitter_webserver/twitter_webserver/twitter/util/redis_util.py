@@ -2,7 +2,6 @@ import json
 import logging
 import os
 
-import msgpack
 from msgpack import dumps as m_dumps
 import redis
 
@@ -17,6 +16,47 @@ REDIS_STREAM = 'twitter-items3'
 REDIS_HOSTNAME = os.environ.get('REDIS_HOSTNAME', 'localhost')
 REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
 
+# 'v1': one field per value, each value msgpack'd separately
+# 'v2': a single field, named after the version, holding the whole msgpack'd dict
+# note: keep in sync with the scraper's util/redis_util.py, which decodes both formats
+STREAM_WIRE_FORMAT = os.environ.get('STREAM_WIRE_FORMAT', 'v1')
+WIRE_FORMAT_V2_FIELD = 'v2'
+
+SCHEDULE_CHUNK_SIZE = 1000  # items per pipeline, profiles are read from the db in chunks of this size
+
+# an item is only added to the stream if no other item for the same (work_type, entity) is
+# queued, the scraper deletes an item's dedup key when it acks it. The ttl only matters if
+# that never happens (e.g. the line was trimmed or dead-lettered), roughly the scrape cadence
+DEDUP_KEY_PREFIX = 'twitter-dedup'
+DEDUP_TTLS = {
+    'user_info': 6 * 60 * 60,
+    'user_timeline': 24 * 60 * 60,
+    'user_likes': 24 * 60 * 60,
+    'friend_ids': 3 * 24 * 60 * 60,
+    'follower_ids': 3 * 24 * 60 * 60,
+    'conversation_tweets': 24 * 60 * 60,
+}
+DEFAULT_DEDUP_TTL = 24 * 60 * 60
+
+# scraper actors cache profile/tweet pks by api id, and clear their cache when this changes
+# note: keep in sync with the scraper's util/identity_cache.py
+IDENTITY_GENERATION_KEY = 'twitter-identity-generation'
+
+# pks by api id shared by all scraper actors, see: manage.py rebuild_id_index / check_id_index
+# note: keep in sync with the scraper's util/id_index.py
+ID_INDEX_KEYS = {
+    'profile': 'twitter-idx:profile',
+}
+
+# KEYS: stream, dedup key  ARGV: ttl, field1, value1, field2, value2...
+# returns the new line's id, or nil if the dedup key already existed
+XADD_IF_NEW_LUA = """
+if redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[1]) then
+    return redis.call('XADD', KEYS[1], '*', unpack(ARGV, 2))
+end
+return false
+"""
+
 '''
 def send_scrape_work__given_screen_names(
     redis_cli, screen_names, work_type, priority=2, flush=False
@@ -61,17 +101,17 @@ def _create_userinfo_item(profile_or_id, priority):
         item_dict['user_id'] = profile.user_id
         item_dict['screen_name'] = profile.screen_name
 
-    for key, val in item_dict.items():
-        try:
-            val = m_dumps(val)
-        except:
-            print(f"msgpack failed {profile.id} user_info")
-            return False, None
-        item_dict[key] = val
-
     return True, item_dict
 
 
+def _has_user_info(profile):
+    # note: querysets from TwitterProfileQuerySet.for_scheduling() defer the user_info
+    # blob and annotate has_user_info instead
+    if hasattr(profile, 'has_user_info'):
+        return profile.has_user_info
+    return profile.user_info is not None
+
+
 def _create_item(profile_or_id, work_type, priority):
 
     if type(profile_or_id) is str:
@@ -83,19 +123,17 @@ def _create_item(profile_or_id, work_type, priority):
         print(f"error: profile missing user_id, pk: {profile.id} {work_type}")
         return False, None
 
-    if profile.is_available is False or not profile.user_info:
+    if profile.is_available is False or not _has_user_info(profile):
         # private/deleted account, or missing user_info, skip these
         return False, None
 
-    if not profile.user_info:
-        return False, None
-
+    # note: only the fields workers use, has_user_info replaces the user_info blob
     item_dict = {
         'obj_id': profile.id,
         'user_id': profile.user_id,
         'work_type': work_type,
         'priority': priority,
-        'user_info': profile.user_info
+        'has_user_info': True
     }
 
     if work_type == 'user_timeline' and profile.user_timeline_since_id:
@@ -104,19 +142,70 @@ def _create_item(profile_or_id, work_type, priority):
     elif work_type == 'user_likes' and profile.user_likes_since_id:
         item_dict['since_id'] = profile.user_likes_since_id
 
-    for key, val in item_dict.items():
-        try:
-            val = m_dumps(val)
-        except:
-            print(f"msgpack failed {profile.id} {work_type}")
-            return False, None
-        item_dict[key] = val
-
     return True, item_dict
 
 
-def _chunker(seq, size):
-    return (seq[pos:pos + size] for pos in range(0, len(seq), size))
+def encode_item(item_dict, wire_format=None):
+    """ returns the stream entry's fields, or None if a value can't be serialized """
+    try:
+        if (wire_format or STREAM_WIRE_FORMAT) == 'v2':
+            return {WIRE_FORMAT_V2_FIELD: m_dumps(item_dict)}
+        return {key: m_dumps(val) for key, val in item_dict.items()}
+    except Exception as e:
+        print(f"msgpack failed {item_dict.get('obj_id')} {item_dict.get('work_type')}: {e}")
+        return None
+
+
+def _get_dedup_key(work_type, item_dict):
+    # note: user_id comes first so items created from an id string and from a profile object share a key
+    for field in ('conversation_id', 'user_id', 'screen_name', 'obj_id'):
+        val = item_dict.get(field)
+        if val:
+            return f"{DEDUP_KEY_PREFIX}:{work_type}:{str(val).lower()}"
+    return None
+
+
+def _xadd_items(redis_cli, items, work_type):
+    """ returns (num_sent, num_suppressed), items already queued for the same entity are suppressed """
+
+    xadd_if_new = redis_cli.register_script(XADD_IF_NEW_LUA)
+    ttl = DEDUP_TTLS.get(work_type, DEFAULT_DEDUP_TTL)
+
+    num_encoded = 0
+    with redis_cli.pipeline() as pipe:
+        for item_dict in items:
+            dedup_key = _get_dedup_key(work_type, item_dict)
+            if dedup_key is not None:
+                item_dict['dedup_key'] = dedup_key  # deleted by the scraper on ack
+            fields = encode_item(item_dict)
+            if fields is None:
+                continue
+            num_encoded += 1
+            if dedup_key is None:
+                pipe.xadd(REDIS_STREAM, fields)
+                continue
+            field_values = [v for field_value in fields.items() for v in field_value]
+            xadd_if_new(keys=[REDIS_STREAM, dedup_key], args=[ttl] + field_values, client=pipe)
+        results = pipe.execute()
+
+    num_suppressed = len([r for r in results if r is None])
+    return num_encoded - num_suppressed, num_suppressed
+
+
+def _xadd_flush(redis_cli, work_type):
+    redis_cli.xadd(REDIS_STREAM, encode_item({'flush_group': True, 'work_type': work_type}))
+
+
+def _iter_chunks(iterable, size):
+    # unlike slicing, this works with generators and queryset.iterator()
+    chunk = []
+    for obj in iterable:
+        chunk.append(obj)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 def send_scrape_work__conversation(
@@ -126,62 +215,68 @@ def send_scrape_work__conversation(
     if redis_cli is None:
         redis_cli = redis.Redis(host=REDIS_HOSTNAME, port=REDIS_PORT)
 
-    items = []
-    for id in conversation_ids:
-        items.append({
-            'conversation_id': m_dumps(id),
-            'work_type': m_dumps('conversation_tweets')
-        })
+    num_sent, num_suppressed = 0, 0
+    for chunk in _iter_chunks(conversation_ids, SCHEDULE_CHUNK_SIZE):
+        items = [{'conversation_id': id, 'work_type': 'conversation_tweets'} for id in chunk]
+        sent, suppressed = _xadd_items(redis_cli, items, 'conversation_tweets')
+        num_sent, num_suppressed = num_sent + sent, num_suppressed + suppressed
 
-    num_items = len(items)
     if flush:
-        items.append({
-            'flush_group': m_dumps(True),
-            'work_type': m_dumps('conversation_tweets')
-        })
-
-    with redis_cli.pipeline() as pipe:
-        pipe = redis_cli.pipeline()
-        for item_dict in items:
-            pipe.xadd(REDIS_STREAM, item_dict)
-        pipe.execute()
+        _xadd_flush(redis_cli, 'conversation_tweets')
 
-    return num_items
+    return num_sent, num_suppressed
 
 
 def send_scrape_work(
-    redis_cli, profiles, work_type, priority=2, flush=False
+    redis_cli, profiles, work_type, priority=2, flush=False, on_progress=None
 ):
-
+    """
+    profiles can be any iterable (e.g. queryset.iterator()), it's consumed and sent
+    SCHEDULE_CHUNK_SIZE items at a time. on_progress(num_sent, num_suppressed, num_skipped)
+    is called after each chunk. Returns (num_sent, num_suppressed)
+    """
     if redis_cli is None:
         redis_cli = redis.Redis(host=REDIS_HOSTNAME, port=REDIS_PORT)
 
-    items = []
-    for profile_or_id in profiles:
-        if work_type == 'user_info':
-            succ, item_dict = _create_userinfo_item(profile_or_id, priority)
-        else:
-            succ, item_dict = _create_item(profile_or_id, work_type, priority)
-        if succ:
-            items.append(item_dict)
-
-    if not items:
-        return
-
-    num_items = len(items)
-    if flush:
-        items.append({
-            'flush_group': m_dumps(True),
-            'work_type': m_dumps(work_type)
-        })
+    num_sent, num_suppressed, num_skipped = 0, 0, 0
+    for chunk in _iter_chunks(profiles, SCHEDULE_CHUNK_SIZE):
+        items = []
+        for profile_or_id in chunk:
+            if work_type == 'user_info':
+                succ, item_dict = _create_userinfo_item(profile_or_id, priority)
+            else:
+                succ, item_dict = _create_item(profile_or_id, work_type, priority)
+            if succ:
+                items.append(item_dict)
+            else:
+                num_skipped += 1
+
+        if items:
+            sent, suppressed = _xadd_items(redis_cli, items, work_type)
+            num_sent, num_suppressed = num_sent + sent, num_suppressed + suppressed
+        if on_progress:
+            on_progress(num_sent, num_suppressed, num_skipped)
+
+    if num_suppressed:
+        print(f"{work_type}: {num_suppressed} duplicate items suppressed, {num_sent} sent")
+    if flush and num_sent:
+        _xadd_flush(redis_cli, work_type)
+
+    return num_sent, num_suppressed
+
+
+def invalidate_identity_caches(redis_cli=None):
+    """ call after profiles are merged or removed, so scrapers don't use their old pks """
+    if redis_cli is None:
+        redis_cli = redis.Redis(host=REDIS_HOSTNAME, port=REDIS_PORT)
+    return redis_cli.incr(IDENTITY_GENERATION_KEY)
 
-    with redis_cli.pipeline() as pipe:
-        pipe = redis_cli.pipeline()
-        for item_dict in items:
-            pipe.xadd(REDIS_STREAM, item_dict)
-        pipe.execute()
-    '''
-    for item_dict in items:
-        redis_cli.xadd(REDIS_STREAM, item_dict)'''
 
-    return num_items
+def remove_from_id_index(redis_cli, kind, api_ids):
+    """ call after the rows are deleted, e.g. when merged profiles are removed """
+    api_ids = [api_id for api_id in api_ids if api_id]
+    if not api_ids:
+        return 0
+    if redis_cli is None:
+        redis_cli = redis.Redis(host=REDIS_HOSTNAME, port=REDIS_PORT)
+    return redis_cli.hdel(ID_INDEX_KEYS[kind], *api_ids)
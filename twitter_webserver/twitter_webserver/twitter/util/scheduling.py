@@ -0,0 +1,107 @@
+'''
+Schedules scrape work for the profiles with some tags, outside of the request/response cycle.
+
+Profiles are streamed from the db with a server-side cursor (queryset.iterator()) and sent
+to the stream in chunks (see: send_scrape_work), so memory use doesn't grow with the number of
+profiles. Progress is kept in a redis hash per job, e.g. twitter-schedule-jobs:<job_id>, which
+the webserver polls (see: schedule_job_progress__view).
+'''
+import threading
+import time
+import uuid
+
+from django.db import connection
+import redis
+
+from twitter.models import TwitterProfile
+from twitter.util.redis_util import REDIS_HOSTNAME, REDIS_PORT, send_scrape_work
+
+
+JOB_KEY_PREFIX = 'twitter-schedule-jobs'
+JOB_TTL = 24 * 60 * 60
+DB_CHUNK_SIZE = 2000
+
+
+def get_profiles_to_schedule(tag_slugs, work_type, only_due=True, limit=None):
+
+    profiles = TwitterProfile.objects.with_tags(tag_slugs)
+    if work_type != 'user_info':
+        profiles = profiles.schedulable()
+    if only_due:
+        profiles = profiles.due_for(work_type)
+
+    profiles = profiles.for_scheduling().order_by('id')
+    if limit is not None:
+        profiles = profiles[:limit]
+    return profiles
+
+
+def _get_job_key(job_id):
+    return f"{JOB_KEY_PREFIX}:{job_id}"
+
+
+def run_schedule_job(
+    job_id, tag_slugs, work_types, priority=2, only_due=True, limit=None,
+    flush=False, on_progress=None
+):
+    """ runs in the calling thread, returns {work_type: (num_sent, num_suppressed)} """
+    redis_cli = redis.Redis(host=REDIS_HOSTNAME, port=REDIS_PORT)
+    job_key = _get_job_key(job_id)
+
+    def _set_progress(**fields):
+        redis_cli.hset(job_key, mapping=fields)
+        redis_cli.expire(job_key, JOB_TTL)
+
+    _set_progress(status='running', work_types=','.join(work_types), started_at=time.time())
+
+    results = {}
+    try:
+        for work_type in work_types:
+
+            def _on_chunk(num_sent, num_suppressed, num_skipped):
+                _set_progress(**{
+                    f'{work_type}:sent': num_sent,
+                    f'{work_type}:suppressed': num_suppressed,
+                    f'{work_type}:skipped': num_skipped,
+                })
+                if on_progress:
+                    on_progress(work_type, num_sent, num_suppressed, num_skipped)
+
+            profiles = get_profiles_to_schedule(tag_slugs, work_type, only_due, limit)
+            results[work_type] = send_scrape_work(
+                redis_cli, profiles.iterator(chunk_size=DB_CHUNK_SIZE), work_type,
+                priority=priority, flush=flush, on_progress=_on_chunk
+            )
+    except Exception as e:
+        _set_progress(status='failed', error=str(e), finished_at=time.time())
+        raise
+
+    _set_progress(status='done', finished_at=time.time())
+    return results
+
+
+def _run_in_thread(*args, **kwargs):
+    try:
+        run_schedule_job(*args, **kwargs)
+    except Exception as e:
+        print(f"error: schedule job failed: {e}")
+    finally:
+        connection.close()  # the thread's own db connection
+
+
+def start_schedule_job(tag_slugs, work_types, **kwargs):
+    """ runs the job in a background thread, returns its job_id """
+    job_id = uuid.uuid4().hex[:16]
+    thread = threading.Thread(
+        target=_run_in_thread, args=(job_id, tag_slugs, work_types), kwargs=kwargs,
+        daemon=True
+    )
+    thread.start()
+    return job_id
+
+
+def fetch_job_progress(job_id, redis_cli=None):
+    if redis_cli is None:
+        redis_cli = redis.Redis(host=REDIS_HOSTNAME, port=REDIS_PORT)
+    progress = redis_cli.hgetall(_get_job_key(job_id))
+    return {k.decode(): v.decode() for k, v in progress.items()}
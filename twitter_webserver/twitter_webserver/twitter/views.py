@@ -1,17 +1,19 @@
 import datetime
-import json
+from functools import cached_property
 import logging
 import os
 import time
 
 from django.contrib import messages
 from django.core.exceptions import SuspiciousOperation
+from django.db.models import Count, Q
 from django.http import HttpResponseBadRequest, HttpResponse, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
 from django.views.decorators.http import require_http_methods
 from django.views.generic.edit import FormView
 
+import msgpack
 import redis
 from util_shared.datetime_utils import get_utc_now
 
@@ -34,7 +36,12 @@ from .models import (
     LikeRel
 )
 from twitter.util.ingestion import ingest_spreadsheet
-from twitter.util.redis_util import send_scrape_work, send_scrape_work__conversation
+from twitter.util.json_util import dumps as json_dumps, loads as json_loads
+from twitter.util.redis_util import (
+    invalidate_identity_caches, remove_from_id_index, send_scrape_work,
+    send_scrape_work__conversation
+)
+from twitter.util.scheduling import fetch_job_progress, start_schedule_job
 
 
 logger = logging.getLogger(__name__)
@@ -56,6 +63,9 @@ WORK_TYPES = [
     'conversation_tweets'
 ]
 
+# work types sent from SelectScrapeTasksView
+SCRAPE_WORK_TYPES = ['user_timeline', 'user_likes', 'friend_ids', 'follower_ids']
+
 PROFILE_RELATED_MODELS = [
     TwitterProfileTagRel,
     ProfileFollowsProfileRel,
@@ -70,7 +80,7 @@ PROFILE_RELATED_MODELS = [
 @require_http_methods(["POST"])
 def merge_profiles_view(request):
     try:
-        data = json.loads(request.body)
+        data = json_loads(request.body)
     except:
         return HttpResponseBadRequest('invalid request body, json parse failed')
 
@@ -89,8 +99,14 @@ def merge_profiles_view(request):
         to_remove = [tup[1] for tup in to_merge]
         for cls in PROFILE_RELATED_MODELS:
             cls.remove_profiles(to_remove)
+        removed_user_ids = list(TwitterProfile.objects.filter(
+            id__in=to_remove
+        ).values_list('user_id', flat=True))
         TwitterProfile.objects.filter(id__in=to_remove).delete()
+        # note: only once the delete is committed, else a concurrent ingest could publish the old pks again
+        remove_from_id_index(None, 'profile', removed_user_ids)
 
+    invalidate_identity_caches()
     return HttpResponse('ok')
 
 
@@ -126,15 +142,18 @@ class SendOneView(FormView):
 
         if work_type == 'conversation_tweets':
             conversation_ids = form.cleaned_data['conversation_ids']
-            items_sent = send_scrape_work__conversation(
+            items_sent, num_suppressed = send_scrape_work__conversation(
                 None, conversation_ids, priority=1, flush=True
             )
         else:
             profiles = form.cleaned_data['selected_profiles']
-            items_sent = send_scrape_work(
+            items_sent, num_suppressed = send_scrape_work(
                 None, profiles, work_type, priority=1, flush=True
             )
-        messages.success(self.request, f"{work_type} requested, sent: {items_sent} items")
+        messages.success(
+            self.request,
+            f"{work_type} requested, sent: {items_sent} items, {num_suppressed} already queued"
+        )
         return super().form_valid(form)
 
     def form_invalid(self, form):
@@ -154,12 +173,15 @@ class SelectTagsView(FormView):
     def form_valid(self, form):
         tag_slugs = form.cleaned_data['tag_slugs']
 
-        profiles = Tag.get_profiles_with_tags(tag_slugs)
-        if len(profiles) == 0:
+        counts = Tag.get_profiles_with_tags(tag_slugs).aggregate(
+            num_profiles=Count('id'),
+            num_userinfo_missing=Count('id', filter=Q(user_info__isnull=True))
+        )
+        if counts['num_profiles'] == 0:
             messages.error(self.request, f"no profiles found with tags: {tag_slugs}")
             return redirect('select-tags')
 
-        self.num_userinfo_missing = len([o for o in profiles if o.user_info is None])
+        self.num_userinfo_missing = counts['num_userinfo_missing']
         self.request.session['selected_tags'] = ','.join(tag_slugs)
         return super().form_valid(form)
 
@@ -191,7 +213,7 @@ def flush_group_view(request, work_type):
     redis_cli = redis.Redis(host=REDIS_HOSTNAME, port=REDIS_PORT)
     for wt in work_types:
         msg = {'work_type': wt, 'items': ['flush-group']}
-        redis_cli.lpush(SCRAPER_QUEUE_NAME, json.dump(msg))
+        redis_cli.lpush(SCRAPER_QUEUE_NAME, json_dumps(msg))
 
     messages.success(request, f'{work_type} group flushed')
 
@@ -207,6 +229,10 @@ def feed_view(request, screen_name_or_userid):
         profile = get_object_or_404(TwitterProfile, screen_name=screen_name)
 
     tweets = Tweet.objects.filter(author=profile, json_data__isnull=False).order_by('-publish_datetime')[:20]
+    tweets = list(tweets)
+    for tweet in tweets:
+        # note: shares one author instance, so its user_info is fetched and parsed once
+        tweet.author = profile
     context = {'tweets': tweets}
     return render(request, "twitter/twitter_feed.html", context)  # todo: change to not use base html file
 
@@ -219,8 +245,7 @@ class SelectUserInfoActionView(FormView):
     def get_form_kwargs(self):
         kwargs = super(SelectUserInfoActionView, self).get_form_kwargs()
 
-        profiles_with_ui, _ = self._get_profiles()
-        kwargs['num_with_user_info'] = len(profiles_with_ui)
+        kwargs['num_with_user_info'] = self.profile_counts['num_with_user_info']
 
         # kwargs['user'] = user = self.request.user
         # if 'initial' not in kwargs:
@@ -242,31 +267,33 @@ class SelectUserInfoActionView(FormView):
             return redirect('select-tags')
 
         if fetch_userinfo:
-            profiles = Tag.get_profiles_with_tags(tags.split(','), available_only=False)
-            num_items = send_scrape_work(
-                None, profiles, 'user_info', priority=1, flush=True
+            job_id = start_schedule_job(
+                tags.split(','), ['user_info'], priority=1, only_due=False, flush=True
             )
             time.sleep(1)  # delay the user a little so items get processed
-            messages.info(self.request, f"requested user-info for {len(profiles)} profiles")
+            # note: the job sends every profile with the tags, its progress page has the counts
+            progress_url = reverse('schedule-job-progress', args=[job_id])
+            messages.info(self.request, f"requesting user-info for the selected tags, progress: {progress_url}")
 
         return super().form_valid(form)
 
     def get_success_url(self):
         return reverse('select-scrape-tasks')
 
-    def _get_profiles(self):
+    @cached_property
+    def profile_counts(self):
+        # note: the view is instantiated per request, so this is one query per request
         tag_slugs_list = self.request.session['selected_tags'].split(',')
-        profiles = Tag.get_profiles_with_tags(tag_slugs_list)
-        profiles_no_ui = [p for p in profiles if p.user_info is None]
-        profiles_with_ui = [p for p in profiles if p.user_info is not None]
-        return profiles_with_ui, profiles_no_ui
+        return Tag.get_profiles_with_tags(tag_slugs_list).aggregate(
+            num_with_user_info=Count('id', filter=Q(user_info__isnull=False)),
+            num_without_user_info=Count('id', filter=Q(user_info__isnull=True))
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        profiles_with_ui, profiles_no_ui = self._get_profiles()
-        context['num_without_user_info'] = len(profiles_no_ui)
-        context['num_with_user_info'] = len(profiles_with_ui)
+        context['num_without_user_info'] = self.profile_counts['num_without_user_info']
+        context['num_with_user_info'] = self.profile_counts['num_with_user_info']
         context['tags_joined'] = self.request.session['selected_tags']
 
         return context
@@ -297,49 +324,48 @@ class SelectScrapeTasksView(FormView):
         '''
         form_data = form.cleaned_data
 
-        tag_slugs_list = self.request.session['selected_tags'].split(',')
-        profiles = Tag.get_profiles_with_tags(tag_slugs_list)
+        profiles = self.profiles.schedulable()
 
-        profiles = [p for p in profiles if p.user_info is not None]
-        profiles_no_ui = [p for p in profiles if p.user_info is None]
-        if profiles_no_ui:
-            print(f"warning: skipping {len(profiles_no_ui)} profiles without user-info")
+        num_no_ui = self.profiles.filter(user_info__isnull=True).count()
+        if num_no_ui:
+            print(f"warning: skipping {num_no_ui} profiles without user-info")
 
-        if not profiles:
+        if not profiles.exists():
             messages.error(self.request, 'no profiles with user-info found')
             return super(SelectScrapeTasksView, self).form_valid(form)
 
-        workload_keys = ['user_timeline', 'user_likes', 'friend_ids', 'follower_ids']
-
-        priority = int(form_data['priority'])
         limit = int(form_data['limit'])
-
-        for wt in workload_keys:
-            do_scrape = form_data[f'scrape_{wt}']
-            if not do_scrape:
-                continue
-
-            _profiles = profiles
-            _profiles = profiles[:limit]
-            if not _profiles:
-                continue   # limit was set to < 1
-
-            flush = form_data.get('flush_queues', False)
-            send_scrape_work(
-                None, _profiles, wt, priority=priority, flush=flush
+        work_types = [wt for wt in SCRAPE_WORK_TYPES if form_data[f'scrape_{wt}']]
+
+        if work_types and limit > 0:
+            # note: sent from a background thread, for large tags this can take minutes
+            job_id = start_schedule_job(
+                self.request.session['selected_tags'].split(','), work_types,
+                priority=int(form_data['priority']), only_due=form_data.get('only_due', False),
+                limit=limit, flush=form_data.get('flush_queues', False)
+            )
+            progress_url = reverse('schedule-job-progress', args=[job_id])
+            messages.success(
+                self.request,
+                f'profiles being sent for scrape, {num_no_ui} skipped, progress: {progress_url}'
             )
 
         self.request.session['selected_tags'] = None
-        messages.success(self.request, f'profiles sent for scrape, {len(profiles_no_ui)} skipped')
         return super(SelectScrapeTasksView, self).form_valid(form)
 
-    def get_form_kwargs(self):
-        kwargs = super(SelectScrapeTasksView, self).get_form_kwargs()
-
+    @cached_property
+    def profiles(self):
+        # note: the view is instantiated per request, so these are only built once per request
         tag_slugs_list = self.request.session['selected_tags'].split(',')
-        profiles = Tag.get_profiles_with_tags(tag_slugs_list)
-        kwargs['num_profiles'] = len(profiles)
+        return Tag.get_profiles_with_tags(tag_slugs_list)
 
+    @cached_property
+    def num_profiles(self):
+        return self.profiles.count()
+
+    def get_form_kwargs(self):
+        kwargs = super(SelectScrapeTasksView, self).get_form_kwargs()
+        kwargs['num_profiles'] = self.num_profiles
         return kwargs
 
     def get_success_url(self):
@@ -348,33 +374,38 @@ class SelectScrapeTasksView(FormView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        tag_slugs_list = self.request.session['selected_tags'].split(',')
-        profiles = Tag.get_profiles_with_tags(tag_slugs_list)
-        context['num_profiles'] = len(profiles)
+        context['num_profiles'] = self.num_profiles
+        context['num_due'] = self.profiles.count_due(SCRAPE_WORK_TYPES)
 
         return context
 
     def get(self, *args, **kwargs):
 
         tags_li = self.request.session['selected_tags'].split(',')
-        profiles = Tag.get_profiles_with_tags(tags_li)
 
-        if len(profiles) == 0:
+        if self.num_profiles == 0:
             messages.error(self.request, f'no profiles found for tags: {tags_li}')
             return redirect('select-tags')
 
         return super(SelectScrapeTasksView, self).get(*args, *kwargs)
 
 
+def schedule_job_progress__view(request, job_id):
+    progress = fetch_job_progress(job_id)
+    if not progress:
+        return JsonResponse({'error': f'job not found: {job_id}'}, status=404)
+    return JsonResponse(progress)
+
+
 def get_current_quota_periods__view(request, service_slug, endpoint_slug, account_slug):
 
     now = get_utc_now()
     quota_periods = ApiQuotaPeriod.objects.filter(
             service_slug=service_slug, endpoint_slug=endpoint_slug,
             account_slug=account_slug,
-            start_datetime__gte=now, end_datetime__lte=now
+            start_datetime__lte=now, end_datetime__gt=now
     )
     object_dicts = [obj.get_dict() for obj in quota_periods]
     return HttpResponse(
-        msgpack.dumps(object_dicts), content_type='application/msgpack'
+        msgpack.dumps(object_dicts, datetime=True), content_type='application/msgpack'
     )
@@ -19,7 +19,7 @@ from django.urls import path
 from twitter.views import (
     ImportProfilesView, SelectTagsView, SendOneView,
     SelectScrapeTasksView, SelectUserInfoActionView, flush_group_view,
-    merge_profiles_view, get_current_quota_periods__view
+    merge_profiles_view, get_current_quota_periods__view, schedule_job_progress__view
 )
 
 urlpatterns = [
@@ -31,6 +31,7 @@ urlpatterns = [
     path('select-userinfo-action/', SelectUserInfoActionView.as_view(), name='select-user-info-action'),
     path('flush-group/<str:work_type>', flush_group_view, name='flush-group'),
     path('select-scrape-tasks/', SelectScrapeTasksView.as_view(), name='select-scrape-tasks'),
+    path('schedule-jobs/<str:job_id>', schedule_job_progress__view, name='schedule-job-progress'),
 
     path('current-quota-periods/<str:service_slug>/<str:endpoint_slug>/<str:account_slug>', get_current_quota_periods__view),
 